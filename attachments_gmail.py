@@ -0,0 +1,216 @@
+import base64
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import constants
+
+_logger = logging.getLogger(__name__)
+
+
+class Attachment(object):
+    """
+        The metadata of an attachment of a message, from the payload of a
+        FULL `messages.get`. Its bytes are downloaded separately, through
+        `messages.attachments.get`.
+    """
+
+    __slots__ = (
+        "message_id",
+        "part_id",
+        "filename",
+        "mime_type",
+        "size",
+        "attachment_id",
+    )
+
+    def __init__(
+        self,
+        message_id: str,
+        part_id: str,
+        filename: str,
+        mime_type: str,
+        size: int,
+        attachment_id: str,
+    ):
+        self.message_id = message_id
+        self.part_id = part_id
+        self.filename = filename
+        self.mime_type = mime_type
+        self.size = size
+        self.attachment_id = attachment_id
+
+    def to_record(self) -> Dict[str, Any]:
+        """ Returns the metadata as a JSON serialisable dictionary.
+        """
+        return {
+            "message_id": self.message_id,
+            "part_id": self.part_id,
+            "filename": self.filename,
+            "mime_type": self.mime_type,
+            "size": self.size,
+        }
+
+
+def attachments_of(message: Dict[str, Any]) -> List[Attachment]:
+    """ Lists the attachments of a message, in the order of its parts.
+
+    Args:
+        message: A message object of the FULL format.
+
+    Returns:
+        The parts of the message with a filename whose body is stored apart
+        from the message.
+    """
+    attachments = []
+    parts = [message.get("payload", {})]
+    while parts:
+        part = parts.pop(0)
+        body = part.get("body", {})
+        if part.get("filename") and "attachmentId" in body:
+            attachments.append(
+                Attachment(
+                    message["id"],
+                    part.get("partId", ""),
+                    part["filename"],
+                    part.get("mimeType", "application/octet-stream"),
+                    body.get("size", 0),
+                    body["attachmentId"],
+                )
+            )
+        parts[0:0] = part.get("parts", [])
+    return attachments
+
+
+def iter_decoded(
+    data: str, chunk_size: int = constants.GMAIL_ATTACHMENT_CHUNK_BYTES
+) -> Iterator[bytes]:
+    """ Decodes URL safe base64 a chunk at a time, so the decoded bytes are
+        never held whole.
+
+    Args:
+        data: The base64 text, with or without padding.
+        chunk_size: The most bytes of each decoded chunk. Rounded down to a
+            multiple of 3, so chunks split on whole base64 quanta.
+
+    Returns:
+        An iterator of the decoded chunks.
+    """
+    step = max(chunk_size // 3, 1) * 4
+    for start in range(0, len(data), step):
+        chunk = data[start : start + step]
+        yield base64.urlsafe_b64decode(chunk + "=" * (-len(chunk) % 4))
+
+
+class AttachmentStore(object):
+    """
+        A content-addressed directory of attachment files, each named by the
+        SHA-256 of its bytes, so an attachment shared by many messages is
+        stored once.
+
+        Files are written to a temporary file while being hashed, and only
+        moved under their hash once complete, so a stored file is never
+        partial. Safe to share between threads.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The directory of the files, created on first write.
+
+        Returns:
+             Constructor.
+        """
+        self.path = path
+
+    def path_of(self, digest: str) -> str:
+        """ Returns the path of the file with a SHA-256 hex digest. Files are
+            spread over subdirectories by the first two characters of their
+            digest, so no directory grows too large.
+        """
+        return os.path.join(self.path, digest[:2], digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return os.path.exists(self.path_of(digest))
+
+    def write(self, chunks: Iterable[bytes]) -> Tuple[str, int, bool]:
+        """ Streams a file into the store.
+
+        Args:
+            chunks: The bytes of the file, in order.
+
+        Returns:
+            A tuple of the SHA-256 hex digest of the file, its size, and
+            whether it was new to the store. If it was not, the copy just
+            written is discarded.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, temporary = tempfile.mkstemp(dir=self.path, suffix=".part")
+        try:
+            with open(fd, "wb") as f:
+                for chunk in chunks:
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = sha256.hexdigest()
+            path = self.path_of(digest)
+            if os.path.exists(path):
+                os.remove(temporary)
+                return digest, size, False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return digest, size, True
+
+    def save_as(self, digest: str, directory: str, filename: str) -> str:
+        """ Copies a stored file to a directory, under a filename, adding a
+            number to the name if a different file already has it.
+
+        The file is copied rather than linked, so editing the copy leaves the
+        stored file intact.
+
+        Args:
+            digest: The SHA-256 hex digest of the stored file.
+            directory: The directory to copy it to, created if necessary.
+            filename: The name to give it. Only its last path component is
+                used.
+
+        Returns:
+            The path of the copy.
+        """
+        os.makedirs(directory, exist_ok=True)
+        name, extension = os.path.splitext(
+            os.path.basename(filename) or digest
+        )
+        source = self.path_of(digest)
+        path = os.path.join(directory, name + extension)
+        number = 1
+        while os.path.exists(path):
+            if _same_contents(source, path):
+                return path
+            path = os.path.join(directory, f"{name} ({number}){extension}")
+            number += 1
+        shutil.copyfile(source, path)
+        return path
+
+
+def _same_contents(a: str, b: str) -> bool:
+    """ Checks if two files have the same bytes.
+    """
+    if os.path.getsize(a) != os.path.getsize(b):
+        return False
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while True:
+            chunk = fa.read(constants.GMAIL_ATTACHMENT_CHUNK_BYTES)
+            if chunk != fb.read(constants.GMAIL_ATTACHMENT_CHUNK_BYTES):
+                return False
+            if not chunk:
+                return True
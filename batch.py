@@ -0,0 +1,209 @@
+import asyncio
+import collections
+import json
+import logging
+import shlex
+import sys
+from typing import Any, AsyncIterator, Dict, Iterable, List, TextIO
+
+import constants
+from controller_main import MainController
+from prefetch import aread_ahead
+from profiling import tracer
+
+_logger = logging.getLogger(__name__)
+
+# Marks the end of a command's records on its queue.
+_DONE = object()
+
+
+async def _failing(error: Exception) -> AsyncIterator[Dict[str, Any]]:
+    """ Raises an error when iterated, for commands that could not be parsed.
+    """
+    raise error
+    # Makes this an asynchronous generator.
+    yield
+
+
+class _Command(object):
+    """ A command of a script, running as a task that queues its records
+        until they are written out.
+    """
+
+    def __init__(self, number: int, text: str, args: List[str]):
+        """
+        Args:
+            number: The line number of the command in the script.
+            text: The command as written in the script.
+            args: The parsed command.
+
+        Returns:
+             Constructor.
+        """
+        self.number = number
+        self.text = text
+        self.args = args
+        # Bounded, so a command waits while its records are not written,
+        # e.g. behind an earlier command or a slow reader.
+        self.records: asyncio.Queue = asyncio.Queue(
+            maxsize=constants.BATCH_MAX_QUEUED_RECORDS
+        )
+        self.error = None
+        self.task = None
+
+    def start(self, records: AsyncIterator[Dict[str, Any]]):
+        """ Starts queueing the records of the command.
+        """
+        self.task = asyncio.ensure_future(self._queue(records))
+
+    async def _queue(self, records: AsyncIterator[Dict[str, Any]]):
+        try:
+            with tracer.command(self.text):
+                async for record in records:
+                    await self.records.put(record)
+        except Exception as e:
+            self.error = e
+        finally:
+            await self.records.put(_DONE)
+
+
+class BatchRunner(object):
+    """
+        Runs a script of commands against one session, writing newline
+        delimited JSON instead of formatted text.
+
+        Each line of a script is a command as typed at the main prompt with
+        its service name first, e.g. `gmail list "is:unread" 20`, or `inbox`.
+        Blank lines and # comments are skipped.
+
+        Independent commands run concurrently, up to `concurrency` at once,
+        while their output is written in script order: a
+        {"line": n, "record": {...}} line per record, then
+        {"line": n, "command": text, "ok": bool} with an "error" if it
+        failed. Commands in BATCH_BARRIER_COMMANDS run alone.
+    """
+
+    def __init__(
+        self,
+        main: MainController,
+        out: TextIO = None,
+        concurrency: int = constants.BATCH_CONCURRENCY,
+    ):
+        """
+        Args:
+            main: The controller of the signed in services.
+            out: Where to write the records. Defaults to stdout.
+            concurrency: The maximum number of commands running at once.
+
+        Returns:
+             Constructor.
+        """
+        self.main = main
+        self.out = out or sys.stdout
+        self.concurrency = max(concurrency, 1)
+
+    async def run(self, lines: Iterable[str]) -> bool:
+        """ Runs every command of a script.
+
+        Args:
+            lines: The lines of the script, e.g. an open file.
+
+        Returns:
+            True if every command succeeded, False otherwise.
+        """
+        pending = collections.deque()
+        succeeded = True
+        numbered = aread_ahead(enumerate(lines, 1), depth=self.concurrency)
+        async for number, line in numbered:
+            try:
+                args = shlex.split(line, comments=True)
+                records = self._records(args)
+            except ValueError as e:
+                # Reported in order, like any other failed command.
+                args, records = [line], _failing(e)
+            if not args:
+                continue
+
+            command = _Command(number, line.strip(), args)
+            barrier = (
+                len(args) > 1
+                and args[1].lower() in constants.BATCH_BARRIER_COMMANDS
+            )
+            if barrier:
+                while pending:
+                    succeeded &= await self._write_command(pending.popleft())
+            command.start(records)
+            pending.append(command)
+
+            while pending and (
+                barrier
+                or len(pending) >= self.concurrency
+                or pending[0].task.done()
+            ):
+                succeeded &= await self._write_command(pending.popleft())
+
+        while pending:
+            succeeded &= await self._write_command(pending.popleft())
+        return succeeded
+
+    async def _records(self, args: List[str]) -> AsyncIterator[Dict]:
+        """ Runs a command, yielding its records.
+
+        Raises:
+            ValueError: If the command is invalid, or its service is not
+                signed in to.
+        """
+        if args[0].lower() == "inbox":
+            limit = (
+                constants.INBOX_DEFAULT_ITEM_COUNT
+                if len(args) < 2
+                else int(args[1])
+            )
+            items = self.main.inbox_items(limit)
+            count = 0
+            async for item in items:
+                yield item._asdict()
+                count += 1
+                if count == limit:
+                    break
+            await items.aclose()
+            return
+
+        controller = self.main.find_controller(args[0])
+        if controller is None:
+            raise ValueError(f"'{args[0]}' is not a valid service.")
+        if not controller.is_authenticated():
+            raise ValueError(f"Not signed in to {controller.get_name()}.")
+        if len(args) < 2:
+            raise ValueError(f"No command given for {controller.get_name()}.")
+        async for record in controller.records_async(args[1:]):
+            yield record
+
+    async def _write_command(self, command: _Command) -> bool:
+        """ Writes a command's records as they arrive, then its outcome.
+
+        Returns:
+            True if the command succeeded, False otherwise.
+        """
+        while True:
+            record = await command.records.get()
+            if record is _DONE:
+                break
+            self._write({"line": command.number, "record": record})
+        self._finish(command.number, command.text, command.error)
+        return command.error is None
+
+    def _finish(self, number: int, text: str, error: Exception = None):
+        """ Writes the outcome of a command.
+        """
+        outcome = {"line": number, "command": text, "ok": error is None}
+        if error is not None:
+            _logger.info(f"Line {number} failed. Error: {error}.")
+            outcome["error"] = str(error) or type(error).__name__
+        self._write(outcome)
+        self.out.flush()
+
+    def _write(self, record: Dict[str, Any]):
+        """ Writes a record as a line of JSON.
+        """
+        self.out.write(json.dumps(record, default=str) + "\n")
@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import io
+import json
+import tempfile
+import time
+from typing import Dict, List
+
+import constants
+
+# Run from the repository root with: python -m benchmarks.bench_batch
+
+
+def make_script(commands: int, size: int) -> List[str]:
+    """ Returns a script mixing listings, reads and inboxes.
+    """
+    from benchmarks.fake_gmail import FakeGmail
+
+    script = []
+    for i in range(commands):
+        script.append(
+            [
+                "gmail recent 10",
+                "gmail list 'is:unread' 5",
+                f"gmail read {FakeGmail.message_id(i % size)}",
+                "inbox 5",
+            ][i % 4]
+        )
+    return script
+
+
+def run_script(
+    script: List[str], root_url: str, cred_file: str, concurrency: int
+) -> Dict[str, float]:
+    """ Runs a script in batch mode against a fresh session.
+
+    Returns:
+        A dictionary with keys: seconds, commands, records and failed.
+    """
+    from batch import BatchRunner
+    from controller_gmail import GmailController
+    from controller_main import MainController
+    from handler_gmail import GmailHandler
+    from store_gmail import GmailStore
+
+    gmail = GmailHandler(
+        cred_file, store=GmailStore(":memory:"), root_url=root_url
+    )
+    main = MainController([GmailController(gmail)])
+    out = io.StringIO()
+    runner = BatchRunner(main, out=out, concurrency=concurrency)
+
+    start = time.perf_counter()
+    asyncio.run(runner.run(script))
+    seconds = time.perf_counter() - start
+    main.close_controllers()
+
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    return {
+        "seconds": seconds,
+        "commands": sum(1 for line in lines if "ok" in line),
+        "records": sum(1 for line in lines if "record" in line),
+        "failed": sum(1 for line in lines if line.get("ok") is False),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures batch mode throughput on a script of commands, "
+        "against a local fake Gmail server."
+    )
+    parser.add_argument("--commands", type=int, default=1000)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.02,
+        help="seconds the fake server delays each response by",
+    )
+    parser.add_argument(
+        "--quota",
+        type=float,
+        default=constants.GMAIL_QUOTA_UNITS_PER_SECOND,
+        help="Gmail quota units per second. Gmail's limit is 250, which "
+        "bounds the throughput of any script that is not latency bound",
+    )
+    arguments = parser.parse_args()
+    constants.GMAIL_QUOTA_UNITS_PER_SECOND = arguments.quota
+
+    from benchmarks.bench_startup import placeholder_credentials
+    from benchmarks.fake_gmail import FakeGmail
+
+    fake = FakeGmail(size=1000, latency=arguments.latency).start()
+    cred_file = placeholder_credentials(tempfile.mkdtemp())
+    script = make_script(arguments.commands, fake.size)
+
+    print(
+        f"{'concurrency':>11} | {'seconds':>7} | {'commands/s':>10} | "
+        f"{'records':>7} | {'requests':>8} | {'failed':>6}"
+    )
+    for concurrency in (1, constants.BATCH_CONCURRENCY):
+        before = fake.requests
+        result = run_script(script, fake.root_url, cred_file, concurrency)
+        print(
+            f"{concurrency:>11} | {result['seconds']:>7.2f} | "
+            f"{result['commands'] / result['seconds']:>10.1f} | "
+            f"{result['records']:>7} | {fake.requests - before:>8} | "
+            f"{result['failed']:>6}"
+        )
+    fake.stop()
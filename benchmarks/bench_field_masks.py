@@ -0,0 +1,121 @@
+import argparse
+import contextlib
+import io
+from typing import Callable, Dict, List, Tuple
+
+import constants
+
+# Run from the repository root with: python -m benchmarks.bench_field_masks
+
+
+def measure_commands(
+    make_handler: Callable[[], object],
+    commands: List[Tuple[str, Callable[[object], object]]],
+) -> Dict[str, Dict[bool, int]]:
+    """ Measures the response bytes of each command, with and without field
+        masks, using a fresh handler for each run so nothing is cached.
+
+    Args:
+        make_handler: Creates a handler with a `bytes_received` counter and a
+            `field_masks` switch.
+        commands: Pairs of a command name and a function running the command
+            against a handler.
+
+    Returns:
+        A dictionary of command name to a dictionary of field mask setting to
+        bytes received.
+    """
+    results = {name: {} for name, _ in commands}
+    for field_masks in (False, True):
+        handler = make_handler()
+        handler.field_masks = field_masks
+        for name, command in commands:
+            before = handler.bytes_received
+            with contextlib.redirect_stdout(io.StringIO()):
+                command(handler)
+            results[name][field_masks] = handler.bytes_received - before
+        handler.close()
+    return results
+
+
+def gmail_commands(cred_file: str):
+    """ Returns a handler factory and the commands to measure for Gmail.
+    """
+    from controller_gmail import GmailController
+    from handler_gmail import GmailHandler
+    from store_gmail import GmailStore
+
+    # Background prefetches would be counted against whichever command is
+    # running when they finish.
+    constants.GMAIL_PREFETCH_COUNT = 0
+
+    def make_handler():
+        return GmailHandler(cred_file, store=GmailStore(":memory:"))
+
+    def run(args):
+        return lambda gmail: GmailController(gmail).process_args(args)
+
+    def recent_then_read(gmail):
+        controller = GmailController(gmail)
+        controller.process_args(["recent", "1"])
+        controller.process_args(["read", "0"])
+
+    return make_handler, [
+        ("gmail recent 10", run(["recent", "10"])),
+        ("gmail list 'is:unread' 50", run(["list", "is:unread", "50"])),
+        ("gmail recent 1 + read 0", recent_then_read),
+    ]
+
+
+def facebook_commands(access_token: str):
+    """ Returns a handler factory and the commands to measure for Facebook.
+    """
+    from handler_facebook import FacebookHandler
+
+    def make_handler():
+        return FacebookHandler({"access_token": access_token})
+
+    return make_handler, [
+        (
+            "facebook user",
+            lambda facebook: facebook.get_current_user(force_query=True),
+        ),
+        (
+            "facebook events",
+            lambda facebook: facebook.get_paginated_data(
+                "/me/events",
+                limit=1,
+                fields=constants.FACEBOOK_EVENT_LIST_FIELDS,
+            ),
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the response bytes each command saves with "
+        "partial response field masks. Needs real credentials."
+    )
+    parser.add_argument("--gmail-credentials", help="oauth2client file")
+    parser.add_argument("--facebook-token", help="Graph API access token")
+    arguments = parser.parse_args()
+
+    services = []
+    if arguments.gmail_credentials:
+        services.append(gmail_commands(arguments.gmail_credentials))
+    if arguments.facebook_token:
+        services.append(facebook_commands(arguments.facebook_token))
+    if not services:
+        parser.error("Provide --gmail-credentials or --facebook-token.")
+
+    print(
+        f"{'command':<28} | {'full bytes':>10} | {'masked':>10} | "
+        f"{'saved':>6}"
+    )
+    for make_handler, commands in services:
+        for name, sizes in measure_commands(make_handler, commands).items():
+            full, masked = sizes[False], sizes[True]
+            saved = 100 * (full - masked) / full if full else 0
+            print(
+                f"{name:<28} | {full:>10} | {masked:>10} | {saved:>5.1f}%"
+            )
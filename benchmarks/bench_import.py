@@ -0,0 +1,122 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# Run from the repository root with: python -m benchmarks.bench_import
+
+# Modules that must only be imported once the user selects a service.
+SERVICE_DEPENDENCIES = (
+    "googleapiclient",
+    "oauth2client",
+    "html2text",
+    "facebook",
+    "requests_oauthlib",
+    "google",
+)
+
+_IMPORT_TIME = re.compile(r"import time:\s*(\d+) \|\s*(\d+) \|( *)(\S+)")
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(statement: str) -> Dict[str, int]:
+    """ Runs an import statement in a fresh interpreter with -X importtime.
+
+    Args:
+        statement: The statement to run, e.g. "import waddle".
+
+    Returns:
+        A dictionary of the modules imported directly by `statement` to their
+        cumulative import time in microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        # Top level imports are indented by the single separating space.
+        if match and len(match.group(3)) == 1:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def median_ms(statement: str, modules: List[str], repeat: int) -> float:
+    """ Returns the median time to import `modules` with `statement`, in
+        milliseconds.
+    """
+    totals = []
+    for _ in range(repeat):
+        times = import_times(statement)
+        totals.append(sum(times.get(m, 0) for m in modules) / 1000)
+    return statistics.median(totals)
+
+
+def loaded_service_dependencies(statement: str) -> List[str]:
+    """ Returns the service dependencies imported by a statement.
+    """
+    check = (
+        f"{statement}; import sys; "
+        f"print(' '.join(m for m in {SERVICE_DEPENDENCIES!r} "
+        f"if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check],
+        cwd=_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.split()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the cold import time of the CLI, and fails if "
+        "it exceeds a budget or imports a service's dependencies before the "
+        "service is selected."
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=50,
+        help="The longest `import waddle` may take",
+    )
+    arguments = parser.parse_args()
+
+    startup = median_ms("import waddle", ["waddle"], arguments.repeat)
+    services = ["controller_gmail", "controller_facebook"]
+    eager = median_ms(
+        "import controller_gmail, controller_facebook",
+        services,
+        arguments.repeat,
+    )
+
+    print(f"{'import':<38} | {'median ms':>9}")
+    print(f"{'waddle (services loaded lazily)':<38} | {startup:>9.1f}")
+    print(f"{'controller_gmail, controller_facebook':<38} | {eager:>9.1f}")
+
+    failures = []
+    if startup > arguments.budget_ms:
+        failures.append(
+            f"Importing waddle took {startup:.1f}ms, over the budget of "
+            f"{arguments.budget_ms:.0f}ms."
+        )
+    loaded = loaded_service_dependencies("import waddle")
+    if loaded:
+        failures.append(
+            f"Importing waddle imported service dependencies: "
+            f"{', '.join(loaded)}."
+        )
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,115 @@
+import argparse
+import base64
+import email
+import gc
+import os
+import time
+import tracemalloc
+from email.message import EmailMessage
+from typing import Callable, Dict
+
+import mime
+
+# Run from the repository root with: python -m benchmarks.bench_mime
+
+
+def synthetic_message(attachment_mb: int, html_kb: int) -> Dict[str, str]:
+    """ Builds a Gmail RAW message object with text and html bodies and an
+        attachment.
+
+    Args:
+        attachment_mb: The size of the attachment, in megabytes.
+        html_kb: The size of the html body, in kilobytes.
+
+    Returns:
+        A message object with a `raw` key, as returned by the Gmail API.
+    """
+    message = EmailMessage()
+    message["From"] = "Sender <sender@example.com>"
+    message["To"] = "me@example.com"
+    message["Subject"] = "Synthetic message"
+    message["Date"] = "Mon, 1 Jan 2024 00:00:00 +0000"
+    paragraph = "<p>Lorem ipsum dolor sit amet, <b>consectetur</b>.</p>\n"
+    message.set_content("Lorem ipsum dolor sit amet.\n" * 100)
+    message.add_alternative(
+        paragraph * (html_kb * 1024 // len(paragraph)), subtype="html"
+    )
+    if attachment_mb:
+        message.add_attachment(
+            os.urandom(attachment_mb * 1024 * 1024),
+            maintype="application",
+            subtype="octet-stream",
+            filename="attachment.bin",
+        )
+    return {"raw": base64.urlsafe_b64encode(message.as_bytes()).decode()}
+
+
+def legacy_parse(message: Dict[str, str]) -> int:
+    """ The string based parsing `read_message` used before it parsed bytes.
+    """
+    msg_str = base64.urlsafe_b64decode(message["raw"].encode("ASCII"))
+    mime_msg = email.message_from_string(msg_str.decode())
+    length = 0
+    if mime_msg.is_multipart():
+        for payload in mime_msg.get_payload():
+            length += len(payload.get_payload(decode=False))
+    else:
+        length += len(mime_msg.get_payload(decode=False))
+    return length
+
+
+def bytes_parse(message: Dict[str, str]) -> int:
+    """ The lazy, bytes based parsing used by `print_message`.
+    """
+    raw = base64.urlsafe_b64decode(message["raw"])
+    part = mime.best_body_part(mime.parse_message(raw))
+    return len(part.get_text())
+
+
+def measure(parse: Callable[[Dict[str, str]], int], message, repeat: int):
+    """ Measures the best latency and the peak memory of a parse function.
+
+    Returns:
+        A tuple of (best seconds, peak traced megabytes).
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        parse(message)
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    parse(message)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / (1024 * 1024)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the latency and peak memory of parsing large "
+        "RAW Gmail messages as strings and as bytes."
+    )
+    parser.add_argument(
+        "--sizes",
+        default="0,1,5,25",
+        help="comma separated attachment sizes, in megabytes",
+    )
+    parser.add_argument("--html-kb", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+
+    print(
+        f"{'attachment':>10} | {'parser':>6} | {'best ms':>9} | "
+        f"{'peak MB':>8}"
+    )
+    for size in (int(s) for s in arguments.sizes.split(",")):
+        message = synthetic_message(size, arguments.html_kb)
+        for name, parse in (("string", legacy_parse), ("bytes", bytes_parse)):
+            seconds, peak = measure(parse, message, arguments.repeat)
+            print(
+                f"{size:>8}MB | {name:>6} | {seconds * 1000:>9.1f} | "
+                f"{peak:>8.1f}"
+            )
@@ -0,0 +1,100 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, List
+
+# Run from the repository root with: python -m benchmarks.bench_startup
+
+
+def time_runs(run: Callable[[], object], repeat: int) -> List[float]:
+    """ Times repeated runs of a function.
+
+    Returns:
+        The duration of each run, in milliseconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def placeholder_credentials(directory: str) -> str:
+    """ Writes credentials that are never used to authorize a request, which
+        is all building the client needs.
+
+    Returns:
+        The path of the credentials file.
+    """
+    from oauth2client.client import AccessTokenCredentials
+    from oauth2client.file import Storage
+
+    path = os.path.join(directory, "credentials.json")
+    Storage(path).put(AccessTokenCredentials("placeholder", "benchmark"))
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures how long authenticating with Gmail takes, i.e. "
+        "constructing a GmailHandler, and how long its first API call waits "
+        "for the client to be built."
+    )
+    parser.add_argument("--credentials", help="oauth2client file")
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+
+    from apiclient.discovery import build
+    from discovery_cache import DiscoveryCache, build_service
+    from handler_gmail import GmailHandler
+    from store_gmail import GmailStore
+
+    directory = tempfile.mkdtemp()
+    cred_file = arguments.credentials or placeholder_credentials(directory)
+    cache = DiscoveryCache(os.path.join(directory, "discovery"))
+
+    def construct():
+        return GmailHandler(cred_file, store=GmailStore(":memory:"))
+
+    handler = construct()
+    # Fills the cache, from the network if possible.
+    build_service("gmail", "v1", handler.cred, cache=cache)
+
+    runs = [
+        (
+            "before: download document",
+            lambda: build(
+                "gmail",
+                "v1",
+                credentials=handler.cred,
+                cache_discovery=False,
+                static_discovery=False,
+            ),
+        ),
+        (
+            "before: bundled document",
+            lambda: build(
+                "gmail", "v1", credentials=handler.cred, static_discovery=True
+            ),
+        ),
+        ("after: authenticate", construct),
+        (
+            "after: first call, cached",
+            lambda: build_service("gmail", "v1", handler.cred, cache=cache),
+        ),
+    ]
+
+    print(f"{'step':<28} | {'median ms':>9} | {'max ms':>9}")
+    for name, run in runs:
+        try:
+            durations = time_runs(run, arguments.repeat)
+        except Exception as e:
+            print(f"{name:<28} | failed: {e}")
+            continue
+        print(
+            f"{name:<28} | {statistics.median(durations):>9.1f} | "
+            f"{max(durations):>9.1f}"
+        )
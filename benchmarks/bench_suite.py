@@ -0,0 +1,419 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+import constants
+
+# Run from the repository root with: python -m benchmarks.bench_suite
+#
+# Each scenario runs in a fresh process against local fake Gmail and Graph
+# servers, so its peak RSS is its own and no network or credentials are
+# needed. Results are written as JSON, and --compare prints the change
+# from an earlier run.
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _gmail(options: Dict[str, Any]):
+    from handler_gmail import GmailHandler
+    from store_gmail import GmailStore
+
+    return GmailHandler(
+        options["cred_file"],
+        store=GmailStore(":memory:"),
+        root_url=options["gmail_url"],
+    )
+
+
+def _facebook(options: Dict[str, Any]):
+    from handler_facebook import FacebookHandler
+    from http_cache import HttpCache
+
+    return FacebookHandler(
+        {"access_token": "benchmark"},
+        root_url=options["graph_url"],
+        http_cache=HttpCache(":memory:"),
+    )
+
+
+def _gmail_query(options: Dict[str, Any]) -> Tuple[Callable, Callable]:
+    gmail = _gmail(options)
+    return (
+        lambda i: gmail.get_messages_from_query(
+            "", max_messages=options["messages"]
+        ),
+        gmail.close,
+    )
+
+
+def _gmail_read(options: Dict[str, Any]) -> Tuple[Callable, Callable]:
+    from benchmarks.fake_gmail import FakeGmail
+
+    gmail = _gmail(options)
+
+    def read(i: int):
+        message_id = FakeGmail.message_id(i % options["size"])
+        return gmail.read_message(gmail.get_message_from_id(message_id))
+
+    return read, gmail.close
+
+
+def _facebook_pages(options: Dict[str, Any]) -> Tuple[Callable, Callable]:
+    facebook = _facebook(options)
+    return (
+        lambda i: facebook.get_paginated_data(
+            "/me/feed", options["pages"], constants.FACEBOOK_FEED_FIELDS
+        ),
+        facebook.close,
+    )
+
+
+def _facebook_events(options: Dict[str, Any]) -> Tuple[Callable, Callable]:
+    facebook = _facebook(options)
+    return lambda i: facebook.get_events_by_type(), facebook.close
+
+
+def _gmail_recent(options: Dict[str, Any]) -> Tuple[Callable, Callable]:
+    from controller_gmail import GmailController
+
+    controller = GmailController(_gmail(options))
+    return (
+        lambda i: controller.process_args(
+            ["recent", str(options["messages"])]
+        ),
+        controller.close,
+    )
+
+
+def _gmail_list_read(options: Dict[str, Any]) -> Tuple[Callable, Callable]:
+    from controller_gmail import GmailController
+
+    controller = GmailController(_gmail(options))
+    controller.process_args(["recent", str(options["messages"])])
+    return (
+        lambda i: controller.process_args(
+            ["read", str(i % options["messages"])]
+        ),
+        controller.close,
+    )
+
+
+def _inbox(options: Dict[str, Any]) -> Tuple[Callable, Callable]:
+    from controller_facebook import FacebookController
+    from controller_gmail import GmailController
+    from controller_main import MainController
+
+    main = MainController(
+        [
+            GmailController(_gmail(options)),
+            FacebookController(_facebook(options)),
+        ]
+    )
+    return (
+        lambda i: asyncio.run(main.inbox(["inbox", "20"])),
+        main.close_controllers,
+    )
+
+
+# Scenario names to functions preparing a session, which return the
+# operation to time and a function closing the session. An operation is
+# called with its index.
+SCENARIOS = {
+    "gmail.get_messages_from_query": _gmail_query,
+    "gmail.read_message": _gmail_read,
+    "facebook.get_paginated_data": _facebook_pages,
+    "facebook.get_events_by_type": _facebook_events,
+    "gmail recent": _gmail_recent,
+    "gmail read": _gmail_list_read,
+    "inbox": _inbox,
+}
+
+
+def percentile(durations: List[float], p: int) -> float:
+    """ Returns the p-th percentile of durations, interpolated.
+    """
+    if len(durations) < 2:
+        return durations[0]
+    return statistics.quantiles(durations, n=100, method="inclusive")[p - 1]
+
+
+def peak_rss_mb() -> float:
+    """ Returns the peak resident set size of this process, in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _run_scenario(name: str, options: Dict[str, Any], connection):
+    """ Runs a scenario in a child process, messaging its parent once it is
+        warmed up, so the parent can count requests from then on, and then
+        with its results.
+    """
+    constants.GMAIL_QUOTA_UNITS_PER_SECOND = options["quota"]
+    if options["graph_version"]:
+        constants.FACEBOOK_API_VERSION = options["graph_version"]
+
+    with open(os.devnull, "w") as out, contextlib.redirect_stdout(out):
+        try:
+            operation, close = SCENARIOS[name](options)
+        except Exception as e:
+            connection.send({"skipped": f"{type(e).__name__}: {e}"})
+            return
+        try:
+            # Builds clients and fills caches a first run depends on.
+            operation(-1)
+        except Exception as e:
+            close()
+            connection.send({"skipped": f"{type(e).__name__}: {e}"})
+            return
+        connection.send("warm")
+        connection.recv()
+
+        durations = []
+        errors = 0
+        for i in range(options["operations"]):
+            start = time.perf_counter()
+            try:
+                operation(i)
+            except Exception:
+                errors += 1
+            durations.append((time.perf_counter() - start) * 1000)
+        # Stops background work, e.g. prefetching, and the render workers.
+        close()
+
+    connection.send(
+        {
+            "operations": len(durations),
+            "p50_ms": percentile(durations, 50),
+            "p99_ms": percentile(durations, 99),
+            "mean_ms": statistics.mean(durations),
+            "errors": errors,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    )
+
+
+def run_scenario(name: str, options: Dict[str, Any], servers) -> Dict:
+    """ Runs a scenario in a fresh process.
+
+    Args:
+        name: A key of SCENARIOS.
+        options: The options of the suite, and the fake servers' URLs.
+        servers: The fake servers the scenario calls.
+
+    Returns:
+        The scenario's results. Keys: operations, p50_ms, p99_ms, mean_ms,
+            requests_per_operation, throttled, errors and peak_rss_mb, or
+            skipped if the scenario could not start.
+    """
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    process = context.Process(
+        target=_run_scenario, args=(name, options, child)
+    )
+    process.start()
+    try:
+        message = parent.recv()
+        if message != "warm":
+            return message
+
+        requests = sum(s.requests for s in servers)
+        throttled = sum(s.throttled_requests for s in servers)
+        parent.send("go")
+        results = parent.recv()
+        results["requests_per_operation"] = (
+            sum(s.requests for s in servers) - requests
+        ) / results["operations"]
+        results["throttled"] = (
+            sum(s.throttled_requests for s in servers) - throttled
+        )
+        return results
+    except EOFError:
+        return {"skipped": "the scenario's process stopped."}
+    finally:
+        process.join()
+
+
+def compare(results: Dict, baseline: Dict):
+    """ Prints the change of every metric from an earlier run.
+    """
+    print(f"\nChange from the baseline run of {baseline['created']}:")
+    metrics = ("p50_ms", "p99_ms", "requests_per_operation", "peak_rss_mb")
+    print(f"{'scenario':<30} | " + " | ".join(f"{m:>22}" for m in metrics))
+    for name, scenario in results["scenarios"].items():
+        before = baseline["scenarios"].get(name, {})
+        if "skipped" in scenario or "skipped" in before or not before:
+            print(f"{name:<30} | not comparable")
+            continue
+        changes = []
+        for metric in metrics:
+            old, new = before[metric], scenario[metric]
+            change = (new - old) / old * 100 if old else 0.0
+            changes.append(f"{old:>8.1f} → {new:>8.1f} {change:>+4.0f}%")
+        print(f"{name:<30} | " + " | ".join(changes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs the handlers and controller commands against "
+        "local fake Gmail and Graph API servers, reporting latency "
+        "percentiles, requests per operation and peak RSS."
+    )
+    parser.add_argument("--operations", type=int, default=50)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="a scenario to run, repeatable. Defaults to every scenario",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.01,
+        help="seconds the fake servers delay each response by",
+    )
+    parser.add_argument(
+        "--size", type=int, default=1000, help="messages, posts and events"
+    )
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=50,
+        help="messages each Gmail listing asks for",
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        default=4,
+        help="pages each Graph API listing reads",
+    )
+    parser.add_argument(
+        "--gmail-page-size",
+        type=int,
+        default=500,
+        help="the most messages a page of messages.list holds",
+    )
+    parser.add_argument(
+        "--graph-page-size",
+        type=int,
+        default=25,
+        help="the results of a Graph API page without a limit",
+    )
+    parser.add_argument(
+        "--body-size",
+        type=int,
+        default=2000,
+        help="bytes in each message body and characters in each post",
+    )
+    parser.add_argument(
+        "--throttle-every",
+        type=int,
+        default=0,
+        help="answer every n-th call with a rate limit error",
+    )
+    parser.add_argument(
+        "--quota",
+        type=float,
+        default=constants.GMAIL_QUOTA_UNITS_PER_SECOND,
+        help="Gmail quota units per second",
+    )
+    parser.add_argument(
+        "--graph-version",
+        help="the Graph API version to ask for, if the installed "
+        "facebook-sdk does not support FACEBOOK_API_VERSION",
+    )
+    parser.add_argument(
+        "--output",
+        help="where to write the JSON results. Defaults to a timestamped "
+        "file in benchmarks/results",
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE", help="an earlier run's JSON results"
+    )
+    arguments = parser.parse_args()
+
+    from benchmarks.bench_startup import placeholder_credentials
+    from benchmarks.fake_gmail import FakeGmail
+    from benchmarks.fake_graph import FakeGraph
+
+    gmail = FakeGmail(
+        size=arguments.size,
+        latency=arguments.latency,
+        page_size=arguments.gmail_page_size,
+        body_size=arguments.body_size,
+        throttle_every=arguments.throttle_every,
+    ).start()
+    graph = FakeGraph(
+        size=arguments.size,
+        latency=arguments.latency,
+        page_size=arguments.graph_page_size,
+        message_size=arguments.body_size,
+        throttle_every=arguments.throttle_every,
+    ).start()
+    options = {
+        key: value
+        for key, value in vars(arguments).items()
+        if key not in ("scenario", "output", "compare")
+    }
+    options.update(
+        gmail_url=gmail.root_url,
+        graph_url=graph.root_url,
+        cred_file=placeholder_credentials(tempfile.mkdtemp()),
+    )
+
+    created = datetime.now(timezone.utc)
+    results = {
+        "created": created.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {
+            k: v
+            for k, v in options.items()
+            if k not in ("gmail_url", "graph_url", "cred_file")
+        },
+        "scenarios": {},
+    }
+    print(
+        f"{'scenario':<30} | {'p50 ms':>8} | {'p99 ms':>8} | "
+        f"{'requests/op':>11} | {'throttled':>9} | {'errors':>6} | "
+        f"{'peak RSS MB':>11}"
+    )
+    for name in arguments.scenario or SCENARIOS:
+        scenario = run_scenario(name, options, (gmail, graph))
+        results["scenarios"][name] = scenario
+        if "skipped" in scenario:
+            print(f"{name:<30} | skipped: {scenario['skipped']}")
+            continue
+        print(
+            f"{name:<30} | {scenario['p50_ms']:>8.1f} | "
+            f"{scenario['p99_ms']:>8.1f} | "
+            f"{scenario['requests_per_operation']:>11.2f} | "
+            f"{scenario['throttled']:>9} | {scenario['errors']:>6} | "
+            f"{scenario['peak_rss_mb']:>11.1f}"
+        )
+    gmail.stop()
+    graph.stop()
+
+    output = arguments.output or os.path.join(
+        RESULTS_DIR, f"{created:%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}.")
+
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            compare(results, json.load(f))
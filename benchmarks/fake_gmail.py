@@ -0,0 +1,251 @@
+import base64
+import json
+import re
+from typing import Dict, Tuple, Union
+from urllib.parse import urlparse
+
+from benchmarks.fake_server import FakeServer
+
+# An offline stand-in for the parts of the Gmail API waddle uses, so
+# benchmarks are repeatable and need no credentials.
+
+
+def raw_message(i: int, body_size: int = 0) -> bytes:
+    """ Returns the RFC 2822 bytes of the i-th message of the mailbox, its
+        body padded to at least `body_size` bytes.
+    """
+    body = f"<p>The body of <b>message {i}</b>.</p>"
+    # Padded with short lines, so parsers see realistic line lengths.
+    line = "<p>" + "x" * 70 + "</p>\r\n"
+    body += line * -(-max(body_size - len(body), 0) // len(line))
+    return (
+        f"From: Person {i} <person{i}@example.com>\r\n"
+        f"To: me@example.com\r\n"
+        f"Subject: Message {i}\r\n"
+        f"Date: Mon, 1 Jan 2024 00:00:00 +0000\r\n"
+        f"Content-Type: text/html; charset=utf-8\r\n"
+        f"\r\n"
+        f"{body}\r\n"
+    ).encode()
+
+
+class FakeGmail(FakeServer):
+    """
+        A local HTTP server answering Gmail API requests, including batches,
+        from a generated mailbox of `size` messages, newest first.
+
+        Every response is delayed by `latency` seconds, and every request,
+        including each call of a batch, is counted in `requests`. Throttled
+        calls are answered with a 429, as Gmail does.
+
+        Messages are not modified by messages.batchModify, but the ids it is
+        sent are counted in `modified`.
+
+        With an `attachment_size`, every message has two attachments: a logo
+        shared by every message, and a report of its own.
+    """
+
+    def __init__(
+        self,
+        size: int = 1000,
+        latency: float = 0.0,
+        page_size: int = 500,
+        body_size: int = 0,
+        throttle_every: int = 0,
+        attachment_size: int = 0,
+    ):
+        """
+        Args:
+            size: The number of messages in the mailbox.
+            latency: Seconds each HTTP response is delayed by.
+            page_size: The most messages a page of messages.list holds,
+                whatever maxResults asks for.
+            body_size: The least number of bytes in a message's body.
+            throttle_every: Answer every n-th call with a 429.
+            attachment_size: The bytes of each attachment. If 0, messages
+                have no attachments.
+
+        Returns:
+             Constructor.
+        """
+        super().__init__(latency, throttle_every)
+        self.size = size
+        self.page_size = page_size
+        self.body_size = body_size
+        self.attachment_size = attachment_size
+        self.modified = 0
+
+    def route(self, method: str, path: str, query: Dict) -> Tuple[int, Dict]:
+        """ Answers a single API call.
+
+        Returns:
+            A tuple of the HTTP status and the JSON response.
+        """
+        if re.fullmatch(r"/gmail/v1/users/me/messages/?", path):
+            start = int(query.get("pageToken", ["0"])[0])
+            size = min(
+                int(query.get("maxResults", ["100"])[0]), self.page_size
+            )
+            end = min(start + size, self.size)
+            page = {
+                "messages": [
+                    {"id": self.message_id(i), "threadId": f"t{i}"}
+                    for i in range(start, end)
+                ],
+                "resultSizeEstimate": self.size,
+            }
+            if end < self.size:
+                page["nextPageToken"] = str(end)
+            return 200, page
+
+        match = re.fullmatch(r"/gmail/v1/users/me/messages/m(\d+)", path)
+        if match and int(match.group(1)) < self.size:
+            return 200, self.message(
+                int(match.group(1)), query.get("format", ["full"])[0]
+            )
+
+        match = re.fullmatch(
+            r"/gmail/v1/users/me/messages/m(\d+)/attachments/(\w+)", path
+        )
+        if match and self.attachment_size:
+            data = self.attachment(int(match.group(1)), match.group(2))
+            if data is not None:
+                return 200, {
+                    "size": len(data),
+                    "data": base64.urlsafe_b64encode(data).decode(),
+                }
+
+        if path == "/gmail/v1/users/me/labels":
+            return 200, {
+                "labels": [
+                    {"id": "INBOX", "name": "INBOX"},
+                    {"id": "UNREAD", "name": "UNREAD"},
+                    {"id": "Label_1", "name": "Receipts"},
+                ]
+            }
+        if path == "/gmail/v1/users/me/profile":
+            return 200, {"emailAddress": "me@example.com", "historyId": "1"}
+        if path == "/gmail/v1/users/me/history":
+            return 200, {"history": [], "historyId": "1"}
+        if path == "/gmail/v1/users/me/messages/batchModify":
+            return 200, {}
+        return 404, {"error": {"code": 404, "message": f"No {path}."}}
+
+    def throttled(self) -> Tuple[int, Dict]:
+        return 429, {
+            "error": {
+                "code": 429,
+                "message": "Too many concurrent requests for user.",
+                "errors": [{"reason": "rateLimitExceeded"}],
+            }
+        }
+
+    @staticmethod
+    def message_id(i: int) -> str:
+        return f"m{i:06d}"
+
+    def message(self, i: int, form: str) -> Dict:
+        """ Returns the i-th message in a format of messages.get.
+        """
+        message = {
+            "id": self.message_id(i),
+            "threadId": f"t{i}",
+            "labelIds": ["INBOX"],
+            "snippet": f"The body of message {i}.",
+            "historyId": "1",
+            "internalDate": str(1700000000000 - i * 60000),
+        }
+        if form == "raw":
+            message["raw"] = base64.urlsafe_b64encode(
+                raw_message(i, self.body_size)
+            ).decode()
+        else:
+            message["payload"] = {
+                "headers": [
+                    {
+                        "name": "From",
+                        "value": f"Person {i} <person{i}@example.com>",
+                    },
+                    {"name": "Subject", "value": f"Message {i}"},
+                ]
+            }
+        if form == "full" and self.attachment_size:
+            message["payload"].update(
+                partId="",
+                mimeType="multipart/mixed",
+                parts=[
+                    {"partId": "0", "mimeType": "text/html", "filename": ""},
+                    self._attachment_part(i, "1", "logo.png", "image/png"),
+                    self._attachment_part(
+                        i, "2", f"report-{i}.pdf", "application/pdf"
+                    ),
+                ],
+            )
+        return message
+
+    def attachment(self, i: int, attachment_id: str) -> Union[None, bytes]:
+        """ Returns the bytes of an attachment of the i-th message, or None
+            if it has no attachment with that id.
+        """
+        if attachment_id == f"logo{i}":
+            seed = b"logo"
+        elif attachment_id == f"report{i}":
+            seed = f"report {i} ".encode()
+        else:
+            return None
+        return (seed * -(-self.attachment_size // len(seed)))[
+            : self.attachment_size
+        ]
+
+    def _attachment_part(
+        self, i: int, part_id: str, filename: str, mime_type: str
+    ) -> Dict:
+        # Gmail's attachment ids differ between messages, even for the same
+        # file.
+        name = "logo" if part_id == "1" else "report"
+        return {
+            "partId": part_id,
+            "mimeType": mime_type,
+            "filename": filename,
+            "body": {
+                "attachmentId": f"{name}{i}",
+                "size": self.attachment_size,
+            },
+        }
+
+    def post(self, path: str, content_type: str, body: bytes):
+        """ Answers a batch request, each of its calls in turn, or a
+            messages.batchModify call.
+        """
+        if urlparse(path).path == "/gmail/v1/users/me/messages/batchModify":
+            status, reply = self.call("POST", path)
+            if status != 200:
+                return status, "application/json", json.dumps(reply).encode()
+            with self._lock:
+                self.modified += len(json.loads(body)["ids"])
+            return 204, "application/json", b""
+
+        boundary = re.search(r'boundary="?([^";]+)', content_type).group(1)
+        parts = body.decode().split(f"--{boundary}")[1:-1]
+        replies = []
+        for part in parts:
+            content_id = re.search(r"Content-ID: <([^>]+)>", part)
+            target = re.search(r"GET (\S+) HTTP", part).group(1)
+            status, reply = self.call("GET", target)
+            reply = json.dumps(reply)
+            replies.append(
+                f"--batch\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id.group(1)}>\r\n"
+                f"\r\n"
+                f"HTTP/1.1 {status} OK\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(reply)}\r\n"
+                f"\r\n"
+                f"{reply}\r\n"
+            )
+        return (
+            200,
+            "multipart/mixed; boundary=batch",
+            ("".join(replies) + "--batch--\r\n").encode(),
+        )
@@ -0,0 +1,217 @@
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Tuple
+from urllib.parse import parse_qs, urlencode
+
+import facebook
+
+import constants
+from benchmarks.fake_server import FakeServer
+
+# An offline stand-in for the parts of the Facebook Graph API waddle uses.
+
+_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeGraph(FakeServer):
+    """
+        A local HTTP server answering Graph API requests from a generated
+        feed, event list and group list of `size` results each, newest
+        first, paginated with cursors.
+
+        Next links point at graph.facebook.com like the real API's, so
+        handlers must send them to `root_url` too. Throttled calls are
+        answered with Graph's application request limit error.
+
+        Batch requests are answered call by call, resolving references to
+        named calls, and each of their calls counts as a request.
+    """
+
+    def __init__(
+        self,
+        size: int = 1000,
+        latency: float = 0.0,
+        page_size: int = 25,
+        message_size: int = 0,
+        throttle_every: int = 0,
+    ):
+        """
+        Args:
+            size: The number of results of each paginated endpoint.
+            latency: Seconds each HTTP response is delayed by.
+            page_size: The number of results of a page when the request
+                does not set a limit.
+            message_size: The least number of characters in a post.
+            throttle_every: Answer every n-th call with a rate limit error.
+
+        Returns:
+             Constructor.
+        """
+        super().__init__(latency, throttle_every)
+        self.size = size
+        self.page_size = page_size
+        self.message_size = message_size
+
+    def route(self, method: str, path: str, query: Dict) -> Tuple[int, Dict]:
+        """ Answers a single API call.
+
+        Returns:
+            A tuple of the HTTP status and the JSON response.
+        """
+        # Both "/v3.3/me" and the unversioned "//me" reach the same node.
+        path = "/" + re.sub(r"^/*(v\d+\.\d+/)?", "", path)
+        fields = query.get("fields", [None])[0]
+
+        if path == "/me":
+            return 200, self._masked({"id": "1", "name": "Me"}, fields)
+        if path == "/" and "ids" in query:
+            nodes = {}
+            for id in query["ids"][0].split(","):
+                match = re.fullmatch(r"event(\d+)", id)
+                if match and int(match.group(1)) < self.size:
+                    nodes[id] = self._masked(
+                        self.event(int(match.group(1))), fields
+                    )
+            return 200, nodes
+
+        results = {
+            "/me/feed": self.feed_post,
+            "/me/events": self.event,
+            "/me/groups": self.group,
+        }.get(path)
+        if results is not None:
+            return 200, self._page(path, query, results, fields)
+
+        match = re.fullmatch(r"/event(\d+)", path)
+        if match and int(match.group(1)) < self.size:
+            return 200, self._masked(self.event(int(match.group(1))), fields)
+        return 404, {
+            "error": {
+                "message": f"Unknown path components: {path}",
+                "type": "OAuthException",
+                "code": 2500,
+            }
+        }
+
+    def post(self, path: str, content_type: str, body: bytes):
+        """ Answers a batch request, each of its calls in turn.
+        """
+        form = parse_qs(body.decode())
+        if "batch" not in form:
+            return super().post(path, content_type, body)
+
+        results: Dict[str, Any] = {}
+        replies = []
+        for call in json.loads(form["batch"][0]):
+            target = "/" + self._resolve(call["relative_url"], results)
+            status, reply = self.call(call.get("method", "GET"), target)
+            if "name" in call:
+                results[call["name"]] = reply
+                if status == 200 and call.get(
+                    "omit_response_on_success", True
+                ):
+                    replies.append(None)
+                    continue
+            replies.append(
+                {
+                    "code": status,
+                    "headers": [
+                        {"name": "Content-Type", "value": "application/json"}
+                    ],
+                    "body": json.dumps(reply),
+                }
+            )
+        return 200, "application/json", json.dumps(replies).encode()
+
+    @staticmethod
+    def _resolve(url: str, results: Dict[str, Any]) -> str:
+        """ Replaces JSONPath references to named calls' results in a URL,
+            e.g. "{result=events:$.data.*.id}", with the values they select,
+            comma separated.
+        """
+
+        def select(match) -> str:
+            values = [results.get(match.group(1))]
+            for key in match.group(2).split(".")[1:]:
+                selected = []
+                for value in values:
+                    if key == "*" and isinstance(value, list):
+                        selected.extend(value)
+                    elif isinstance(value, dict) and key in value:
+                        selected.append(value[key])
+                    elif isinstance(value, list) and key.isdigit():
+                        selected.extend(value[int(key):int(key) + 1])
+                values = selected
+            return ",".join(str(v) for v in values)
+
+        return re.sub(r"\{result=([^:}]+):(\$[^}]*)\}", select, url)
+
+    def throttled(self) -> Tuple[int, Dict]:
+        return 403, {
+            "error": {
+                "message": "(#4) Application request limit reached",
+                "type": "OAuthException",
+                "code": 4,
+            }
+        }
+
+    def feed_post(self, i: int) -> Dict:
+        message = f"Post number {i}."
+        message += " lorem" * -(-max(self.message_size - len(message), 0) // 6)
+        return {
+            "id": f"1_post{i}",
+            "message": message,
+            "created_time": self._time(i),
+            "from": {"id": f"{i}", "name": f"Friend {i}"},
+        }
+
+    def event(self, i: int) -> Dict:
+        return {
+            "id": f"event{i}",
+            "name": f"Event {i}",
+            "start_time": self._time(i),
+            "rsvp_status": "attending",
+            "description": f"The description of event {i}.",
+            "place": {"name": f"Place {i}"},
+        }
+
+    @staticmethod
+    def group(i: int) -> Dict:
+        return {"id": f"group{i}", "name": f"Group {i}"}
+
+    def _page(self, path: str, query: Dict, result, fields: str) -> Dict:
+        """ Returns a page of a paginated endpoint, with its cursors.
+        """
+        start = int(query.get("after", ["0"])[0])
+        limit = int(query.get("limit", [self.page_size])[0])
+        end = min(start + limit, self.size)
+        page = {
+            "data": [
+                self._masked(result(i), fields) for i in range(start, end)
+            ],
+            "paging": {"cursors": {"before": str(start), "after": str(end)}},
+        }
+        if end < self.size:
+            arguments = {k: v[0] for k, v in query.items()}
+            arguments.update(after=str(end), limit=str(limit))
+            page["paging"]["next"] = (
+                f"{facebook.FACEBOOK_GRAPH_URL}"
+                f"v{constants.FACEBOOK_API_VERSION}{path}?"
+                f"{urlencode(arguments)}"
+            )
+        return page
+
+    @staticmethod
+    def _masked(result: Dict, fields: str) -> Dict:
+        """ Applies a partial response field mask to a result.
+        """
+        if not fields:
+            return result
+        return {k: v for k, v in result.items() if k in fields.split(",")}
+
+    @staticmethod
+    def _time(i: int) -> str:
+        return (_EPOCH - timedelta(hours=i)).strftime(
+            constants.FACEBOOK_EVENT_DATETIME_FORMAT
+        )
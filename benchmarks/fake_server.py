@@ -0,0 +1,154 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# The parts of the offline API stand-ins the benchmarks share.
+
+
+class FakeServer(object):
+    """
+        A local HTTP server answering JSON API calls from `route`, which
+        subclasses implement.
+
+        Every response is delayed by `latency` seconds, and every call is
+        counted in `requests`. If `throttle_every` is set, every n-th call is
+        answered with the API's rate limit error from `throttled` instead.
+
+        GET responses carry an ETag, and a GET whose If-None-Match still
+        matches is answered with 304 Not Modified and no body.
+    """
+
+    def __init__(self, latency: float = 0.0, throttle_every: int = 0):
+        """
+        Args:
+            latency: Seconds each HTTP response is delayed by.
+            throttle_every: Answer every n-th call with a rate limit error.
+                0 never throttles.
+
+        Returns:
+             Constructor.
+        """
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.requests = 0
+        self.throttled_requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._request_handler()
+        )
+        self._server.daemon_threads = True
+
+    @property
+    def root_url(self) -> str:
+        """ The root URL the handler under test should call.
+        """
+        return f"http://127.0.0.1:{self._server.server_port}/"
+
+    def start(self) -> "FakeServer":
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def call(self, method: str, target: str) -> Tuple[int, Dict]:
+        """ Counts and answers a single API call, throttling it if it is due.
+
+        Args:
+            method: The HTTP method of the call.
+            target: The path and query of the call.
+
+        Returns:
+            A tuple of the HTTP status and the JSON response.
+        """
+        with self._lock:
+            self.requests += 1
+            throttle = (
+                self.throttle_every
+                and self.requests % self.throttle_every == 0
+            )
+            if throttle:
+                self.throttled_requests += 1
+        if throttle:
+            return self.throttled()
+
+        url = urlparse(target)
+        return self.route(method, url.path, parse_qs(url.query))
+
+    def route(self, method: str, path: str, query: Dict) -> Tuple[int, Dict]:
+        """ Answers an API call.
+
+        Returns:
+            A tuple of the HTTP status and the JSON response.
+        """
+        raise NotImplementedError()
+
+    def throttled(self) -> Tuple[int, Dict]:
+        """ Returns the API's answer to a call over its rate limit.
+        """
+        raise NotImplementedError()
+
+    def post(self, path: str, content_type: str, body: bytes):
+        """ Answers a POST request with a body. By default, a POST is
+            answered like any other call.
+
+        Returns:
+            A tuple of the HTTP status, the content type and the body.
+        """
+        status, reply = self.call("POST", path)
+        return status, "application/json", json.dumps(reply).encode()
+
+    def _request_handler(self):
+        """ Returns a request handler class answering from this server.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                status, reply = server.call("GET", self.path)
+                body = json.dumps(reply).encode()
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self._reply(status, "application/json", body, etag)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                time.sleep(server.latency)
+                self._reply(
+                    *server.post(
+                        self.path, self.headers.get("Content-Type", ""), body
+                    )
+                )
+
+            def _reply(
+                self,
+                status: int,
+                content_type: str,
+                body: bytes,
+                etag: str = None,
+            ):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,117 @@
+import collections
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+
+class LRUCache(object):
+    """
+        A thread safe, size bounded, least recently used cache. Entries that
+        have not been accessed for `idle_timeout` seconds expire.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        idle_timeout: float = None,
+        size_of: Callable[[Any], int] = None,
+    ):
+        """
+        Args:
+            max_size: The maximum total size of the cached values.
+            idle_timeout: Seconds after its last access that an entry expires.
+                If not set, entries only leave the cache when evicted.
+            size_of: Returns the size of a value. If not set, every value has
+                a size of 1, bounding the number of entries.
+
+        Returns:
+             Constructor.
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._size_of = size_of or (lambda value: 1)
+        # Maps keys to (value, size, last access), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Gets a value from the cache, marking it as recently used.
+
+        Args:
+            key: The key of the value.
+            default: Returned if the key is not cached.
+
+        Returns:
+            The cached value, or `default`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            value, size, _ = entry
+            self._entries[key] = (value, size, now)
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """ Adds a value to the cache, evicting the least recently used values
+            until it fits. Values larger than the cache are not added.
+
+        Args:
+            key: The key of the value.
+            value: The value to cache.
+        """
+        size = self._size_of(value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_size:
+                return
+
+            now = time.monotonic()
+            self._expire(now)
+            while self._size + size > self.max_size:
+                self._remove(next(iter(self._entries)))
+            self._entries[key] = (value, size, now)
+            self._size += size
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            self._expire(time.monotonic())
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        """ Removes every value from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key: Hashable):
+        """ Removes a key, if cached. Must be called with the lock held.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def _expire(self, now: float):
+        """ Removes idle entries. Must be called with the lock held.
+        """
+        if self.idle_timeout is None:
+            return
+        while self._entries:
+            key, (_, _, accessed) = next(iter(self._entries.items()))
+            if now - accessed < self.idle_timeout:
+                return
+            self._remove(key)
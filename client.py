@@ -0,0 +1,58 @@
+import json
+import socket
+import sys
+from typing import List, TextIO, Union
+
+import constants
+
+# Kept free of service imports, so one-shot commands start quickly.
+
+
+def is_daemon_running(
+    socket_path: str = constants.DAEMON_SOCKET_PATH,
+) -> bool:
+    """ Returns True if a daemon is listening on a socket.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(socket_path)
+    except OSError:
+        return False
+    return True
+
+
+def run_command(
+    args: List[str],
+    socket_path: str = constants.DAEMON_SOCKET_PATH,
+    out: TextIO = None,
+) -> Union[None, bool]:
+    """ Runs a command on the daemon, printing its output as it arrives.
+
+    Args:
+        args: The command, e.g. ["gmail", "recent", "20"].
+        socket_path: The socket the daemon listens on.
+        out: Where to print the output. Defaults to stdout.
+
+    Returns:
+        True if the command succeeded, False if it failed, or None if no
+        daemon is running.
+    """
+    out = out or sys.stdout
+    try:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        return None
+
+    with connection, connection.makefile("rb") as replies:
+        connection.sendall(json.dumps({"args": args}).encode() + b"\n")
+        for line in replies:
+            reply = json.loads(line)
+            if "output" in reply:
+                out.write(reply["output"])
+                out.flush()
+            if "ok" in reply:
+                return reply["ok"]
+    # The daemon stopped before the command finished.
+    return False
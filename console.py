@@ -0,0 +1,105 @@
+import asyncio
+import io
+import logging
+import signal
+import sys
+import threading
+from typing import Awaitable, TypeVar
+
+from exceptions import CommandInterruptedError
+
+_logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+async def read_line(prefix: str) -> str:
+    """ Prompts the user and reads a line from stdin without blocking the
+        event loop, so background tasks keep running while the user types.
+
+    On a terminal, stdin is watched by the event loop. Otherwise (e.g. piped
+    input, or event loops that cannot watch files) the line is read in a
+    daemon thread.
+
+    Args:
+        prefix: The prompt to print before reading.
+
+    Returns:
+        The line read, without its line ending.
+
+    Raises:
+        EOFError: If stdin was closed.
+    """
+    print(prefix, end="", flush=True)
+    loop = asyncio.get_running_loop()
+    line: asyncio.Future = loop.create_future()
+
+    def resolve(text: str):
+        if not line.done():
+            line.set_result(text)
+
+    try:
+        fd = sys.stdin.fileno()
+        # Buffered lines of piped input would never make the fd readable.
+        if not sys.stdin.isatty():
+            raise io.UnsupportedOperation("stdin is not a terminal")
+        loop.add_reader(fd, lambda: resolve(sys.stdin.readline()))
+    except (NotImplementedError, AttributeError, ValueError, OSError):
+        threading.Thread(
+            target=lambda: loop.call_soon_threadsafe(
+                resolve, sys.stdin.readline()
+            ),
+            daemon=True,
+        ).start()
+    else:
+        line.add_done_callback(lambda _: loop.remove_reader(fd))
+
+    text = await line
+    if not text:
+        raise EOFError()
+    return text.rstrip("\r\n")
+
+
+async def run_interruptibly(awaitable: Awaitable[T]) -> T:
+    """ Runs an awaitable as a task that Ctrl-C cancels, rather than
+        interrupting the whole program.
+
+    Event loops that cannot handle signals (e.g. on Windows) keep asyncio's
+    default handling, where Ctrl-C cancels the main task.
+
+    Args:
+        awaitable: The coroutine or future to run.
+
+    Returns:
+        The result of the awaitable.
+
+    Raises:
+        CommandInterruptedError: If the user pressed Ctrl-C before it
+            finished.
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(awaitable)
+    interrupted = False
+
+    def interrupt():
+        nonlocal interrupted
+        interrupted = True
+        task.cancel()
+
+    previous = signal.getsignal(signal.SIGINT)
+    try:
+        loop.add_signal_handler(signal.SIGINT, interrupt)
+    except (NotImplementedError, RuntimeError, ValueError):
+        return await task
+
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not interrupted:
+            raise
+        raise CommandInterruptedError()
+    finally:
+        loop.remove_signal_handler(signal.SIGINT)
+        # Restores e.g. asyncio.run's own handler.
+        if previous is not None:
+            signal.signal(signal.SIGINT, previous)
@@ -1,9 +1,22 @@
+import os
 from typing import Tuple
 from enum import Enum
 
 
 TERMINATION_COMMANDS: Tuple[str, ...] = ("quit", "exit")
 
+# Directory for local caches and stores.
+WADDLE_DATA_DIR = os.path.expanduser("~/.waddle")
+DISCOVERY_CACHE_DIR = os.path.join(WADDLE_DATA_DIR, "discovery")
+# Seconds a cached Google API discovery document is used before refreshing.
+DISCOVERY_CACHE_TTL = 7 * 24 * 60 * 60
+# Socket the daemon keeping signed in sessions alive listens on.
+DAEMON_SOCKET_PATH = os.path.join(WADDLE_DATA_DIR, "daemon.sock")
+# Directory --profile writes each session's profiles and trace to.
+PROFILE_DIR = os.path.join(WADDLE_DATA_DIR, "profiles")
+# Spans held for a session's trace. The oldest are dropped first.
+PROFILE_MAX_SPANS = 100000
+
 # Facebook constants
 FACEBOOK_CLIENT_ID = "1565657260242806"
 FACEBOOK_REDIRECT_URI = "https://www.facebook.com/connect/login_success.html"
@@ -39,12 +52,162 @@ FACEBOOK_EVENT_TYPES = [
     "not_replied"
 ]
 FACEBOOK_EVENT_LIST_COUNT = 10
+# Number of Graph API pages fetched ahead of the one being consumed.
+FACEBOOK_READ_AHEAD_PAGES = 2
+# Most calls the Graph API accepts in one batch request.
+FACEBOOK_BATCH_SIZE = 50
+# Partial response field masks of each view.
+FACEBOOK_USER_FIELDS = "id,name"
+FACEBOOK_EVENT_LIST_FIELDS = "id,name,start_time,rsvp_status"
+FACEBOOK_EVENT_DETAIL_FIELDS = (
+    "id,name,start_time,end_time,place,rsvp_status,description"
+)
+FACEBOOK_FEED_FIELDS = "id,message,story,created_time,from"
+FACEBOOK_GROUP_FIELDS = "id,name"
 FACEBOOK_EVENT_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
 FACEBOOK_EVENT_DISPLAY_FORMAT = "%c"
+# Local cache of Graph API responses, and the most bytes it holds.
+FACEBOOK_HTTP_CACHE_PATH = os.path.join(WADDLE_DATA_DIR, "facebook-http.db")
+FACEBOOK_HTTP_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Seconds a cached Graph API response is used without revalidating it, by
+# endpoint. Responses of other endpoints are revalidated on every request.
+FACEBOOK_HTTP_CACHE_TTLS = {
+    "GET /me": 60 * 60,
+    "GET /{id}": 5 * 60,
+    "GET /me/events": 60,
+    "GET /me/groups": 60 * 60,
+}
+# Graph API error codes of requests over a rate limit.
+FACEBOOK_RATE_LIMIT_CODES = (4, 17, 32, 613)
+
+# Inbox constants
+INBOX_DEFAULT_ITEM_COUNT = 20
+# Seconds to wait for a service's next items before leaving it out.
+INBOX_SERVICE_TIMEOUT = 10
+
+# Batch mode constants
+# Number of independent commands of a script that run at once.
+BATCH_CONCURRENCY = 8
+# Records of each command held until they are written out. Commands wait
+# beyond this.
+BATCH_MAX_QUEUED_RECORDS = 256
+# Commands that change state, so run alone, after every earlier command.
+BATCH_BARRIER_COMMANDS = (
+    "sync",
+    "archive",
+    "markread",
+    "label",
+    "export",
+)
+
+# Metrics constants
+# Request latencies up to this many seconds share a histogram's first bucket.
+METRICS_HISTOGRAM_MIN_SECONDS = 0.0001
+# Request latencies from this many seconds share a histogram's last bucket.
+METRICS_HISTOGRAM_MAX_SECONDS = 600
+
+# Html rendering constants
+HTML_RENDER_WORKERS = 2
+# Larger html is shown with its tags stripped instead of being rendered.
+HTML_RENDER_MAX_CHARS = 2 * 1024 * 1024
+# Seconds to wait for html to render before stripping its tags instead.
+HTML_RENDER_TIMEOUT = 5
+HTML_RENDER_CACHE_MAX_CHARS = 16 * 1024 * 1024
 
 # Gmail Constants
 GMAIL_DEFAULT_EMAIL_COUNT = 10
 GMAIL_RECENT_QUERY = "category:primary"
+# Headers requested for each message in a listing.
+GMAIL_LISTING_HEADERS = ["From", "Subject"]
+# Characters of a snippet kept for each listed email, the most a row shows.
+GMAIL_SUMMARY_SNIPPET_CHARS = 140
+# Partial response field masks, by API method (and format for gets).
+GMAIL_FIELD_MASKS = {
+    "getProfile": "historyId",
+    "history.list": "history(messagesDeleted/message/id,"
+    "labelsAdded/message/id,labelsRemoved/message/id),"
+    "historyId,nextPageToken",
+    "messages.get/metadata": "id,threadId,labelIds,snippet,historyId,"
+    "internalDate,payload/headers",
+    "messages.get/raw": "id,threadId,internalDate,raw",
+    # FULL messages are only fetched for their attachments, so bodies are
+    # left out, down to parts three levels deep.
+    "messages.get/full": "id,payload("
+    "partId,filename,mimeType,body(attachmentId,size),parts("
+    "partId,filename,mimeType,body(attachmentId,size),parts("
+    "partId,filename,mimeType,body(attachmentId,size),parts("
+    "partId,filename,mimeType,body(attachmentId,size))))",
+    "messages.list": "messages/id,nextPageToken",
+    "labels.list": "labels(id,name)",
+    "messages.attachments.get": "data",
+}
+# Must contain "gzip" for Google to compress responses.
+GMAIL_USER_AGENT = "vigilant-waddle (gzip)"
+# Text subtypes of an email's body to display, in order of preference.
+GMAIL_BODY_PREFERENCE = ("html", "plain")
+# Gmail rejects batches of more than 100 calls, and recommends no more than 50
+# to avoid being rate limited.
+GMAIL_BATCH_SIZE = 50
+# Number of message ids requested per `messages.list` page (Gmail allows 500).
+GMAIL_LIST_PAGE_SIZE = 100
+# Number of message batches fetched ahead of the one being printed.
+GMAIL_READ_AHEAD_BATCHES = 4
+# Gmail modifies up to 1000 messages per `messages.batchModify` call.
+GMAIL_MODIFY_CHUNK_SIZE = 1000
+# Message ids listed per page when modifying messages, the most Gmail allows.
+GMAIL_MODIFY_LIST_PAGE_SIZE = 500
+# batchModify calls queued or running at once.
+GMAIL_MODIFY_MAX_PENDING = 8
+# Message ids listed per page when exporting messages.
+GMAIL_EXPORT_LIST_PAGE_SIZE = 500
+# Message batches fetched ahead of the one being written by `export`.
+GMAIL_EXPORT_READ_AHEAD_BATCHES = 8
+# Bytes buffered before an export writes to its file.
+GMAIL_EXPORT_BUFFER_BYTES = 1024 * 1024
+# Content-addressed store of downloaded attachments.
+GMAIL_ATTACHMENT_DIR = os.path.join(WADDLE_DATA_DIR, "attachments")
+# Bytes of an attachment decoded and written at a time.
+GMAIL_ATTACHMENT_CHUNK_BYTES = 1024 * 1024
+GMAIL_STORE_PATH_FORMAT = os.path.join(WADDLE_DATA_DIR, "gmail-{account}.db")
+# Bytes of message payloads the local store holds before evicting those
+# fetched longest ago.
+GMAIL_STORE_MAX_BYTES = 512 * 1024 * 1024
+# Characters of each message body added to the local search index.
+GMAIL_SEARCH_BODY_MAX_CHARS = 20000
+# Number of emails `search` lists.
+GMAIL_SEARCH_RESULT_COUNT = 20
+# Seconds before the local store is re-synced when serving from it.
+GMAIL_SYNC_INTERVAL = 60
+# Concurrent requests made by the fetch engine.
+GMAIL_FETCH_WORKERS = 4
+# Gmail allows each user 250 quota units per second.
+GMAIL_QUOTA_UNITS_PER_SECOND = 250
+GMAIL_QUOTA_COSTS = {
+    "history.list": 2,
+    "getProfile": 1,
+    "messages.get": 5,
+    "messages.list": 5,
+    "messages.batchModify": 50,
+    "labels.list": 1,
+    "messages.attachments.get": 5,
+}
+GMAIL_MAX_RETRIES = 5
+# Seconds of the first backoff after being throttled, doubled on each retry.
+GMAIL_BACKOFF_BASE = 0.5
+GMAIL_MAX_BACKOFF = 32
+# Seconds after slowing down in which further throttling is not acted on.
+GMAIL_SLOWDOWN_INTERVAL = 1
+# The engine never slows below this fraction of the quota rate.
+GMAIL_MIN_RATE_FRACTION = 0.05
+# Units per second of rate recovered for each quota unit successfully spent.
+GMAIL_RATE_RECOVERY_PER_UNIT = 0.05
+# Seconds over which fetch throughput is measured.
+GMAIL_THROUGHPUT_WINDOW = 10
+# Number of messages at the top of a listing whose bodies are prefetched.
+GMAIL_PREFETCH_COUNT = 10
+GMAIL_BODY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Seconds a cached body is kept without being read.
+GMAIL_BODY_CACHE_IDLE_TIMEOUT = 10 * 60
 
 
 class GmailMessageFormat(Enum):
@@ -1,18 +1,26 @@
 from datetime import datetime
+import json
 import logging
-from typing import List, Union, Dict
+from typing import Any, AsyncIterator, Callable, List, Union, Dict
 import getpass
 
+from facebook import GraphAPIError
 from oauthlib.oauth2.rfc6749.errors import OAuth2Error
 
 from requests_oauthlib import OAuth2Session
 from requests_oauthlib.compliance_fixes import facebook_compliance_fix
 
-from exceptions import UserTerminationError, ServiceAuthenticationError
+from exceptions import (
+    ControllerCloseError,
+    ServiceAuthenticationError,
+    UserTerminationError,
+)
 import constants
 from exceptions import NotAuthenticatedError
 from controller_interface import ServiceController
 from handler_facebook import FacebookHandler
+from inbox import InboxItem
+from metrics import Metrics
 
 _logger = logging.getLogger(__name__)
 
@@ -33,21 +41,20 @@ class FacebookController(ServiceController):
             None.
         """
         self.facebook = facebook
+        self.datastore = {}
 
     def close(self) -> bool:
-        """ Performs all necessary operations to properly close the
-            service controller.
-
-            Returns:
-                True, if the controller was able to close itself down
-                properly, False otherwise.
-            Raises:
-                ControllerCloseError: if the controller cannot properly close.
+        """ Closes down the connection to Facebook.
+
+        Returns:
+             True if the controller was successfully closed, False otherwise.
+        Raises:
+            ControllerCloseError: if the Facebook connection fails to close
+                correctly.
         """
-        raise NotImplementedError(
-            f"{type(self)} has not defined a close method but it inherits"
-            f"from ServiceController."
-        )
+        if self.facebook is not None and not self.facebook.close():
+            raise ControllerCloseError()
+        return True
 
     def get_name(self) -> str:
         """ Returns the name of the service, shown to the user.
@@ -62,6 +69,51 @@ class FacebookController(ServiceController):
             "account."
         )
 
+    def get_metrics(self) -> Union[None, Metrics]:
+        return None if self.facebook is None else self.facebook.metrics
+
+    def is_authenticated(self) -> bool:
+        """ Returns True if the user has signed in to Facebook.
+        """
+        return self.facebook is not None
+
+    def authenticate_from_file(self, path: str) -> bool:
+        """ Authenticates with a saved OAuth token, without prompting the
+            user.
+
+        Args:
+            path: The path of a JSON file holding the token, including its
+                access_token.
+
+        Returns:
+            True upon successful authentication.
+        Raises:
+            ServiceAuthenticationError: If the token cannot be read or is not
+                valid.
+        """
+        try:
+            with open(path) as f:
+                facebook = FacebookHandler(json.load(f))
+            facebook.get_current_user(force_query=True)
+        except (OSError, ValueError, KeyError, NotAuthenticatedError) as e:
+            raise ServiceAuthenticationError(
+                f"Could not authenticate with the token in {path}. "
+                f"Error: {e}."
+            )
+        self._use_handler(facebook)
+        return True
+
+    def _use_handler(self, facebook: FacebookHandler):
+        """ Switches to the handler of a newly authenticated account, closing
+            the previous one, whose session and HTTP cache would otherwise
+            leak.
+        """
+        # The last listing belongs to the previous account.
+        self.datastore = {}
+        if self.facebook is not None:
+            self.facebook.close()
+        self.facebook = facebook
+
     def authenticate(self) -> bool:
         """ Allows the user to authenticate with the service.
 
@@ -113,7 +165,7 @@ class FacebookController(ServiceController):
                 authorization_response=redirect_response,
             )
 
-            self.facebook = FacebookHandler(token)
+            self._use_handler(FacebookHandler(token))
             self.facebook.get_current_user(force_query=True)
             return True
 
@@ -155,36 +207,212 @@ class FacebookController(ServiceController):
         """
 
         return {
-            "recent": self.recent,
-            "list": self.list,
-            "read": self.read,
-            "back": self.back,
+            "events": self.events,
+            "event": self.event,
+            "groups": self.groups,
+            "stats": self.stats,
         }.get(args[0], self.help)(args)
 
+    async def records_async(
+        self, args: List[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """ Runs a command for batch mode, yielding machine readable records
+            instead of printing.
+
+        `events [type]` yields the user's events, optionally of one of
+        FACEBOOK_EVENT_TYPES, and `feed` the posts in their feed.
+
+        Args:
+            args: A list of strings, such that args[0] is the command name.
+
+        Returns:
+            An asynchronous iterator of the Graph API's results.
+
+        Raises:
+            ValueError: If the command or its arguments are invalid.
+        """
+        if args[0] == "events":
+            endpoint = "/me/events"
+            if len(args) > 1:
+                if args[1] not in constants.FACEBOOK_EVENT_TYPES:
+                    raise ValueError(f"{args[1]} is not an event type.")
+                endpoint = f"/me/events?type={args[1]}"
+            fields = constants.FACEBOOK_EVENT_LIST_FIELDS
+        elif args[0] == "feed":
+            endpoint, fields = "/me/feed", constants.FACEBOOK_FEED_FIELDS
+        else:
+            raise ValueError(f"`{args[0]}` has no batch form.")
+
+        async for result in self.facebook.iter_paginated_data_async(
+            endpoint, 1, fields
+        ):
+            yield result
+
+    def inbox_streams(
+        self, limit: int
+    ) -> Dict[str, AsyncIterator[InboxItem]]:
+        """ Returns streams of the newest posts in the user's feed and of
+            their events, for the unified inbox.
+
+        Args:
+            limit: The maximum number of items each stream should yield.
+
+        Returns:
+            A dictionary of stream name to a stream of items, newest first.
+
+        Raises:
+            NotAuthenticatedError: If the user has not signed in to Facebook.
+        """
+        if self.facebook is None:
+            raise NotAuthenticatedError()
+        return {
+            "Facebook feed": self._inbox_items(
+                "/me/feed",
+                constants.FACEBOOK_FEED_FIELDS,
+                "created_time",
+                self._post_item,
+                limit,
+            ),
+            "Facebook events": self._inbox_items(
+                "/me/events",
+                constants.FACEBOOK_EVENT_LIST_FIELDS,
+                "start_time",
+                self._event_item,
+                limit,
+            ),
+        }
+
+    async def _inbox_items(
+        self,
+        endpoint: str,
+        fields: str,
+        time_field: str,
+        to_item: Callable[[Dict[str, str], float], InboxItem],
+        limit: int,
+    ) -> AsyncIterator[InboxItem]:
+        """ Fetches the first page of an endpoint in a background thread,
+            and streams its results as inbox items, newest first.
+
+        Args:
+            endpoint: The endpoint to query.
+            fields: The partial response field mask of the results.
+            time_field: The field holding the time of a result.
+            to_item: Creates an item from a result and its timestamp.
+            limit: The maximum number of items to stream.
+        """
+        items = []
+        async for result in self.facebook.iter_paginated_data_async(
+            endpoint, 1, fields
+        ):
+            try:
+                timestamp = datetime.strptime(
+                    result[time_field],
+                    constants.FACEBOOK_EVENT_DATETIME_FORMAT,
+                ).timestamp()
+            except (KeyError, ValueError) as e:
+                _logger.info(f"Skipping a result without a time. Error: {e}.")
+                continue
+            items.append(to_item(result, timestamp))
+
+        items.sort(key=lambda item: item.timestamp, reverse=True)
+        for item in items[:limit]:
+            yield item
+
+    @staticmethod
+    def _post_item(post: Dict[str, str], timestamp: float) -> InboxItem:
+        """ Summarises a post from the user's feed for the unified inbox.
+        """
+        return InboxItem(
+            timestamp=timestamp,
+            service="Facebook",
+            kind="post",
+            sender=post.get("from", {}).get("name", ""),
+            summary=post.get("message") or post.get("story", ""),
+            id=post["id"],
+        )
+
+    @staticmethod
+    def _event_item(event: Dict[str, str], timestamp: float) -> InboxItem:
+        """ Summarises one of the user's events for the unified inbox.
+        """
+        return InboxItem(
+            timestamp=timestamp,
+            service="Facebook",
+            kind="event",
+            sender="",
+            summary=f"{event.get('name', '')} "
+            f"({event.get('rsvp_status', 'no reply')})",
+            id=event["id"],
+        )
+
     def events(self, args: List[str]) -> bool:
-        """ Displays a list of events for the user.
+        """ Displays a list of events for the user. Events are printed as
+            their pages arrive, while the next pages are being requested.
 
         Args:
             args:
-              - [1]: The type of events to include.
+              - [1]: The type of events to include, one of
+                FACEBOOK_EVENT_TYPES, or "all" for the events of every type.
 
         Returns:
             True, if events could be retrieved and listed.
         """
-        if len(args) < 2 or args[1] not in constants.FACEBOOK_EVENT_TYPES:
+        endpoint = "/me/events"
+        if len(args) > 1 and args[1] == "all":
+            return self._all_events()
+        if len(args) > 1:
+            if args[1] not in constants.FACEBOOK_EVENT_TYPES:
+                print(
+                    f"  The event type must be one of "
+                    f"{', '.join(constants.FACEBOOK_EVENT_TYPES)}."
+                )
+                return False
             endpoint = f"/me/events?type={args[1]}"
-        else:
-            endpoint = f"/me/events"
 
-        events = self.facebook.get_paginated_data(endpoint, limit=constants.FACEBOOK_EVENT_LIST_COUNT)
-        print(
-            f" i |         Event         | "
-        )
-        for e, i in zip(events, range(len(e))):
-            if not self._event_print_line(e, i):
-                return False
+        events = []
+        self.datastore["events"] = events
+        self.datastore["event_details"] = False
+        print(f" i | {'Event':<23} | {'Start time':<24} | RSVP")
+        try:
+            for i, e in enumerate(
+                self.facebook.iter_paginated_data(
+                    endpoint,
+                    limit=constants.FACEBOOK_EVENT_LIST_COUNT,
+                    fields=constants.FACEBOOK_EVENT_LIST_FIELDS,
+                )
+            ):
+                events.append(e)
+                if not self._event_print_line(e, i):
+                    _logger.info(f"Could not list the event {e.get('id')}.")
+        except GraphAPIError as e:
+            print(f"  Could not list your events. Error: {e}.")
+            return False
+        return True
+
+    def _all_events(self) -> bool:
+        """ Displays the events of every type, fetched together with their
+            details in a single batch request.
+
+        Returns:
+            True, if events could be retrieved and listed.
+        """
+        try:
+            events_by_type = self.facebook.get_events_by_type()
+        except GraphAPIError as e:
+            print(f"  Could not list your events. Error: {e}.")
+            return False
 
-        self.datastore["events"] = e
+        events = []
+        self.datastore["events"] = events
+        self.datastore["event_details"] = True
+        for event_type, typed_events in events_by_type.items():
+            print(f"{event_type}:")
+            if not typed_events:
+                print("  No events.")
+            for e in typed_events:
+                if self._event_print_line(e, len(events)):
+                    events.append(e)
+        return True
 
     def _event_print_line(self, event_json: Dict[str, str], index: int) -> bool:
         """ Prints a single line detailing an event.
@@ -197,19 +425,18 @@ class FacebookController(ServiceController):
             True if the event JSON could be successfully parsed, False otherwise.
         """
         try:
-            name = event_json['name']
+            name = event_json["name"]
             name = name[:20] + "..." if len(name) > 23 else name
-
-            start_time = datetime.strptime(event_json["start_time"], constants.FACEBOOK_EVENT_DATETIME_FORMAT)
-            start_time = start_time.strftime(constants.FACEBOOK_EVENT_DISPLAY_FORMAT)
-            print(
-                f"{index} {name}  {start_time}  {event_json['rsvp_status']}"
-            )
-        except KeyError as e:
+            start_time = self._display_time(event_json["start_time"])
+        except (KeyError, ValueError):
             return False
+        print(
+            f"{index:>2} | {name:<23} | {start_time:<24} | "
+            f"{event_json.get('rsvp_status', '')}"
+        )
         return True
 
-    def _event_print_details(self, event_json: Dict[str, str]) -> bool:
+    def _event_print_details(self, event_json: Dict[str, Any]) -> bool:
         """ Prints the details of a single event to the user.
 
         Args:
@@ -218,18 +445,39 @@ class FacebookController(ServiceController):
         Returns:
             True if the event JSON could be successfully parsed, False otherwise.
         """
-        start_time = datetime.strptime(event_json["start_time"],
-                                       constants.FACEBOOK_EVENT_DATETIME_FORMAT).strftime(constants.FACEBOOK_EVENT_DISPLAY_FORMAT)
-        end_time =  datetime.strptime(event_json["end_time"],
-                                       constants.FACEBOOK_EVENT_DATETIME_FORMAT).strftime(constants.FACEBOOK_EVENT_DISPLAY_FORMAT)
+        try:
+            start_time = self._display_time(event_json["start_time"])
+            end_time = (
+                self._display_time(event_json["end_time"])
+                if "end_time" in event_json
+                else ""
+            )
+        except (KeyError, ValueError):
+            return False
 
-        print(f"Event:       {event_json['name']}")
+        place = event_json.get("place", {})
+        location = place.get("location", {})
+        address = ", ".join(
+            location[k] for k in ("street", "city", "country") if k in location
+        )
+        print(f"Event:       {event_json.get('name', '')}")
         print(f"Start Time:  {start_time}")
         print(f"End Time:    {end_time}")
-        print(f"Location:    {event_json['place']['name']}. {event_json['place']['street']} {event_json['place']['city']}, {event_json['place']['country']}")
-        print(f"RSVP:        {event_json['rsvp_status']}")
-        print(f"Description: {event_json['description']}")
+        print(
+            f"Location:    {place.get('name', '')}"
+            + (f". {address}" if address else "")
+        )
+        print(f"RSVP:        {event_json.get('rsvp_status', '')}")
+        print(f"Description: {event_json.get('description', '')}")
+        return True
 
+    @staticmethod
+    def _display_time(graph_time: str) -> str:
+        """ Formats a Graph API time for display.
+        """
+        return datetime.strptime(
+            graph_time, constants.FACEBOOK_EVENT_DATETIME_FORMAT
+        ).strftime(constants.FACEBOOK_EVENT_DISPLAY_FORMAT)
 
     def event(self, args: List[str]) -> bool:
         """ Displays details of a specific event.
@@ -241,22 +489,74 @@ class FacebookController(ServiceController):
         Returns:
             True if the event could be retrieved and displayed.
         """
-        if len(args) != 2:
+        if len(args) != 2 or not args[1].isdigit():
             print("  Please specify an event index.")
             return False
 
+        events = self.datastore.get("events", [])
         i = int(args[1])
-        if self.datastore.get("events") and i < len(self.datastore["events"]):
+        if i >= len(events):
             print(
-                f"Index {i} must be between 0 & {len(self.datastore['events'])}."
+                "  Please list your events with `events` first."
+                if not events
+                else f"  Index {i} must be between 0 & {len(events) - 1}."
             )
             return False
 
-        return self._event_print_details(self.datastore["events"][i])
+        if self.datastore.get("event_details"):
+            return self._event_print_details(events[i])
+        try:
+            details = self.facebook.get_node(
+                events[i]["id"], constants.FACEBOOK_EVENT_DETAIL_FIELDS
+            )
+        except GraphAPIError as e:
+            print(f"  Could not retrieve the event. Error: {e}.")
+            return False
+        return self._event_print_details(details)
 
     def groups(self, args: List[str]) -> bool:
-        """ Displays a list of groups 
+        """ Displays a list of the groups the user is a member of, printed as
+            their pages arrive.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself.
 
-        :param args:
-        :return:
-        """
\ No newline at end of file
+        Returns:
+            True, if the groups could be retrieved and listed.
+        """
+        print(f" i | Group")
+        try:
+            for i, group in enumerate(
+                self.facebook.iter_paginated_data(
+                    "/me/groups", fields=constants.FACEBOOK_GROUP_FIELDS
+                )
+            ):
+                print(f"{i:>2} | {group.get('name', group.get('id'))}")
+        except GraphAPIError as e:
+            print(f"  Could not list your groups. Error: {e}.")
+            return False
+        return True
+
+    def help(self, args: List[str]) -> bool:
+        """ Prints a help message outlining the capaiblities of the tool.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself.
+
+        Return:
+            True, if the use input was able to be processed, False otherwise.
+        """
+        print(
+            """
+Not a valid command. Commands:
+`events [type]`: Lists your events, optionally only those of [type], one of
+            attending, created, declined, maybe or not_replied.
+`events all`: Lists the events of every type, with their details.
+`event [int]`: Shows the details of the indexed [int] event from `events`.
+`groups`: Lists the groups you are a member of.
+`stats [reset]`: Shows request latencies, retries and cache hit ratios.
+            """
+        )
+        return True
@@ -1,10 +1,27 @@
+import asyncio
 import logging
-from typing import List
+import os
+import threading
+import time
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+    Union,
+)
 import getpass
 
 import google
+from apiclient.errors import HttpError
+from oauth2client.file import Storage
 
 import constants
+import mime
 from constants import GmailMessageFormat
 from exceptions import (
     ControllerCloseError,
@@ -12,13 +29,77 @@ from exceptions import (
     ServiceAuthenticationError,
     UserTerminationError,
 )
-from handler_gmail import GmailHandler
+from exporter_gmail import EmlWriter, MboxWriter, open_writer
+from fetcher_gmail import is_rate_limit_error
+from handler_gmail import GmailHandler, MessageSummary
+from inbox import InboxItem
 from controller_interface import ServiceController
+from metrics import Metrics
 
 
 _logger = logging.getLogger(__name__)
 
 
+def _recorded(
+    messages: Iterable[Dict[str, str]], record: List[MessageSummary]
+) -> Iterator[MessageSummary]:
+    """ Summarises messages as they are consumed, appending each summary to
+        `record`. Used to keep the messages of a streamed listing for `read`
+        and `back`, without keeping their message objects.
+
+    Args:
+        messages: METADATA message objects from the Gmail API.
+        record: The list to append the summaries to.
+
+    Returns:
+        An iterator over the summaries of `messages`.
+    """
+    for m in messages:
+        summary = MessageSummary.from_message(m)
+        record.append(summary)
+        yield summary
+
+
+def _message_record(message: Dict[str, Any]) -> Dict[str, Any]:
+    """ Summarises a METADATA message as a batch mode record.
+    """
+    headers = {h["name"]: h["value"] for h in message["payload"]["headers"]}
+    return {
+        "id": message["id"],
+        "threadId": message.get("threadId"),
+        "internalDate": int(message["internalDate"]),
+        "labelIds": message.get("labelIds", []),
+        "from": headers.get("From", ""),
+        "subject": headers.get("Subject", ""),
+        "snippet": message.get("snippet", ""),
+    }
+
+
+def _inbox_item(message: Dict[str, str]) -> InboxItem:
+    """ Summarises a METADATA message for the unified inbox.
+    """
+    headers = {h["name"]: h["value"] for h in message["payload"]["headers"]}
+    return InboxItem(
+        timestamp=int(message["internalDate"]) / 1000,
+        service="Gmail",
+        kind="email",
+        sender=headers.get("From", ""),
+        summary=headers.get("Subject") or message.get("snippet", ""),
+        id=message["id"],
+    )
+
+
+async def _recorded_async(
+    messages: AsyncIterable[Dict[str, str]], record: List[MessageSummary]
+) -> AsyncIterator[MessageSummary]:
+    """ Like `_recorded`, for asynchronous iterables.
+    """
+    async for m in messages:
+        summary = MessageSummary.from_message(m)
+        record.append(summary)
+        yield summary
+
+
 class GmailController(ServiceController):
     """ A controller for a user interacting with Gmail. Current
         commands include:
@@ -36,7 +117,9 @@ class GmailController(ServiceController):
             gmail: A gmail handler to directly interact with Gmail.
         """
         self.gmail = gmail
-        self.messages = []
+        # Summaries of the emails of the last listing, for `read` and `back`.
+        self.messages: List[MessageSummary] = []
+        self._prefetch: Union[None, threading.Event] = None
 
     def close(self) -> bool:
         """ Closes down the connection to Gmail.
@@ -47,7 +130,8 @@ class GmailController(ServiceController):
             ControllerCloseError: if the Gmail connection fails to close
                 correctly.
         """
-        if not self.gmail.close():
+        self._cancel_prefetch()
+        if self.gmail is not None and not self.gmail.close():
             raise ControllerCloseError()
         else:
             return True
@@ -78,10 +162,189 @@ class GmailController(ServiceController):
         return {
             "recent": self.recent,
             "list": self.list,
+            "search": self.search,
             "read": self.read,
+            "attachments": self.attachments,
             "back": self.back,
+            "sync": self.sync,
+            "archive": self.modify,
+            "markread": self.modify,
+            "label": self.modify,
+            "export": self.export,
+            "stats": self.stats,
         }.get(args[0], self.help)(args)
 
+    async def process_args_async(self, args: List[str]) -> bool:
+        """ Processes a set of arguments from the user on the event loop.
+
+        Listings stream from Gmail on the event loop, so they can be
+        cancelled part way. Other commands run in a worker thread.
+
+        Args:
+            args: A list of strings typed by the user.
+
+        Returns:
+            True, if the service controller successfully processed the args,
+            False otherwise.
+        """
+        parse = {"recent": self._recent_query, "list": self._list_query}.get(
+            args[0]
+        )
+        if parse is None:
+            return await super().process_args_async(args)
+
+        try:
+            query = parse(args)
+        except ValueError as e:
+            print(e)
+            return False
+        return await self._list_messages_async(*query)
+
+    async def records_async(
+        self, args: List[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """ Runs a command for batch mode, yielding machine readable records
+            instead of printing.
+
+        `recent`, `list` and `search` yield a record per email. `read` takes a
+        message id rather than an index, as batch commands run independently,
+        and yields the email, and `attachments` takes one too, yielding a
+        record per attachment. `sync` yields the number of changed messages,
+        and `archive`, `markread` and `label` the number of modified ones.
+        `export` yields the counts of its export.
+
+        Args:
+            args: A list of strings, such that args[0] is the command name.
+
+        Returns:
+            An asynchronous iterator of JSON serialisable records.
+
+        Raises:
+            ValueError: If the command or its arguments are invalid.
+        """
+        if args[0] in ("recent", "list"):
+            parse = (
+                self._recent_query if args[0] == "recent" else self._list_query
+            )
+            query, number = parse(args)
+            messages = self.gmail.iter_messages_from_query_async(
+                query,
+                max_messages=number,
+                form=GmailMessageFormat.METADATA,
+                metadata=constants.GMAIL_LISTING_HEADERS,
+            )
+            async for m in messages:
+                yield _message_record(m)
+        elif args[0] == "read":
+            if len(args) != 2:
+                raise ValueError("Please provide the id of the email to read.")
+            yield await asyncio.to_thread(self._read_record, args[1])
+        elif args[0] == "attachments":
+            if len(args) not in (2, 3):
+                raise ValueError(
+                    "Please provide the id of an email, and optionally a "
+                    "directory to save its attachments to."
+                )
+            attachments = await asyncio.to_thread(
+                self.gmail.get_attachments, args[1]
+            )
+            paths = [None] * len(attachments)
+            if len(args) == 3:
+                saved = await asyncio.to_thread(
+                    self.gmail.save_attachments,
+                    attachments,
+                    os.path.expanduser(args[2]),
+                )
+                paths = [path for path, _ in saved]
+            for attachment, path in zip(attachments, paths):
+                record = attachment.to_record()
+                if path is not None:
+                    record["path"] = path
+                yield record
+        elif args[0] == "search":
+            if len(args) < 2:
+                raise ValueError("Please provide words to search for.")
+            messages = await asyncio.to_thread(
+                self.gmail.search_messages,
+                " ".join(args[1:]),
+                constants.GMAIL_SEARCH_RESULT_COUNT,
+            )
+            for m in messages:
+                yield _message_record(m)
+        elif args[0] == "sync":
+            yield {"changed": await asyncio.to_thread(self.gmail.sync)}
+        elif args[0] in ("archive", "markread", "label"):
+            query, add, remove, _ = await asyncio.to_thread(
+                self._modification, args
+            )
+            modified = await asyncio.to_thread(
+                self.gmail.modify_messages, query, add, remove
+            )
+            yield {"modified": modified}
+        elif args[0] == "export":
+            writer, query = self._export_target(args)
+            yield await asyncio.to_thread(
+                self.gmail.export_messages, query, writer
+            )
+        else:
+            raise ValueError(f"`{args[0]}` has no batch form.")
+
+    def _read_record(self, id: str) -> Dict[str, Any]:
+        """ Returns the sender, date, subject and text body of an email.
+        """
+        message = mime.parse_message(self.gmail.get_message_body(id))
+        return {
+            "id": id,
+            "from": str(message["From"] or ""),
+            "date": str(message["Date"] or ""),
+            "subject": str(message["Subject"] or ""),
+            "body": self.gmail.render_body(message, id=id),
+        }
+
+    def inbox_streams(
+        self, limit: int
+    ) -> Dict[str, AsyncIterator[InboxItem]]:
+        """ Returns a stream of the most recent emails for the unified inbox.
+
+        Args:
+            limit: The maximum number of emails to stream.
+
+        Returns:
+            A dictionary with one stream of recent emails, newest first.
+
+        Raises:
+            NotAuthenticatedError: If the user has not signed in to Gmail.
+        """
+        if self.gmail is None:
+            raise NotAuthenticatedError()
+        return {self.get_name(): self._inbox_items(limit)}
+
+    async def _inbox_items(self, limit: int) -> AsyncIterator[InboxItem]:
+        """ Streams the most recent emails as inbox items.
+        """
+        messages = self.gmail.iter_messages_from_query_async(
+            constants.GMAIL_RECENT_QUERY,
+            max_messages=limit,
+            form=GmailMessageFormat.METADATA,
+            metadata=constants.GMAIL_LISTING_HEADERS,
+        )
+        async for m in messages:
+            yield _inbox_item(m)
+
+    async def background(self):
+        """ Syncs the local message store every GMAIL_SYNC_INTERVAL seconds
+            for as long as the session runs, so listings rarely wait for a
+            sync.
+        """
+        while True:
+            await asyncio.sleep(constants.GMAIL_SYNC_INTERVAL)
+            try:
+                changed = await asyncio.to_thread(self.gmail.sync)
+            except (HttpError, OSError) as e:
+                _logger.info(f"Background sync failed. Error: {e}.")
+            else:
+                _logger.debug(f"Background sync changed {changed} messages.")
+
     def recent(self, args: List[str]) -> bool:
         """ Prints a list of the most recent emails.
 
@@ -93,17 +356,12 @@ class GmailController(ServiceController):
         Return:
             True, if the use input was able to be processed, False otherwise.
         """
-        number = (
-            constants.GMAIL_DEFAULT_EMAIL_COUNT if len(args) < 2 else args[1]
-        )
-        number = int(number)
-        messages = self.gmail.get_messages_from_query(
-            constants.GMAIL_RECENT_QUERY,
-            max_messages=number,
-            form=GmailMessageFormat.METADATA,
-        )
-        self.messages = messages
-        return self.gmail.print_email_list(emails=messages)
+        try:
+            query = self._recent_query(args)
+        except ValueError as e:
+            print(e)
+            return False
+        return self._list_messages(*query)
 
     def list(self, args: List[str]) -> bool:
         """ Displays a list of emails to the user.
@@ -114,23 +372,155 @@ class GmailController(ServiceController):
                 arg[1]: The query to filter emails via.
                 arg[2]: The number of emails to print.
 
+        Return:
+            True, if the use input was able to be processed, False otherwise.
+        """
+        try:
+            query = self._list_query(args)
+        except ValueError as e:
+            print(e)
+            return False
+        return self._list_messages(*query)
+
+    def search(self, args: List[str]) -> bool:
+        """ Lists the fetched emails matching a search, best match first,
+            from the local search index rather than Gmail.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself.
+                args[1:]: The words to search for.
+
         Return:
             True, if the use input was able to be processed, False otherwise.
         """
         if len(args) < 2:
             print(
+                "Please provide words to search for. "
+                "I.e. `search from:alice invoice`"
+            )
+            return False
+        if not self.gmail.store.searchable:
+            print("Search is unavailable, as SQLite has no FTS5 support.")
+            return False
+
+        self._cancel_prefetch()
+        start = time.perf_counter()
+        self.messages = [
+            MessageSummary.from_message(m)
+            for m in self.gmail.search_messages(
+                " ".join(args[1:]), constants.GMAIL_SEARCH_RESULT_COUNT
+            )
+        ]
+        elapsed = time.perf_counter() - start
+        printed = self.gmail.print_email_list(self.messages)
+        print(
+            f"{len(self.messages)} fetched emails matched in "
+            f"{elapsed * 1000:.1f} ms. Use `list` to search all of Gmail."
+        )
+        return printed
+
+    @staticmethod
+    def _recent_query(args: List[str]) -> Tuple[str, int]:
+        """ Parses the arguments of `recent`.
+
+        Returns:
+            A tuple of the query and number of emails to list.
+
+        Raises:
+            ValueError: If the arguments are invalid, with a message for the
+                user.
+        """
+        if len(args) < 2:
+            return (
+                constants.GMAIL_RECENT_QUERY,
+                constants.GMAIL_DEFAULT_EMAIL_COUNT,
+            )
+        try:
+            return constants.GMAIL_RECENT_QUERY, int(args[1])
+        except ValueError:
+            raise ValueError(f"The value {args[1]} is not an integer.")
+
+    @staticmethod
+    def _list_query(args: List[str]) -> Tuple[str, Union[None, int]]:
+        """ Parses the arguments of `list`.
+
+        Returns:
+            A tuple of the query and number of emails to list.
+
+        Raises:
+            ValueError: If the arguments are invalid, with a message for the
+                user.
+        """
+        if len(args) < 2:
+            raise ValueError(
                 f"Please provide a query with this command. "
                 f"I.e. `list 'category:primary'`"
             )
-        else:
-            query = args[1]
-            messages = self.gmail.get_messages_from_query(
-                query,
-                max_messages=None if len(args) < 3 else args[2],
-                form=GmailMessageFormat.METADATA,
-            )
-            self.messages = messages
-            return self.gmail.print_email_list(messages)
+        try:
+            number = None if len(args) < 3 else int(args[2])
+        except ValueError:
+            raise ValueError(f"The value {args[2]} is not an integer.")
+        return args[1], number
+
+    def _list_messages(self, query: str, number: Union[None, int]) -> bool:
+        """ Prints the emails matching a query as they arrive, keeping them
+            for `read` and `back`, then starts prefetching the bodies of the
+            first GMAIL_PREFETCH_COUNT of them.
+
+        Args:
+            query: The query to filter emails via.
+            number: The number of emails to print. If None, all emails
+                matching the query are printed.
+
+        Return:
+            True, if the list of emails was printed, False otherwise.
+        """
+        self._cancel_prefetch()
+        messages = self.gmail.iter_messages_from_query(
+            query,
+            max_messages=number,
+            form=GmailMessageFormat.METADATA,
+            metadata=constants.GMAIL_LISTING_HEADERS,
+        )
+        self.messages = []
+        printed = self.gmail.print_email_list(
+            _recorded(messages, self.messages), total=number
+        )
+        self._prefetch = self.gmail.prefetch_message_bodies(
+            [m.id for m in self.messages[: constants.GMAIL_PREFETCH_COUNT]]
+        )
+        return printed
+
+    async def _list_messages_async(
+        self, query: str, number: Union[None, int]
+    ) -> bool:
+        """ Like `_list_messages`, but streams the emails on the event loop.
+            If cancelled, the emails printed so far are kept for `read` and
+            `back`.
+        """
+        self._cancel_prefetch()
+        messages = self.gmail.iter_messages_from_query_async(
+            query,
+            max_messages=number,
+            form=GmailMessageFormat.METADATA,
+            metadata=constants.GMAIL_LISTING_HEADERS,
+        )
+        self.messages = []
+        printed = await self.gmail.print_email_list_async(
+            _recorded_async(messages, self.messages), total=number
+        )
+        self._prefetch = self.gmail.prefetch_message_bodies(
+            [m.id for m in self.messages[: constants.GMAIL_PREFETCH_COUNT]]
+        )
+        return printed
+
+    def _cancel_prefetch(self):
+        """ Cancels the prefetching of bodies from the previous listing.
+        """
+        if self._prefetch is not None:
+            self._prefetch.set()
+            self._prefetch = None
 
     def read(self, args: List[str]) -> bool:
         """ Displays a single email to the user.
@@ -148,10 +538,11 @@ class GmailController(ServiceController):
         else:
             try:
                 index = int(args[1])
-                message_full = self.gmail.get_message_from_id(
-                    self.messages[index]["id"], form=GmailMessageFormat.RAW
-                )
-                self.gmail.read_message(message_full)
+                id = self.messages[index].id
+                # With its id, the rendered body is memoised, e.g. when the
+                # message was prefetched.
+                body = self.gmail.get_message_body(id)
+                self.gmail.print_message(body, id=id)
 
             except ValueError:
                 print(f"The value {args[1]} is not an integer.")
@@ -166,6 +557,69 @@ class GmailController(ServiceController):
             else:
                 return True
 
+    def attachments(self, args: List[str]) -> bool:
+        """ Lists the attachments of an email, or saves them to a directory.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself.
+                args[1]: The index of the email in the last listing.
+                args[2]: If set, the directory to save the attachments to.
+
+        Return:
+            True, if the use input was able to be processed, False otherwise.
+        """
+        if len(args) not in (2, 3):
+            print(
+                "Please provide the index of an email, and optionally a "
+                "directory to save its attachments to."
+            )
+            return False
+        try:
+            id = self.messages[int(args[1])].id
+        except ValueError:
+            print(f"The value {args[1]} is not an integer.")
+            return False
+        except IndexError:
+            print(
+                f"Index greater than number of messages. "
+                f"{int(args[1])}>={len(self.messages)}"
+            )
+            return False
+
+        attachments = self.gmail.get_attachments(id)
+        if not attachments:
+            print("The email has no attachments.")
+            return True
+        if len(args) == 2:
+            for i, attachment in enumerate(attachments):
+                print(
+                    f"|{i:>3}| {attachment.filename[:40]:<40} | "
+                    f"{attachment.mime_type[:24]:<24} | "
+                    f"{attachment.size / 1024:>9.1f} kB"
+                )
+            return True
+
+        start = time.perf_counter()
+        try:
+            saved = self.gmail.save_attachments(
+                attachments, os.path.expanduser(args[2])
+            )
+        except (HttpError, OSError) as e:
+            print(f"Could not save the attachments. Error: {e}.")
+            return False
+        elapsed = time.perf_counter() - start
+        downloaded = [a for a, (_, d) in zip(attachments, saved) if d]
+        megabytes = sum(a.size for a in downloaded) / 1024 / 1024
+        for path, _ in saved:
+            print(path)
+        print(
+            f"Saved {len(saved)} attachments in {elapsed:.1f}s, "
+            f"downloading {len(downloaded)} ({megabytes:.1f} MB, "
+            f"{megabytes / max(elapsed, 1e-6):.1f} MB/s)."
+        )
+        return True
+
     def back(self, args: List[str]) -> bool:
         """ Prints the previous message list requested by the used.
 
@@ -183,6 +637,183 @@ class GmailController(ServiceController):
         else:
             return self.gmail.print_email_list(self.messages)
 
+    def sync(self, args: List[str]) -> bool:
+        """ Brings the local message store up to date with Gmail.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself.
+
+        Return:
+            True, if the use input was able to be processed, False otherwise.
+        """
+        if len(args) > 1:
+            return False
+
+        changed = self.gmail.sync()
+        print(f"Synced. {changed} messages changed since the last sync.")
+        return True
+
+    def modify(self, args: List[str]) -> bool:
+        """ Archives, marks as read or labels every email matching a query,
+            printing progress and throughput as it goes.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself, one of archive, markread or label.
+                args[1]: For label, the name of the label to add.
+                args[1:] or args[2:]: The query to filter emails via.
+
+        Return:
+            True, if every matching email was modified, False otherwise.
+        """
+        try:
+            query, add, remove, done = self._modification(args)
+        except ValueError as e:
+            print(e)
+            return False
+        except HttpError as e:
+            print(f"Could not look up the label. Error: {e}.")
+            return False
+
+        start = time.perf_counter()
+
+        def progress(modified: int, matching: int):
+            rate = modified / max(time.perf_counter() - start, 1e-6)
+            print(
+                f"\r{modified} of {matching} emails, {rate:.0f}/s.",
+                end="",
+                flush=True,
+            )
+
+        try:
+            modified = self.gmail.modify_messages(query, add, remove, progress)
+        except HttpError as e:
+            print(f"\nCould not modify every email. Error: {e}.")
+            if e.resp.status == 403 and not is_rate_limit_error(e):
+                print("The credentials may not have the gmail.modify scope.")
+            return False
+        elapsed = time.perf_counter() - start
+        print(
+            f"\r{done} {modified} emails in {elapsed:.1f}s "
+            f"({modified / max(elapsed, 1e-6):.0f}/s)."
+        )
+        return True
+
+    def _modification(
+        self, args: List[str]
+    ) -> Tuple[str, List[str], List[str], str]:
+        """ Parses the arguments of `archive`, `markread` and `label`, looking
+            up the label's id.
+
+        Returns:
+            A tuple of the query, the ids of the labels to add and to remove,
+                and a word describing the change, e.g. "Archived".
+
+        Raises:
+            ValueError: If the arguments are invalid, with a message for the
+                user.
+        """
+        if args[0] == "label":
+            if len(args) < 3:
+                raise ValueError(
+                    "Please provide a label and a query. "
+                    "I.e. `label Receipts from:shop@example.com`"
+                )
+            label_id = self.gmail.get_label_id(args[1])
+            if label_id is None:
+                raise ValueError(f"There is no label named {args[1]}.")
+            return " ".join(args[2:]), [label_id], [], f"Labelled {args[1]}"
+
+        if len(args) < 2:
+            raise ValueError(
+                f"Please provide a query with this command. "
+                f"I.e. `{args[0]} from:news@example.com older_than:1m`"
+            )
+        remove, done = {
+            "archive": ("INBOX", "Archived"),
+            "markread": ("UNREAD", "Marked as read"),
+        }[args[0]]
+        return " ".join(args[1:]), [], [remove], done
+
+    def export(self, args: List[str]) -> bool:
+        """ Exports every email matching a query to an mbox file or a
+            directory of EML files, printing progress and throughput as it
+            goes. Running it again with the same path resumes an interrupted
+            export, or adds emails that arrived since.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself.
+                args[1]: The format, mbox or eml.
+                args[2]: The path of the mbox file or EML directory.
+                args[3:]: The query to filter emails via. If empty, every
+                    email is exported.
+
+        Return:
+            True, if the export finished, False otherwise.
+        """
+        try:
+            writer, query = self._export_target(args)
+        except ValueError as e:
+            print(e)
+            return False
+
+        start = time.perf_counter()
+
+        def progress(counts: Dict[str, int]):
+            megabytes = counts["bytes"] / 1024 / 1024
+            rate = megabytes / max(time.perf_counter() - start, 1e-6)
+            print(
+                f"\rExported {counts['exported']} emails, "
+                f"{megabytes:.1f} MB, {rate:.1f} MB/s.",
+                end="",
+                flush=True,
+            )
+
+        try:
+            counts = self.gmail.export_messages(query, writer, progress)
+        except (HttpError, OSError) as e:
+            print(f"\nCould not finish the export. Error: {e}.")
+            print("Run the same command again to resume it.")
+            return False
+        elapsed = time.perf_counter() - start
+        megabytes = counts["bytes"] / 1024 / 1024
+        print(
+            f"\rExported {counts['exported']} emails to {writer.path}, "
+            f"{megabytes:.1f} MB in {elapsed:.1f}s "
+            f"({megabytes / max(elapsed, 1e-6):.1f} MB/s)."
+        )
+        if counts["skipped"]:
+            print(f"Skipped {counts['skipped']} emails exported before.")
+        if counts["failed"]:
+            print(
+                f"Could not fetch {counts['failed']} emails. Run the same "
+                f"command again to retry them."
+            )
+        return True
+
+    @staticmethod
+    def _export_target(
+        args: List[str]
+    ) -> Tuple[Union[MboxWriter, EmlWriter], str]:
+        """ Parses the arguments of `export`.
+
+        Returns:
+            A tuple of the writer of the export and its query.
+
+        Raises:
+            ValueError: If the arguments are invalid, with a message for the
+                user.
+        """
+        if len(args) < 3:
+            raise ValueError(
+                "Please provide a format and a path. "
+                "I.e. `export mbox ~/mail.mbox from:boss@example.com`"
+            )
+        writer = open_writer(args[1], os.path.expanduser(args[2]))
+        return writer, " ".join(args[3:])
+
     def help(self, args: List[str]) -> bool:
         """ Prints a help message outlining the capaiblities of the tool.
 
@@ -201,11 +832,61 @@ Not a valid command. Commands:
             If no int is provided, all emails matching the query are returned.
 `read [int]`: Reads the indexed [int] from the previous list. [int] must be
         less than the number of emails in list.
+`search [words]`: Lists the emails fetched so far matching every word, as
+            a prefix, best match first. Words may start with from:, to: or
+            subject:. Answered locally, without querying Gmail.
+`attachments [index]`: Lists the attachments of the email.
+`attachments [index] [directory]`: Saves the attachments of the email.
 `back`: Prints the previous email list.
+`archive [query]`: Archives every email matching the query.
+`markread [query]`: Marks every email matching the query as read.
+`label [label] [query]`: Adds the label to every email matching the query.
+`export [mbox|eml] [path] [query]`: Exports every email matching the query.
+`sync`: Updates locally stored emails with changes made since the last sync.
+`stats [reset]`: Shows request latencies, retries and cache hit ratios.
             """
         )
         return True
 
+    def get_metrics(self) -> Union[None, Metrics]:
+        return None if self.gmail is None else self.gmail.metrics
+
+    def is_authenticated(self) -> bool:
+        """ Returns True if the user has signed in to Gmail.
+        """
+        return self.gmail is not None
+
+    def _use_handler(self, gmail: GmailHandler):
+        """ Switches to the handler of a newly authenticated account, closing
+            the previous one, whose fetch pool, renderer and store would
+            otherwise leak.
+        """
+        self._cancel_prefetch()
+        # The last listing belongs to the previous account.
+        self.messages = []
+        if self.gmail is not None:
+            self.gmail.close()
+        self.gmail = gmail
+
+    def authenticate_from_file(self, path: str) -> bool:
+        """ Authenticates with an oauth2client credentials file, without
+            prompting the user.
+
+        Args:
+            path: The path of the credentials file.
+
+        Returns:
+            True upon successful authentication.
+        Raises:
+            ServiceAuthenticationError: If the file holds no credentials.
+        """
+        if Storage(path).get() is None:
+            raise ServiceAuthenticationError(
+                f"{path} does not hold Gmail credentials."
+            )
+        self._use_handler(GmailHandler(path))
+        return True
+
     def authenticate(self) -> bool:
         """ Allows the user to authenticate with the service.
 
@@ -237,7 +918,7 @@ Not a valid command. Commands:
                 prompt="What is the path to the credentials file you would"
                 "like to use?"
             )
-            self.gmail = GmailHandler(credential_path)
+            self._use_handler(GmailHandler(credential_path))
             return True
 
         except google.auth.exceptions.DefaultCredentialsError as e:
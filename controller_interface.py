@@ -1,8 +1,15 @@
 import logging
-from typing import List
+from typing import Any, AsyncIterator, Dict, List, Union
 
 import constants
-from exceptions import ServiceAuthenticationError, UserTerminationError
+from exceptions import (
+    CommandInterruptedError,
+    ServiceAuthenticationError,
+    UserTerminationError,
+)
+from inbox import InboxItem
+from metrics import Metrics
+from profiling import tracer
 
 _logger = logging.getLogger(__name__)
 
@@ -52,6 +59,38 @@ class InterfaceController(object):
 
         return command.split()
 
+    @staticmethod
+    async def handle_input_async(prefix: str = ">> $: ") -> List[str]:
+        """ Like `handle_input`, but reads the input without blocking the
+            event loop, so background tasks keep running at the prompt.
+
+        Args:
+            prefix: The line prefix to use when prompting the user.
+
+        Returns: A list of string arguments, as for `handle_input`.
+
+        Raises:
+            UserTerminationError: If the user inputted a command for the
+                    controller to terminate, pressed Ctrl-C at the prompt or
+                    closed stdin.
+        """
+        # Imported here, as the console pulls in asyncio, which is slow to
+        # import and unused until a session starts.
+        from console import read_line, run_interruptibly
+
+        command: str = ""
+        try:
+            while not command:
+                command = await run_interruptibly(read_line(prefix))
+        except (CommandInterruptedError, EOFError):
+            print()
+            raise UserTerminationError()
+
+        if command.strip().lower() in constants.TERMINATION_COMMANDS:
+            raise UserTerminationError()
+
+        return command.split()
+
     def help(self, args: List[str]) -> bool:
         """ Prints a help message outlining the capabilities of this
             service controller.
@@ -106,6 +145,31 @@ class ServiceController(InterfaceController):
             f" inherits from ServiceController."
         )
 
+    def is_authenticated(self) -> bool:
+        """ Returns True if the user has signed in to the service.
+        """
+        raise NotImplementedError(
+            f"{type(self)} has not defined a `is_authenticated` method but it"
+            f" inherits from ServiceController."
+        )
+
+    def authenticate_from_file(self, path: str) -> bool:
+        """ Authenticates with the service without prompting the user, e.g.
+            for batch mode.
+
+        Args:
+            path: The path of a file holding the service's credentials.
+
+        Returns:
+            True upon successful authentication.
+        Raises:
+            ServiceAuthenticationError: If the credentials are not valid.
+        """
+        raise NotImplementedError(
+            f"{type(self)} has not defined a `authenticate_from_file` method"
+            f" but it inherits from ServiceController."
+        )
+
     def authenticate(self) -> bool:
         """ Allows the user to authenticate with the service.
 
@@ -149,6 +213,150 @@ class ServiceController(InterfaceController):
             )
             return True
 
+    async def run_async(self) -> bool:
+        """ Runs the looped interaction with the user on the event loop.
+
+        Each command runs as a task, which Ctrl-C cancels without leaving the
+        service, while `background` runs alongside the whole session. A
+        command that fails is reported, and the session goes on.
+
+        Returns:
+            True if the controller handled all user interactions, False
+                otherwise.
+        """
+        try:
+            self.authenticate()
+        except ServiceAuthenticationError:
+            _logger.info(f"Could not authenticate {self.get_name()} service.")
+            return False
+
+        import asyncio
+
+        from console import run_interruptibly
+
+        background = asyncio.ensure_future(self.background())
+        try:
+            # Run until UserTerminationError
+            while True:
+                args: List[str] = await ServiceController.handle_input_async(
+                    prefix=f"{self.get_name()}>> $:"
+                )
+                if len(args) == 0:
+                    self.help(args)
+                    continue
+                try:
+                    with tracer.command(" ".join([self.get_name()] + args)):
+                        await run_interruptibly(self.process_args_async(args))
+                except CommandInterruptedError:
+                    print("\nInterrupted.")
+                except UserTerminationError:
+                    raise
+                except Exception as e:
+                    # A failed command should not end the session.
+                    _logger.exception("Command failed.")
+                    print(f"Command failed. Error: {e}.")
+
+        except UserTerminationError:
+            _logger.debug(
+                f"User has terminated interaction with {self.get_name()}"
+                f" Controller."
+            )
+            return True
+        finally:
+            background.cancel()
+
+    async def process_args_async(self, args: List[str]) -> bool:
+        """ Processes a set of arguments from the user on the event loop.
+
+        By default `process_args` runs in a worker thread. Cancelling it stops
+        waiting for the command, but the thread runs to completion, so
+        controllers should override this for their long running commands.
+
+        Args:
+            args: A list of strings typed by the user.
+
+        Returns:
+            True, if the service controller successfully processed the args,
+                False otherwise.
+        """
+        import asyncio
+
+        return await asyncio.to_thread(
+            tracer.profiled(self.process_args), args
+        )
+
+    async def records_async(
+        self, args: List[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """ Runs a command for batch mode, yielding machine readable records
+            instead of printing.
+
+        Args:
+            args: A list of strings, such that args[0] is the command name.
+
+        Returns:
+            An asynchronous iterator of JSON serialisable records.
+
+        Raises:
+            ValueError: If the command or its arguments are invalid.
+        """
+        raise ValueError(f"{self.get_name()} has no batch commands.")
+        # Makes this an asynchronous generator, like the overrides.
+        yield
+
+    def inbox_streams(
+        self, limit: int
+    ) -> Dict[str, AsyncIterator[InboxItem]]:
+        """ Returns streams of the service's newest items for the unified
+            inbox. The service has none by default.
+
+        Args:
+            limit: The maximum number of items each stream should yield.
+
+        Returns:
+            A dictionary of stream name to an asynchronous iterator of items,
+            newest first.
+
+        Raises:
+            NotAuthenticatedError: If the user has not signed in to the
+                service.
+        """
+        return {}
+
+    def get_metrics(self) -> Union[None, Metrics]:
+        """ Returns the live metrics of the service, or None if it has none,
+            e.g. before the user signs in.
+        """
+        return None
+
+    def stats(self, args: List[str]) -> bool:
+        """ Prints the service's request counts, latencies, retries and cache
+            hit ratios. `stats reset` clears them.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself.
+
+        Return:
+            True, if the statistics were printed or reset, False otherwise.
+        """
+        metrics = self.get_metrics()
+        if metrics is None:
+            print(f"{self.get_name()} has no statistics.")
+            return False
+        if len(args) > 1 and args[1] == "reset":
+            metrics.reset()
+            print(f"Reset the statistics of {self.get_name()}.")
+            return True
+        print("\n".join(metrics.report()))
+        return True
+
+    async def background(self):
+        """ Runs for the duration of a `run_async` session, and is
+            cancelled when it ends. Does nothing by default.
+        """
+        return None
+
     def process_args(self, args: List[str]) -> bool:
         """Processes a set of arguments from the user.
 
@@ -1,8 +1,17 @@
-from typing import List, Union
+from typing import Any, AsyncIterator, Callable, Dict, List, Union
 import logging
 
-from exceptions import ControllerCloseError, UserTerminationError
+import constants
+from exceptions import (
+    CommandInterruptedError,
+    ControllerCloseError,
+    NotAuthenticatedError,
+    ServiceAuthenticationError,
+    UserTerminationError,
+)
 from controller_interface import InterfaceController, ServiceController
+from inbox import InboxItem, format_item, merge_newest_first
+from profiling import tracer
 
 
 _logger = logging.getLogger(__name__)
@@ -19,52 +28,232 @@ class MainController(InterfaceController):
     def run(self) -> bool:
         """ Main loop controller responsible for
 
+        Returns: True if the controller managed to handle all use inputs and
+            closed down any necessary connections or services.
+        """
+        # Imported here, as asyncio alone would double the time waddle
+        # takes to start.
+        import asyncio
+
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> bool:
+        """ Runs the main loop on the event loop, so selected services can
+            run commands and background tasks concurrently.
+
         Returns: True if the controller managed to handle all use inputs and
             closed down any necessary connections or services.
         """
         try:
-            # Run until UserTerminationError
-            while True:
-                args: List[str] = MainController.handle_input()
+            await self._loop_async()
+        except UserTerminationError:
+            _logger.debug(
+                f"User has terminated interaction with Main Controller."
+            )
+        finally:
+            # Also closes the services when the session fails, so their
+            # worker pools, stores and caches are not left open.
+            closed = self.close_controllers()
+        return closed
 
-                if len(args) > 1:
-                    self.help()
-                    continue
+    async def _loop_async(self):
+        """ Runs commands until the user terminates the session. A command
+            or service that fails is reported, and the loop goes on.
 
-                sub_controller: Union[None, ServiceController] = next(
-                    (
-                        c
-                        for c in self.controllers
-                        if c.get_name().lower() == args[0].lower()
-                    ),
-                    None,
-                )
+        Raises:
+            UserTerminationError: When the user terminates the session.
+        """
+        from console import run_interruptibly
+
+        # Run until UserTerminationError
+        while True:
+            args: List[str] = await MainController.handle_input_async()
+
+            if len(args) == 0:
+                self.help()
+                continue
+
+            if args[0].lower() == "stats":
+                self.stats(args)
+                continue
+
+            if len(args) > 1 and args[0].lower() != "inbox":
+                self.help()
+                continue
+
+            sub_controller = None
+            if args[0].lower() != "inbox":
+                sub_controller = self.find_controller(args[0])
                 if not sub_controller:
                     print(f"'{args[0]}' is not a valid service.")
                     self.help()
-                else:
-                    if not sub_controller.run():
-                        _logger.warning(
-                            f"{sub_controller.get_name()} Controller had a "
-                            f"problem running."
-                        )
+                    continue
 
-        except UserTerminationError:
-            _logger.debug(
-                f"User has terminated interaction with Main Controller."
+            try:
+                if sub_controller is None:
+                    with tracer.command(" ".join(args)):
+                        await run_interruptibly(self.inbox(args))
+                elif not await sub_controller.run_async():
+                    _logger.warning(
+                        f"{sub_controller.get_name()} Controller had a "
+                        f"problem running."
+                    )
+            except CommandInterruptedError:
+                print("\nInterrupted.")
+            except UserTerminationError:
+                raise
+            except Exception as e:
+                _logger.exception("Command failed.")
+                print(f"Command failed. Error: {e}.")
+
+    async def inbox(self, args: List[str]) -> bool:
+        """ Prints the newest items of every signed in service, newest first.
+
+        The services are queried concurrently and their items merged as they
+        arrive.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself.
+                args[1]: The number of items to print.
+
+        Returns:
+            True, if the inbox was printed, False otherwise.
+        """
+        try:
+            limit = (
+                constants.INBOX_DEFAULT_ITEM_COUNT
+                if len(args) < 2
+                else int(args[1])
             )
-            for controller in self.controllers:
-                try:
-                    controller.close()
-                except ControllerCloseError as e:
-                    _logger.error(
-                        f"Controller: {type(controller)} failed to"
-                        f"close properly. Error: {e}."
+        except ValueError:
+            print(f"The value {args[1]} is not an integer.")
+            return False
+
+        printed = 0
+        items = self.inbox_items(limit, on_signed_out=print)
+        async for item in items:
+            print(format_item(item))
+            printed += 1
+            if printed == limit:
+                break
+        await items.aclose()
+        return True
+
+    async def inbox_items(
+        self, limit: int, on_signed_out: Callable[[str], Any] = None
+    ) -> AsyncIterator[InboxItem]:
+        """ Streams the newest items of every signed in service, newest
+            first, querying the services concurrently.
+
+        Args:
+            limit: The maximum number of items to stream from each service.
+            on_signed_out: Called with a message for each service that is
+                not signed in.
+
+        Returns:
+            An asynchronous iterator of items, newest first.
+        """
+        streams = {}
+        for controller in self.controllers:
+            try:
+                streams.update(controller.inbox_streams(limit))
+            except NotAuthenticatedError:
+                if on_signed_out is not None:
+                    on_signed_out(
+                        f"Not signed in to {controller.get_name()}. Select it "
+                        f"to sign in."
                     )
-                    return False
-                else:
-                    _logger.info(f"Main Controller successfully terminated.")
-                    return True
+
+        items = merge_newest_first(streams, constants.INBOX_SERVICE_TIMEOUT)
+        try:
+            async for item in items:
+                yield item
+        finally:
+            await items.aclose()
+
+    def authenticate_from_files(self, credentials: Dict[str, str]) -> bool:
+        """ Signs in to services with credential files, without prompting.
+
+        Args:
+            credentials: A dictionary of service name to the path of its
+                credentials file.
+
+        Returns:
+            True if every service was signed in to, False otherwise.
+        """
+        signed_in = True
+        for name, path in credentials.items():
+            controller = self.find_controller(name)
+            if controller is None:
+                _logger.warning(f"'{name}' is not a valid service.")
+                signed_in = False
+                continue
+            try:
+                controller.authenticate_from_file(path)
+            except ServiceAuthenticationError as e:
+                _logger.warning(
+                    f"Could not sign in to {controller.get_name()}. "
+                    f"Error: {e}."
+                )
+                signed_in = False
+        return signed_in
+
+    def stats(self, args: List[str]) -> bool:
+        """ Prints the statistics of every service that has made requests.
+            `stats reset` clears them.
+
+        Args:
+            args: User specified inputs such that args[0] is the command
+                name itself.
+
+        Returns:
+            True, if any service had statistics, False otherwise.
+        """
+        shown = False
+        for controller in self.controllers:
+            if controller.get_metrics() is None:
+                continue
+            if args[1:] != ["reset"]:
+                print(f"{controller.get_name()}:")
+            controller.stats(args)
+            shown = True
+        if not shown:
+            print("No service has statistics yet.")
+        return shown
+
+    def find_controller(self, name: str) -> Union[None, ServiceController]:
+        """ Returns the service controller with a name, ignoring case, or None
+            if there is none.
+        """
+        return next(
+            (
+                c
+                for c in self.controllers
+                if c.get_name().lower() == name.lower()
+            ),
+            None,
+        )
+
+    def close_controllers(self) -> bool:
+        """ Closes every service controller.
+
+        Returns:
+            True if the controllers closed properly, False otherwise.
+        """
+        closed = True
+        for controller in self.controllers:
+            try:
+                controller.close()
+            except ControllerCloseError as e:
+                _logger.error(
+                    f"Controller: {type(controller)} failed to"
+                    f"close properly. Error: {e}."
+                )
+                closed = False
+        if closed:
+            _logger.info(f"Main Controller successfully terminated.")
+        return closed
 
     def help(self) -> bool:
         """Prints a help message to the user, outlining all the available
@@ -73,6 +262,8 @@ class MainController(InterfaceController):
         Returns:
             True, if the message was able to be printed.
         """
+        print("`inbox [int]`: Lists the newest [int] items of every service.")
+        print("`stats [reset]`: Shows the request statistics of each service.")
         print("Please select a service to use:")
         for controller in self.controllers:
             print(
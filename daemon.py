@@ -0,0 +1,269 @@
+import asyncio
+import contextlib
+import contextvars
+import io
+import json
+import logging
+import os
+import signal
+import sys
+from typing import Dict, List
+
+import constants
+from client import is_daemon_running
+from controller_main import MainController
+from profiling import tracer
+
+_logger = logging.getLogger(__name__)
+
+# The output of the client whose command runs in the current context, if
+# any. Worker threads copy the context they are started from, so a command's
+# output follows it into its threads, and never into the next command's.
+_client_output: contextvars.ContextVar = contextvars.ContextVar(
+    "client_output", default=None
+)
+
+
+class _ClientOutput(io.TextIOBase):
+    """ A text stream that forwards everything written to it to a client, so
+        commands that print can be run for a client unchanged.
+
+        Writes may come from worker threads, so they are handed to the event
+        loop. Once the client is gone, writes are dropped, as a cancelled
+        command's worker thread may still be printing.
+    """
+
+    def __init__(
+        self, loop: asyncio.AbstractEventLoop, writer: asyncio.StreamWriter
+    ):
+        self._loop = loop
+        self._writer = writer
+        self._connected = True
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text and self._connected:
+            self._loop.call_soon_threadsafe(self._forward, text)
+        return len(text)
+
+    def disconnect(self):
+        """ Drops everything written from now on.
+        """
+        self._connected = False
+
+    def _forward(self, text: str):
+        # Text written before the disconnect is still sent, if the client is.
+        if not self._writer.is_closing():
+            self._writer.write(_encode({"output": text}))
+
+
+class _ContextStdout(io.TextIOBase):
+    """ Stands in for stdout while the daemon serves, writing to the output
+        of the client whose command runs in the current context, or to the
+        daemon's own stdout outside of commands.
+    """
+
+    def __init__(self, default: io.TextIOBase):
+        self._default = default
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        return (_client_output.get() or self._default).write(text)
+
+    def flush(self):
+        (_client_output.get() or self._default).flush()
+
+
+def _encode(message: Dict) -> bytes:
+    """ Encodes a message of the daemon protocol, a line of JSON.
+    """
+    return json.dumps(message).encode() + b"\n"
+
+
+class WaddleDaemon(object):
+    """
+        Keeps the controllers of signed in services, with their connections
+        and caches, alive between CLI invocations, and runs commands for
+        clients connecting over a Unix domain socket.
+
+        Each connection sends one command as a line of JSON,
+        {"args": ["gmail", "recent", "20"]}. The daemon replies with lines of
+        {"output": text} as the command prints, then {"ok": bool}. Commands
+        run one at a time, as they share the controllers.
+    """
+
+    def __init__(
+        self,
+        main: MainController,
+        socket_path: str = constants.DAEMON_SOCKET_PATH,
+    ):
+        """
+        Args:
+            main: The controller of the services to keep alive.
+            socket_path: The path of the Unix domain socket to listen on.
+
+        Returns:
+             Constructor.
+        """
+        self.main = main
+        self.socket_path = socket_path
+        self._command_lock = asyncio.Lock()
+
+    def sign_in(self, names: List[str]) -> bool:
+        """ Signs in to services interactively, before serving.
+
+        Args:
+            names: The names of the services to sign in to.
+
+        Returns:
+            True if every service was signed in to, False otherwise.
+        """
+        signed_in = True
+        for name in names:
+            controller = self.main.find_controller(name)
+            if controller is None:
+                print(f"'{name}' is not a valid service.")
+                signed_in = False
+                continue
+            try:
+                controller.authenticate()
+            except Exception as e:
+                print(f"Could not sign in to {controller.get_name()}: {e}")
+                signed_in = False
+        return signed_in
+
+    async def serve(self) -> bool:
+        """ Serves clients until the daemon receives SIGINT or SIGTERM, then
+            closes the controllers.
+
+        Returns:
+            True if the controllers closed properly, False otherwise.
+        """
+        if is_daemon_running(self.socket_path):
+            print(f"A daemon is already listening on {self.socket_path}.")
+            return False
+
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        # Only the user may connect, as the sessions are theirs.
+        with _umask(0o077):
+            server = await asyncio.start_unix_server(
+                self._handle_client, path=self.socket_path
+            )
+
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+
+        print(f"Listening on {self.socket_path}. Press Ctrl-C to stop.")
+        try:
+            with contextlib.redirect_stdout(_ContextStdout(sys.stdout)):
+                async with server:
+                    await stopped.wait()
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.socket_path)
+        return self.main.close_controllers()
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """ Runs a client's command, cancelling it if the client disconnects
+            before it finishes.
+        """
+        ok = False
+        try:
+            request = json.loads(await reader.readline())
+            args = [str(a) for a in request["args"]]
+            command = asyncio.ensure_future(self._run(args, writer))
+            disconnected = asyncio.ensure_future(reader.read())
+            await asyncio.wait(
+                [command, disconnected], return_when=asyncio.FIRST_COMPLETED
+            )
+            disconnected.cancel()
+            if not command.done():
+                _logger.info(f"Client disconnected. Cancelling {args}.")
+                command.cancel()
+            ok = await command
+        except (ValueError, KeyError, TypeError) as e:
+            message = f"Invalid request. Error: {e}.\n"
+            writer.write(_encode({"output": message}))
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            _logger.exception("Command failed.")
+            message = f"Command failed. Error: {e}.\n"
+            writer.write(_encode({"output": message}))
+        finally:
+            if not writer.is_closing():
+                writer.write(_encode({"ok": bool(ok)}))
+                with contextlib.suppress(ConnectionError):
+                    await writer.drain()
+                writer.close()
+
+    async def _run(
+        self, args: List[str], writer: asyncio.StreamWriter
+    ) -> bool:
+        """ Runs a command with its output sent to a client.
+
+        Args:
+            args: The command, starting with a service name or `inbox`.
+            writer: The client's stream.
+
+        Returns:
+            True if the command succeeded, False otherwise.
+        """
+        async with self._command_lock:
+            output = _ClientOutput(asyncio.get_running_loop(), writer)
+            token = _client_output.set(output)
+            try:
+                with tracer.command(" ".join(args)):
+                    return await self._dispatch(args)
+            finally:
+                output.disconnect()
+                _client_output.reset(token)
+
+    async def _dispatch(self, args: List[str]) -> bool:
+        """ Runs a command, printing its output.
+
+        Args:
+            args: The command, starting with a service name or `inbox`.
+
+        Returns:
+            True if the command succeeded, False otherwise.
+        """
+        if not args:
+            return self.main.help()
+        if args[0].lower() == "inbox":
+            return await self.main.inbox(args)
+        if args[0].lower() == "stats":
+            return self.main.stats(args)
+
+        controller = self.main.find_controller(args[0])
+        if controller is None:
+            print(f"'{args[0]}' is not a valid service.")
+            return self.main.help()
+        if not controller.is_authenticated():
+            print(
+                f"Not signed in to {controller.get_name()}. Restart "
+                f"the daemon with its name to sign in."
+            )
+            return False
+        if len(args) < 2:
+            return controller.help(args[1:])
+        return bool(await controller.process_args_async(args[1:]))
+
+
+@contextlib.contextmanager
+def _umask(mask: int):
+    """ Sets the process's umask for the duration of a block.
+    """
+    previous = os.umask(mask)
+    try:
+        yield
+    finally:
+        os.umask(previous)
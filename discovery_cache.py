@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Union
+
+import constants
+
+import httplib2
+from googleapiclient.discovery import (
+    DISCOVERY_URI,
+    build,
+    build_from_document,
+)
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.discovery_cache.base import Cache
+from googleapiclient.errors import HttpError
+
+_logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of cache files changes, so old files are ignored.
+CACHE_FORMAT_VERSION = 1
+
+
+class DiscoveryCache(Cache):
+    """
+        An on-disk cache of Google API discovery documents, keyed by their
+        URL. Entries expire after a TTL, and entries written by another
+        version of the cache are ignored.
+    """
+
+    def __init__(
+        self,
+        directory: str = constants.DISCOVERY_CACHE_DIR,
+        ttl: float = constants.DISCOVERY_CACHE_TTL,
+    ):
+        """
+        Args:
+            directory: The directory to keep cached documents in.
+            ttl: Seconds a cached document is fresh for.
+
+        Returns:
+             Constructor.
+        """
+        self.directory = directory
+        self.ttl = ttl
+
+    def get(self, url: str, allow_stale: bool = False) -> Union[None, str]:
+        """ Gets a cached discovery document.
+
+        Args:
+            url: The URL of the discovery document.
+            allow_stale: If True, documents older than the TTL are returned.
+
+        Returns:
+            The discovery document, or None if it is not cached, is stale or
+            was cached by another version.
+        """
+        try:
+            with open(self._path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("version") != CACHE_FORMAT_VERSION:
+            return None
+        if not allow_stale and time.time() - entry["stored"] > self.ttl:
+            return None
+        return entry["content"]
+
+    def set(self, url: str, content: str):
+        """ Caches a discovery document, replacing the file atomically so
+            concurrent readers never see a partial document.
+
+        Args:
+            url: The URL of the discovery document.
+            content: The discovery document.
+        """
+        entry = {
+            "version": CACHE_FORMAT_VERSION,
+            "stored": time.time(),
+            "url": url,
+            "content": content,
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temporary = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(temporary, self._path(url))
+        except OSError as e:
+            _logger.warning(f"Could not cache discovery document. Error: {e}.")
+
+    def _path(self, url: str) -> str:
+        """ Returns the path of the cache file of a URL.
+        """
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+
+def build_service(
+    api: str,
+    version: str,
+    credentials,
+    cache: Cache = None,
+    root_url: str = None,
+):
+    """ Builds a Google API client, using a cached discovery document if
+        possible.
+
+    Fresh cached documents are used without any network access. Otherwise the
+    document is downloaded and cached. If that fails, e.g. when offline, a
+    stale cached document is used, or else the one bundled with the client
+    library, which is then cached so later builds need not wait for the
+    network until it expires.
+
+    Args:
+        api: The name of the API, e.g. "gmail".
+        version: The version of the API, e.g. "v1".
+        credentials: The credentials to authorize requests with.
+        cache: The discovery document cache. If not set, a DiscoveryCache in
+            DISCOVERY_CACHE_DIR is used.
+        root_url: Overrides the root URL of the API, e.g. to run against a
+            local test server. The cached or bundled document is used, without
+            network access.
+
+    Returns:
+        A googleapiclient Resource for the API.
+    """
+    cache = cache or DiscoveryCache()
+    url = DISCOVERY_URI.format(api=api, apiVersion=version)
+
+    if root_url is not None:
+        document = cache.get(url, allow_stale=True)
+        document = json.loads(document or get_static_doc(api, version))
+        document["rootUrl"] = root_url
+        return build_from_document(document, credentials=credentials)
+
+    document = cache.get(url)
+    if document is not None:
+        return build_from_document(document, credentials=credentials)
+
+    try:
+        return build(
+            api,
+            version,
+            credentials=credentials,
+            cache=cache,
+            static_discovery=False,
+        )
+    except (httplib2.HttpLib2Error, OSError, HttpError) as e:
+        _logger.info(
+            f"Could not download the {api} {version} discovery document."
+            f" Error: {e}."
+        )
+        document = cache.get(url, allow_stale=True)
+        if document is None:
+            document = get_static_doc(api, version)
+            if document is None:
+                raise
+            cache.set(url, document)
+    return build_from_document(document, credentials=credentials)
@@ -29,3 +29,12 @@ class NotAuthenticatedError(Exception):
     """
 
     pass
+
+
+class CommandInterruptedError(Exception):
+    """ This exception is raised when the user interrupts a running command
+        or prompt with Ctrl-C.
+
+    """
+
+    pass
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import re
+import time
+from typing import Iterable, Set, Union
+
+import constants
+
+_logger = logging.getLogger(__name__)
+
+# Lines of a message that would read as the start of the next one in an
+# mbox, quoted with one more ">" as in the mboxrd format.
+_MBOX_FROM_LINE = re.compile(rb"^(>*From )", re.MULTILINE)
+
+
+class ExportCheckpoint(object):
+    """
+        An append-only record of the messages an export has written, so an
+        interrupted export resumes without fetching them again.
+
+        Each line is the JSON of a batch of ids and the size of the export
+        once they were written. A line is only appended after its messages
+        are flushed to disk, and a torn last line is ignored, so the record
+        never claims more than was written.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The path of the checkpoint file, created if necessary.
+
+        Returns:
+             Constructor.
+        """
+        self.path = path
+        self.done: Set[str] = set()
+        # The size of the export at the last checkpoint, or None if it has
+        # none yet.
+        self.offset: Union[None, int] = None
+        if os.path.exists(path):
+            self._load()
+        self._file = open(path, "a")
+
+    def close(self) -> bool:
+        """ Closes the checkpoint file.
+
+        Returns:
+            True if the file was closed.
+        """
+        self._file.close()
+        return True
+
+    def record(self, ids: Iterable[str], offset: int):
+        """ Records messages as written, once they are flushed to disk.
+
+        Args:
+            ids: Ids of the messages written since the last checkpoint.
+            offset: The size of the export after writing them.
+        """
+        ids = list(ids)
+        self._file.write(json.dumps({"offset": offset, "ids": ids}) + "\n")
+        self._file.flush()
+        self.done.update(ids)
+        self.offset = offset
+
+    def _load(self):
+        """ Reads the checkpoint file, truncating it after its last whole
+            line, so lines appended later are not lost behind a torn one.
+        """
+        with open(self.path, "rb+") as f:
+            end = 0
+            for line in f:
+                try:
+                    checkpoint = json.loads(line)
+                except ValueError:
+                    _logger.warning(
+                        f"Dropping a torn line of the checkpoint {self.path}."
+                    )
+                    f.truncate(end)
+                    break
+                self.done.update(checkpoint["ids"])
+                self.offset = checkpoint["offset"]
+                end += len(line)
+
+
+class MboxWriter(object):
+    """
+        Writes messages to a single mbox file, in the mboxrd format, through
+        a large write buffer.
+
+        Line endings are written as "\\n", as mail clients reading mbox files
+        expect.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The path of the mbox file. Messages are appended if it
+                already exists.
+
+        Returns:
+             Constructor.
+        """
+        self.path = path
+        self.checkpoint_path = path + ".checkpoint"
+        self._file = None
+
+    def open(self, offset: int = None) -> int:
+        """ Opens the file for writing, dropping anything written after the
+            last checkpoint of an interrupted export.
+
+        Args:
+            offset: The size of the file at the last checkpoint. If not set,
+                messages are appended to the end of the file.
+
+        Returns:
+            The size of the file, where the next message will be written.
+        """
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        self._file = open(
+            self.path, "ab", buffering=constants.GMAIL_EXPORT_BUFFER_BYTES
+        )
+        if offset is not None and offset < self._file.tell():
+            _logger.info(
+                f"Dropping {self._file.tell() - offset} bytes written to "
+                f"{self.path} after its last checkpoint."
+            )
+            self._file.truncate(offset)
+            self._file.seek(offset)
+        return self._file.tell()
+
+    def write(self, id: str, internal_date: int, raw: bytes) -> int:
+        """ Writes a message.
+
+        Args:
+            id: Id of the email.
+            internal_date: When Gmail received the email, in milliseconds
+                since the epoch.
+            raw: The RFC 2822 bytes of the message.
+
+        Returns:
+            The number of bytes written.
+        """
+        date = time.asctime(time.gmtime(internal_date / 1000))
+        raw = _MBOX_FROM_LINE.sub(rb">\1", raw.replace(b"\r\n", b"\n"))
+        if not raw.endswith(b"\n"):
+            raw += b"\n"
+        entry = f"From {id}@gmail {date}\n".encode() + raw + b"\n"
+        self._file.write(entry)
+        return len(entry)
+
+    def flush(self) -> int:
+        """ Flushes written messages to disk.
+
+        Returns:
+            The size of the file.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self) -> bool:
+        """ Flushes and closes the file.
+
+        Returns:
+            True if the file was closed.
+        """
+        if self._file is not None:
+            self._file.close()
+        return True
+
+
+class EmlWriter(object):
+    """
+        Writes each message to its own EML file in a directory, named by its
+        id, with the bytes Gmail returned.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The directory of the EML files, created if necessary.
+
+        Returns:
+             Constructor.
+        """
+        self.path = path
+        self.checkpoint_path = os.path.join(path, ".checkpoint")
+        os.makedirs(path, exist_ok=True)
+
+    def open(self, offset: int = None) -> int:
+        """ Prepares for writing. EML files are written whole, so there is
+            nothing to drop after an interrupted export.
+
+        Returns:
+            0, as EML exports have no offset.
+        """
+        return 0
+
+    def write(self, id: str, internal_date: int, raw: bytes) -> int:
+        """ Writes a message to `<id>.eml`, through a temporary file so a
+            partly written message is never left under its name.
+
+        Args:
+            id: Id of the email.
+            internal_date: When Gmail received the email, in milliseconds
+                since the epoch. Set as the file's modification time.
+            raw: The RFC 2822 bytes of the message.
+
+        Returns:
+            The number of bytes written.
+        """
+        path = os.path.join(self.path, f"{id}.eml")
+        with open(path + ".part", "wb") as f:
+            f.write(raw)
+        os.replace(path + ".part", path)
+        os.utime(path, (internal_date / 1000, internal_date / 1000))
+        return len(raw)
+
+    def flush(self) -> int:
+        """ Flushes written messages to disk. Syncing every file at once is
+            much cheaper than syncing each as it is written.
+
+        Returns:
+            0, as EML exports have no offset.
+        """
+        os.sync()
+        return 0
+
+    def close(self) -> bool:
+        """ EML files are closed as they are written.
+
+        Returns:
+            True.
+        """
+        return True
+
+
+def open_writer(form: str, path: str) -> Union[MboxWriter, EmlWriter]:
+    """ Returns the writer of an export format.
+
+    Args:
+        form: "mbox" for a single mbox file, or "eml" for a directory of
+            EML files.
+        path: The path of the mbox file or EML directory.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    writers = {"mbox": MboxWriter, "eml": EmlWriter}
+    if form not in writers:
+        raise ValueError(f"Unknown export format {form}. Use mbox or eml.")
+    return writers[form](path)
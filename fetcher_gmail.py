@@ -0,0 +1,332 @@
+import collections
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import constants
+from metrics import Metrics
+
+from apiclient.errors import HttpError
+
+_logger = logging.getLogger(__name__)
+
+# Gmail error reasons that mean the user is sending requests too quickly.
+_RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """ Checks if an error from the Gmail API means the request was throttled.
+
+    Args:
+        error: An exception raised while executing a request.
+
+    Returns:
+        True if the error is a 429, or a 403 with a rate limit reason.
+    """
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    if error.resp.status != 403:
+        return False
+
+    try:
+        content = error.content
+        if isinstance(content, bytes):
+            content = content.decode()
+        errors = json.loads(content)["error"].get("errors", [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return any(e.get("reason") in _RATE_LIMIT_REASONS for e in errors)
+
+
+class TokenBucket(object):
+    """
+        A thread safe token bucket. Tokens refill continuously at `rate` per
+        second, up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: Tokens added per second.
+            capacity: The maximum number of tokens held at once.
+
+        Returns:
+             Constructor.
+        """
+        self.capacity = capacity
+        self._rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        """ Tokens added per second.
+        """
+        return self._rate
+
+    def set_rate(self, rate: float):
+        """ Changes the rate tokens are added at, from now on.
+
+        Args:
+            rate: Tokens added per second.
+        """
+        with self._lock:
+            self._refill()
+            self._rate = rate
+
+    def acquire(self, tokens: float):
+        """ Blocks until `tokens` can be taken from the bucket, then takes
+            them.
+
+        Requests larger than the capacity wait for a full bucket and leave it
+        in debt, which later requests wait out.
+
+        Args:
+            tokens: The number of tokens to take.
+        """
+        with self._lock:
+            self._refill()
+            needed = min(tokens, self.capacity)
+            wait = max(0.0, needed - self._tokens) / self._rate
+            # The tokens are taken before waiting for them, so later callers
+            # wait behind this one, first come, first served.
+            self._tokens -= tokens
+        if wait > 0:
+            time.sleep(wait)
+
+    def _refill(self):
+        """ Adds the tokens accrued since the last update. Must be called with
+            the lock held.
+        """
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated) * self._rate,
+        )
+        self._updated = now
+
+
+class GmailFetchEngine(object):
+    """
+        Runs Gmail API requests concurrently on a thread pool, rate limited in
+        Gmail quota units per second.
+
+        The rate adapts to the server: it is halved whenever a request is
+        throttled and recovers gradually as requests succeed.
+    """
+
+    def __init__(
+        self,
+        http_factory: Callable[[], Any],
+        max_workers: int = None,
+        quota_rate: float = None,
+        metrics: Metrics = None,
+    ):
+        """
+        Args:
+            http_factory: Creates an authorized `httplib2.Http`. Called once
+                per thread, as they cannot be shared between threads.
+            max_workers: The number of requests that may run concurrently.
+                Defaults to GMAIL_FETCH_WORKERS.
+            quota_rate: The maximum number of quota units spent per second.
+                Defaults to GMAIL_QUOTA_UNITS_PER_SECOND.
+            metrics: Counts the engine's throttled requests and retries.
+
+        Returns:
+             Constructor.
+        """
+        max_workers = max_workers or constants.GMAIL_FETCH_WORKERS
+        quota_rate = quota_rate or constants.GMAIL_QUOTA_UNITS_PER_SECOND
+        self._http_factory = http_factory
+        self.metrics = metrics or Metrics()
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="gmail-fetch"
+        )
+        self._max_rate = quota_rate
+        self._bucket = TokenBucket(quota_rate, capacity=quota_rate)
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._requests = 0
+        self._throttled = 0
+        self._last_slowdown = 0.0
+        self._completed = collections.deque()
+
+    def close(self) -> bool:
+        """ Stops the thread pool, cancelling any requests not yet started.
+
+        Returns:
+            True once the engine has stopped.
+        """
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        return True
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """ Runs a function on the engine's thread pool.
+
+        The function should make its requests through `execute`. It runs
+        in the caller's context, so its work is traced with the command that
+        submitted it.
+
+        Args:
+            fn: The function to run.
+            args: Positional arguments for `fn`.
+            kwargs: Keyword arguments for `fn`.
+
+        Returns:
+            A future of the function's result.
+        """
+        context = contextvars.copy_context()
+        return self._pool.submit(context.run, fn, *args, **kwargs)
+
+    def execute(self, request: Callable[[Any], Any], cost: int) -> Any:
+        """ Executes a request on the calling thread, once its quota units are
+            available, retrying with backoff if it is throttled.
+
+        Args:
+            request: Executes the request with the `httplib2.Http` it is
+                given, e.g. `lambda http: r.execute(http=http)`.
+            cost: The request's cost in Gmail quota units.
+
+        Returns:
+            The result of `request`.
+
+        Raises:
+            HttpError: If the request fails, or is still throttled after
+                GMAIL_MAX_RETRIES retries.
+        """
+        attempt = 0
+        while True:
+            self._bucket.acquire(cost)
+            with self._lock:
+                self._in_flight += 1
+            try:
+                result = request(self._http())
+            except HttpError as e:
+                if not is_rate_limit_error(e):
+                    raise
+                self.metrics.count("throttled")
+                if attempt >= constants.GMAIL_MAX_RETRIES:
+                    raise
+                self.backoff(attempt)
+                attempt += 1
+            else:
+                self._succeeded(cost)
+                return result
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+    def backoff(self, attempt: int):
+        """ Slows the engine down after a request was throttled, and sleeps
+            the calling thread for an exponential backoff period.
+
+        Args:
+            attempt: The number of times the request has already been
+                retried.
+        """
+        self.metrics.count("retries")
+        now = time.monotonic()
+        with self._lock:
+            self._throttled += 1
+            # Requests throttled together share one slow down.
+            if (
+                now - self._last_slowdown
+                > constants.GMAIL_SLOWDOWN_INTERVAL
+            ):
+                self._last_slowdown = now
+                self._bucket.set_rate(
+                    max(
+                        self._bucket.rate / 2,
+                        self._max_rate * constants.GMAIL_MIN_RATE_FRACTION,
+                    )
+                )
+            rate = self._bucket.rate
+        delay = min(
+            constants.GMAIL_MAX_BACKOFF,
+            constants.GMAIL_BACKOFF_BASE * 2 ** attempt,
+        )
+        delay += random.uniform(0, constants.GMAIL_BACKOFF_BASE)
+        _logger.info(
+            f"Gmail request throttled. Slowing to {rate:.0f} units/s and "
+            f"retrying in {delay:.1f}s."
+        )
+        time.sleep(delay)
+
+    @property
+    def in_flight(self) -> int:
+        """ The number of requests currently being executed.
+        """
+        return self._in_flight
+
+    def throughput(self) -> float:
+        """ Returns the number of requests completed per second, over the last
+            GMAIL_THROUGHPUT_WINDOW seconds.
+        """
+        with self._lock:
+            self._trim_completed(time.monotonic())
+            return len(self._completed) / constants.GMAIL_THROUGHPUT_WINDOW
+
+    def stats(self) -> Dict[str, float]:
+        """ Returns a snapshot of the engine's counters.
+
+        Returns:
+            A dictionary with keys: in_flight, requests, throttled,
+                rate (quota units per second) and throughput (requests per
+                second).
+        """
+        throughput = self.throughput()
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "requests": self._requests,
+                "throttled": self._throttled,
+                "rate": self._bucket.rate,
+                "throughput": throughput,
+            }
+
+    def _http(self):
+        """ Returns the calling thread's `httplib2.Http`.
+        """
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = self._http_factory()
+        return http
+
+    def _succeeded(self, cost: int):
+        """ Records a completed request, and recovers some of the rate lost to
+            throttling.
+
+        Args:
+            cost: The request's cost in Gmail quota units.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._requests += 1
+            self._completed.append(now)
+            self._trim_completed(now)
+            self._bucket.set_rate(
+                min(
+                    self._max_rate,
+                    self._bucket.rate
+                    + cost * constants.GMAIL_RATE_RECOVERY_PER_UNIT,
+                )
+            )
+
+    def _trim_completed(self, now: float):
+        """ Drops completion times older than GMAIL_THROUGHPUT_WINDOW.
+        """
+        while (
+            self._completed
+            and now - self._completed[0] > constants.GMAIL_THROUGHPUT_WINDOW
+        ):
+            self._completed.popleft()
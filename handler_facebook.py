@@ -1,29 +1,235 @@
+import json
 import logging
-from typing import List, Dict
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, Iterator, List
+from urllib.parse import urlencode
+
 import requests
+from requests.adapters import HTTPAdapter
 
 import facebook
 
 import constants
 from exceptions import NotAuthenticatedError
+from http_cache import CachingAdapter, HttpCache
+from metrics import Metrics, endpoint_name
+from prefetch import aread_ahead, read_ahead
+from profiling import tracer
 
 _logger = logging.getLogger(__name__)
 
+# A JSONPath reference to the result of a named call of a batch request,
+# e.g. "{result=events:$.data.*.id}".
+_REFERENCE = re.compile(r"\{result=([^:}]+):")
+
+
+class _RootURLAdapter(HTTPAdapter):
+    """ Sends the requests of a session to another root URL, e.g. a local
+        stand-in for the Graph API.
+    """
+
+    def __init__(self, prefix: str, root_url: str):
+        super().__init__()
+        self.prefix = prefix
+        self.root_url = root_url
+
+    def send(self, request, **kwargs):
+        request.url = self.root_url + request.url[len(self.prefix):]
+        return super().send(request, **kwargs)
+
+
+class GraphBatch(object):
+    """
+        Graph API calls sent together, up to FACEBOOK_BATCH_SIZE in each
+        batch request, with each call's result going back to its caller
+        through a future.
+
+        A call may use the result of an earlier, named call with a JSONPath
+        reference, e.g. `?ids={result=events:$.data.*.id}`. Graph resolves
+        references on its side, so dependent calls cost no round trip of
+        their own.
+    """
+
+    def __init__(self, handler: "FacebookHandler"):
+        """
+        Args:
+            handler: The handler whose session and token send the batch.
+
+        Returns:
+             Constructor.
+        """
+        self.handler = handler
+        self._calls: List[Dict[str, Any]] = []
+        self._futures: List[Future] = []
+        self._names: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def get(
+        self,
+        path: str,
+        args: Dict[str, str] = None,
+        fields: str = None,
+        name: str = None,
+        keep_result: bool = True,
+    ) -> Future:
+        """ Adds a GET call to the batch.
+
+        Args:
+            path: The path of the call, e.g. "/me/events?type=maybe". It may
+                refer to the results of earlier named calls.
+            args: The query arguments of the call. Their values may refer to
+                the results of earlier named calls.
+            fields: A comma separated partial response field mask.
+            name: A name later calls can refer to this call's result by.
+            keep_result: If False, Graph does not return the result of a
+                named call that succeeded, and its future's result is None.
+
+        Returns:
+            A future of the call's JSON response, set once the batch is
+                executed.
+
+        Raises:
+            ValueError: If a name is reused, or a reference is not to an
+                earlier call of the same batch request.
+        """
+        position = len(self._calls)
+        size = constants.FACEBOOK_BATCH_SIZE
+        for reference in _REFERENCE.findall(f"{path} {args}"):
+            if reference not in self._names:
+                raise ValueError(f"No earlier call is named {reference}.")
+            if self._names[reference] // size != position // size:
+                raise ValueError(
+                    f"{path} would be sent in a later batch request than "
+                    f"the {reference} call it refers to."
+                )
+        if name in self._names:
+            raise ValueError(f"A call is already named {name}.")
+
+        relative_url = path.lstrip("/")
+        args = self.handler._masked(dict(args or {}), fields)
+        if args:
+            # References must reach Graph as they are.
+            relative_url += ("&" if "?" in relative_url else "?") + urlencode(
+                args, safe="{}=:$.*,"
+            )
+        call = {"method": "GET", "relative_url": relative_url}
+        if name is not None:
+            call["name"] = name
+            call["omit_response_on_success"] = not keep_result
+            self._names[name] = position
+
+        future = Future()
+        self._calls.append(call)
+        self._futures.append(future)
+        return future
+
+    def execute(self) -> int:
+        """ Sends the calls added since the last execution, and sets their
+            futures. A failed call sets its future's exception, as does a
+            failed batch request for each of its calls.
+
+        Returns:
+            The number of batch requests sent.
+        """
+        calls, futures = self._calls, self._futures
+        self._calls, self._futures, self._names = [], [], {}
+        size = constants.FACEBOOK_BATCH_SIZE
+        for start in range(0, len(calls), size):
+            self._send(calls[start:start + size], futures[start:start + size])
+        return -(-len(calls) // size)
+
+    def _send(self, calls: List[Dict[str, Any]], futures: List[Future]):
+        """ Sends one batch request, and sets the futures of its calls.
+        """
+        try:
+            responses = self.handler.api.request(
+                "", post_args={"batch": json.dumps(calls)}
+            )
+        except (facebook.GraphAPIError, requests.RequestException) as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        self.handler.metrics.count("batched calls", len(calls))
+
+        for call, future, response in zip(calls, futures, responses):
+            if response is None:
+                # Graph leaves out the results it was asked to omit.
+                if call.get("omit_response_on_success"):
+                    future.set_result(None)
+                else:
+                    future.set_exception(
+                        facebook.GraphAPIError(
+                            f"No response to {call['relative_url']}."
+                        )
+                    )
+                continue
+            try:
+                body = json.loads(response.get("body") or "null")
+            except ValueError:
+                body = None
+            if isinstance(body, dict) and "error" in body:
+                future.set_exception(facebook.GraphAPIError(body))
+            elif response.get("code") != 200:
+                future.set_exception(
+                    facebook.GraphAPIError(
+                        f"{call['relative_url']} failed with HTTP "
+                        f"{response.get('code')}."
+                    )
+                )
+            else:
+                future.set_result(body)
+
 
 class FacebookHandler(object):
     """
 
     """
 
-    def __init__(self, token: Dict[str, str]):
+    def __init__(
+        self,
+        token: Dict[str, str],
+        root_url: str = None,
+        http_cache: HttpCache = None,
+    ):
         """
         Args:
             token:
+            root_url: Sends Graph API requests to this root URL instead of
+                facebook.FACEBOOK_GRAPH_URL, e.g. for benchmarks.
+            http_cache: The cache of Graph API responses. Defaults to the
+                one at FACEBOOK_HTTP_CACHE_PATH.
 
         Returns:
              Constructor.
         """
         self.session = requests.Session()
+        self.http_cache = http_cache or HttpCache(
+            constants.FACEBOOK_HTTP_CACHE_PATH
+        )
+        # GET requests are answered from the cache while fresh, and
+        # revalidated with their ETag once stale.
+        self.cache_adapter = CachingAdapter(
+            self.http_cache,
+            transport=_RootURLAdapter(facebook.FACEBOOK_GRAPH_URL, root_url)
+            if root_url
+            else None,
+        )
+        self.session.mount(facebook.FACEBOOK_GRAPH_URL, self.cache_adapter)
+        # requests already asks for gzip. This counts the bytes it received.
+        self.session.hooks["response"].append(self._count_bytes)
+        self.bytes_received = 0
+        # Responses arrive on read-ahead and batch threads at once.
+        self._bytes_lock = threading.Lock()
+        # Live request and throttle counters, shown by `stats`.
+        self.metrics = Metrics()
+        self.metrics.track_cache("http", self.cache_adapter)
+        # When set, requests ask only for the fields the views use.
+        self.field_masks = True
         self.api = facebook.GraphAPI(
             access_token=token["access_token"],
             session=self.session,
@@ -50,9 +256,25 @@ class FacebookHandler(object):
             return self._user
 
         try:
-            self._user = self.api.request("/me")
+            if force_query:
+                # Makes sure the token is still valid, even if the response
+                # is cached. The URL is the one `api.request` would build.
+                args = self._masked({}, constants.FACEBOOK_USER_FIELDS)
+                args["access_token"] = self.token["access_token"]
+                user = self.session.get(
+                    facebook.FACEBOOK_GRAPH_URL + "/me",
+                    params=args,
+                    headers={"Cache-Control": "no-cache"},
+                ).json()
+                if "error" in user:
+                    raise facebook.GraphAPIError(user)
+            else:
+                user = self.api.request(
+                    "/me", self._masked({}, constants.FACEBOOK_USER_FIELDS)
+                )
+            self._user = user
             return self._user
-        except facebook.GraphAPIError as e:
+        except (facebook.GraphAPIError, ValueError) as e:
             raise NotAuthenticatedError(
                 f"No current user is logged in. Error occurred {e}."
             )
@@ -66,33 +288,214 @@ class FacebookHandler(object):
             True if Facebook connection was properly ended, False otherwise.
         """
         self.session.close()
-        return True
+        return self.http_cache.close()
+
+    def get_node(self, id: str, fields: str = None) -> Dict[str, str]:
+        """ Returns a single Graph API node, e.g. an event.
+
+        Args:
+            id: The id of the node.
+            fields: A comma separated partial response field mask.
+
+        Raises:
+            facebook.GraphAPIError: If the node could not be retrieved.
+        """
+        return self.api.request(f"/{id}", self._masked({}, fields))
+
+    def new_batch(self) -> GraphBatch:
+        """ Returns an empty batch of Graph API calls, sent by this handler.
+        """
+        return GraphBatch(self)
+
+    def get_events_by_type(
+        self,
+        types: List[str] = constants.FACEBOOK_EVENT_TYPES,
+        fields: str = constants.FACEBOOK_EVENT_DETAIL_FIELDS,
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """ Returns the first page of the user's events of each type, with
+            their details, in a single batch request.
+
+        Each type's listing is named, and a dependent call fetches the
+        details of the events it lists by reference.
+
+        Args:
+            types: The event types to list, of FACEBOOK_EVENT_TYPES.
+            fields: The field mask of the details of each event.
+
+        Returns:
+            A dictionary of event type to its events, in listing order.
+
+        Raises:
+            facebook.GraphAPIError: If the events could not be retrieved.
+        """
+        batch = self.new_batch()
+        calls = {}
+        for event_type in types:
+            listing = batch.get(
+                "/me/events",
+                {"type": event_type},
+                fields="id",
+                name=event_type,
+            )
+            details = batch.get(
+                "/", {"ids": f"{{result={event_type}:$.data.*.id}}"}, fields
+            )
+            calls[event_type] = (listing, details)
+        batch.execute()
 
-    def get_paginated_data(self, endpoint: str, limit: int = -1) -> List[Dict[str, str]]:
-        """ Returns cursor-paginated data from an endpoint. It is assumed the endpoint
-            supports pagination checks.
+        events = {}
+        for event_type, (listing, details) in calls.items():
+            ids = [e["id"] for e in listing.result().get("data", [])]
+            # Details of an empty listing fail, as there are no ids.
+            nodes = details.result() if ids else {}
+            events[event_type] = [nodes[id] for id in ids if id in nodes]
+        return events
+
+    def get_paginated_data(
+        self, endpoint: str, limit: int = -1, fields: str = None
+    ) -> List[Dict[str, str]]:
+        """ Returns cursor-paginated data from an endpoint. It is assumed the
+            endpoint supports pagination checks.
 
         Args:
             endpoint: The endpoint to query.
-            limit: The number of paginated results to return. If None, will return all
-                paginated results.
+            limit: The number of paginated results to return. If -1, will
+                return all paginated results.
+            fields: A comma separated partial response field mask, e.g.
+                "id,name". If not set, the endpoint's default fields are
+                returned.
 
         Returns:
-            A list of JSON response results. Subsequent paginations will be appended
-                in order.
+            A list of JSON response results. Subsequent paginations will be
+                appended in order.
+
+        Raises:
+            facebook.GraphAPIError: If a page could not be retrieved.
         """
-        p = 0
-        finished = False
-        results = []
-        while (p != limit) and not finished:
-            page = self.api(endpoint)
-            results.extend(page.get("data"), [])
-
-            if page.get("paging") and page.get("paging").get("next"):
-                endpoint = page.get("paging").get("next")
-            else:
-                finished = True
+        return list(self.iter_paginated_data(endpoint, limit, fields))
+
+    def iter_paginated_data(
+        self,
+        endpoint: str,
+        limit: int = -1,
+        fields: str = None,
+        depth: int = constants.FACEBOOK_READ_AHEAD_PAGES,
+    ) -> Iterator[Dict[str, str]]:
+        """ Lazily iterates over cursor-paginated data from an endpoint.
+
+        Pages are requested in a background thread, up to `depth` pages
+        ahead of the one being consumed, so the next page's round trip
+        overlaps the processing of the current one. Stopping early stops
+        the requests once the page in flight arrives.
+
+        Args:
+            endpoint: The endpoint to query.
+            limit: The number of pages to read. If -1, every page is read.
+            fields: A comma separated partial response field mask.
+            depth: The maximum number of pages held ahead of the consumer.
+
+        Returns:
+            An iterator of the results of each page, in order.
+
+        Raises:
+            facebook.GraphAPIError: If a page could not be retrieved. Results
+                of the earlier pages have already been yielded.
+        """
+        pages = read_ahead(self._iter_pages(endpoint, limit, fields), depth)
+        for page in pages:
+            yield from page.get("data", [])
 
+    async def iter_paginated_data_async(
+        self,
+        endpoint: str,
+        limit: int = -1,
+        fields: str = None,
+        depth: int = constants.FACEBOOK_READ_AHEAD_PAGES,
+    ) -> AsyncIterator[Dict[str, str]]:
+        """ Like `iter_paginated_data`, but for consumers on an event loop.
+        """
+        pages = aread_ahead(self._iter_pages(endpoint, limit, fields), depth)
+        async for page in pages:
+            for result in page.get("data", []):
+                yield result
+
+    def _iter_pages(
+        self, endpoint: str, limit: int, fields: str
+    ) -> Iterator[Dict]:
+        """ Requests the pages of an endpoint in turn, following their next
+            links, until `limit` pages have been read or there are no more.
+        """
+        if limit == 0:
+            return
+        page = self.api.request(endpoint, self._masked({}, fields))
+        p = 0
+        while True:
+            yield page
             p += 1
-        return results
+
+            next_page = page.get("paging", {}).get("next")
+            if not next_page or p == limit:
+                return
+            # The next link already carries the token and field mask.
+            page = self.session.get(next_page).json()
+            if "error" in page:
+                raise facebook.GraphAPIError(page)
+
+    def _masked(self, args: Dict[str, str], fields: str) -> Dict[str, str]:
+        """ Adds a partial response field mask to the arguments of a request,
+            if field masks are enabled.
+
+        Args:
+            args: The query arguments of the request.
+            fields: A comma separated field mask, or None.
+
+        Returns:
+            The same request arguments.
+        """
+        if self.field_masks and fields:
+            args["fields"] = fields
+        return args
+
+    def _count_bytes(self, response: requests.Response, *args, **kwargs):
+        """ Response hook adding the size of a response body to
+            `bytes_received`, and tracing and measuring the request.
+            Responses served from the HTTP cache without a request are not
+            counted, and revalidated ones count without their cached body.
+        """
+        from_cache = getattr(response, "from_cache", None)
+        if from_cache == "fresh":
+            return
+        size = 0 if from_cache else len(response.content)
+        # The body is read here, after `elapsed` stopped at its headers.
+        start = time.perf_counter() - response.elapsed.total_seconds()
+        with self._bytes_lock:
+            self.bytes_received += size
+        duration = time.perf_counter() - start
+        tracer.record(
+            response.request.method,
+            "http",
+            start,
+            duration,
+            url=response.url.split("?")[0],
+            bytes=size,
+            status=304 if from_cache else response.status_code,
+        )
+        self.metrics.record_request(
+            endpoint_name(response.request.method, response.url),
+            duration,
+            size,
+            ok=response.ok,
+        )
+        if not response.ok and self._is_rate_limited(response):
+            self.metrics.count("throttled")
+
+    @staticmethod
+    def _is_rate_limited(response: requests.Response) -> bool:
+        """ Checks if a failed response is a Graph API rate limit error.
+        """
+        try:
+            code = response.json()["error"]["code"]
+        except (ValueError, KeyError, TypeError):
+            return False
+        return code in constants.FACEBOOK_RATE_LIMIT_CODES
 
@@ -1,19 +1,129 @@
+import asyncio
 import base64
-import email
+import collections
 import json
 import logging
-from typing import List, Dict
+import threading
+import time
+from concurrent.futures import Future
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import constants
+import mime
+from attachments_gmail import (
+    Attachment,
+    AttachmentStore,
+    attachments_of,
+    iter_decoded,
+)
+from cache import LRUCache
 from constants import GmailMessageFormat
-from exceptions import NotAuthenticatedError
+from discovery_cache import build_service
+from exceptions import NotAuthenticatedError, ServiceAuthenticationError
+from exporter_gmail import EmlWriter, ExportCheckpoint, MboxWriter
+from fetcher_gmail import GmailFetchEngine, is_rate_limit_error
+from metrics import Metrics, endpoint_name
+from prefetch import aread_ahead, read_ahead
+from profiling import tracer
+from render import HtmlRenderer
+from store_gmail import GmailStore, RAW_VARIANT, variant_of
 
 from oauth2client.file import Storage
-from apiclient.discovery import build
-import html2text
+from apiclient.errors import HttpError
+from apiclient.http import build_http, set_user_agent
 
 _logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+def _chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """ Groups items into lists of `size`, the last of which may be shorter.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class MessageSummary(object):
+    """
+        The parts of a listed email that listings, `back` and `read` use,
+        taken from its METADATA message object once, when it is fetched.
+
+        Much smaller than the message object, which holds every header as a
+        dictionary, and its fields need no header scan when printed.
+    """
+
+    __slots__ = (
+        "id",
+        "thread_id",
+        "internal_date",
+        "sender",
+        "subject",
+        "snippet",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        thread_id: str,
+        internal_date: int,
+        sender: str,
+        subject: str,
+        snippet: str,
+    ):
+        self.id = id
+        self.thread_id = thread_id
+        # Milliseconds since the epoch, as in the Gmail API.
+        self.internal_date = internal_date
+        self.sender = sender
+        self.subject = subject
+        self.snippet = snippet
+
+    @classmethod
+    def from_message(cls, message: Dict[str, Any]) -> "MessageSummary":
+        """ Summarises a METADATA message object from the Gmail API.
+
+        Raises:
+            KeyError: If the message has no id or From header.
+        """
+        sender = subject = None
+        for header in message.get("payload", {}).get("headers", []):
+            if header["name"] == "From" and sender is None:
+                sender = header["value"]
+            elif header["name"] == "Subject" and subject is None:
+                subject = header["value"]
+        if sender is None:
+            raise KeyError("From")
+        snippet = message.get("snippet", "")
+        return cls(
+            message["id"],
+            message.get("threadId"),
+            int(message.get("internalDate", 0)),
+            sender,
+            subject or "",
+            snippet[: constants.GMAIL_SUMMARY_SNIPPET_CHARS],
+        )
+
 
 class GmailHandler(object):
     """
@@ -21,19 +131,79 @@ class GmailHandler(object):
         gmail API.
     """
 
-    def __init__(self, cred_file):
+    def __init__(
+        self,
+        cred_file,
+        store: GmailStore = None,
+        root_url: str = None,
+        attachment_dir: str = None,
+    ):
         """
 
         Args:
             cred_file: An credential file for the oauth2 client.
+            store: A local store of messages. If not set, the store of the
+                authenticated account in GMAIL_STORE_PATH_FORMAT is used.
+            root_url: Overrides the root URL of the API, e.g. to run against
+                a local test server.
+            attachment_dir: The directory of downloaded attachments.
+                Defaults to GMAIL_ATTACHMENT_DIR.
 
         Returns:
              Constructor.
+
+        Raises:
+            ServiceAuthenticationError: If the file holds no credentials, or
+                they are invalid.
         """
         # TODO: Allow for credentials as service account keys
         #  (as GOOGLE_APPLICATION_CREDENTIALS)
         self.cred = Storage(cred_file).get()
-        self.service = build("gmail", "v1", credentials=self.cred)
+        # The service is built lazily, so missing credentials are caught
+        # here rather than on the first request.
+        if self.cred is None or self.cred.invalid:
+            raise ServiceAuthenticationError(
+                f"{cred_file} does not hold valid Gmail credentials."
+            )
+        self.root_url = root_url
+        self._service = None
+        self._service_lock = threading.Lock()
+        self.store = store or GmailStore(self._default_store_path())
+        self.attachments = AttachmentStore(
+            attachment_dir or constants.GMAIL_ATTACHMENT_DIR
+        )
+        # Live request, retry and cache counters, shown by `stats`.
+        self.metrics = Metrics()
+        self.engine = GmailFetchEngine(
+            self._authorized_http, metrics=self.metrics
+        )
+        self.bodies = LRUCache(
+            constants.GMAIL_BODY_CACHE_MAX_BYTES,
+            idle_timeout=constants.GMAIL_BODY_CACHE_IDLE_TIMEOUT,
+            size_of=len,
+        )
+        self.renderer = HtmlRenderer()
+        self.metrics.track_cache("body", self.bodies)
+        self.metrics.track_cache("rendered html", self.renderer.cache)
+        # When set, requests ask only for the fields the views use.
+        self.field_masks = True
+        self.bytes_received = 0
+        self._bytes_lock = threading.Lock()
+        self._last_sync = None
+        self._sync_lock = threading.Lock()
+
+    @property
+    def service(self):
+        """ The Gmail API client. It is built on first use, so that
+            authenticating does not wait for the discovery document.
+        """
+        if self._service is None:
+            with self._service_lock:
+                if self._service is None:
+                    self._service = build_service(
+                        "gmail", "v1", self.cred, root_url=self.root_url
+                    )
+        return self._service
 
     def close(self) -> bool:
         """ Closes down the connection with the API.
@@ -44,7 +214,11 @@ class GmailHandler(object):
             True if Gmail connection was properly ended, False otherwise.
         """
         # TODO: investigate closing down gmail.
-        return True
+        return (
+            self.engine.close()
+            and self.renderer.close()
+            and self.store.close()
+        )
 
     def get_current_email(self) -> str:
         """ Gets the email address currently authenticated.
@@ -56,9 +230,11 @@ class GmailHandler(object):
             NotAuthenticatedError: If the service handler is not authenticated.
 
         """
+        if self.cred is None:
+            raise NotAuthenticatedError("No Gmail credentials.")
         try:
             return json.loads(self.cred.to_json())["id_token"]["email"]
-        except KeyError:
+        except (KeyError, TypeError):
             _logger.warning(
                 f"Error occured with credentials. No key `email` in JSON"
                 f"credentials."
@@ -91,44 +267,481 @@ class GmailHandler(object):
         Raises:
             TBD
         """
-        if metadata:
-            return (
-                self.service.users()
-                .messages()
-                .get(
-                    userId="me",
-                    id=id,
-                    format=form.value,
-                    metadataHeaders=metadata,
+        variant = variant_of(form, metadata)
+        message = None
+        if self._store_is_current(variant):
+            message = self.store.get(id, variant)
+            hit = message is not None
+            self.metrics.count_cache("store", hit, not hit)
+        if message is None:
+            message = self._execute(
+                self._message_request(id, form, metadata), "messages.get"
+            )
+            self.store.put_many([message], variant)
+        return message
+
+    def get_message_body(self, id: str) -> bytes:
+        """ Gets the decoded RAW body of a message, from the body cache if it
+            has been read or prefetched recently.
+
+        Args:
+            id: Id of a email.
+
+        Returns:
+            The RFC 2822 bytes of the message.
+        """
+        body = self.bodies.get(id)
+        if body is None:
+            message = self.get_message_from_id(id, form=GmailMessageFormat.RAW)
+            with tracer.span("base64", "decode", bytes=len(message["raw"])):
+                body = base64.urlsafe_b64decode(message["raw"])
+            self.bodies.put(id, body)
+        return body
+
+    def prefetch_message_bodies(self, ids: List[str]) -> threading.Event:
+        """ Starts fetching and decoding the RAW bodies of messages into the
+            body cache in the background, so they can be read instantly.
+
+        Args:
+            ids: Ids of emails, in the order they should be fetched.
+
+        Returns:
+            An event which, when set, cancels the bodies not yet fetched.
+        """
+        cancelled = threading.Event()
+        for id in ids:
+            self.engine.submit(self._prefetch_message_body, id, cancelled)
+        return cancelled
+
+    def _prefetch_message_body(self, id: str, cancelled: threading.Event):
+        """ Fetches the body of a message into the body cache and renders it,
+            unless the prefetch has been cancelled or it is already cached.
+
+        Args:
+            id: Id of a email.
+            cancelled: Set when the prefetch has been cancelled.
+        """
+        if cancelled.is_set() or id in self.bodies:
+            return
+        try:
+            self.render_body(self.get_message_body(id), id=id)
+        except HttpError as e:
+            _logger.info(f"Could not prefetch Gmail message {id}. Error: {e}.")
+
+    def get_messages_from_ids(
+        self,
+        ids: List[str],
+        form: GmailMessageFormat = GmailMessageFormat.RAW,
+        metadata: List[str] = None,
+    ) -> List[Dict[str, str]]:
+        """ Gets Message objects for a list of IDs. Messages held in the local
+            store are served from it, and the rest are requested through the
+            Gmail batch endpoint, with batches running concurrently on the
+            fetch engine.
+
+        Args:
+            ids: Ids of emails, in the order they should be returned.
+            form: The format of email to return, options are:
+                    'full', 'metadata', 'minimal', 'raw'.
+            metadata: metadata headers to include when receiving messages.
+
+        Returns:
+            A list of message objects, in the same order as `ids`. Messages
+            that could not be retrieved are logged and left out of the list.
+        """
+        batches = [
+            self._submit_messages(
+                ids[start : start + constants.GMAIL_BATCH_SIZE], form, metadata
+            )
+            for start in range(0, len(ids), constants.GMAIL_BATCH_SIZE)
+        ]
+        return [m for batch in batches for m in batch.result()]
+
+    def sync(self) -> int:
+        """ Brings the local store up to date with the mailbox, pulling only
+            the changes since the last sync through `users.history.list`.
+
+        Deleted messages are removed from the store, and messages whose labels
+        changed have their metadata dropped so it is fetched again.
+
+        Returns:
+            The number of messages that changed since the last sync.
+        """
+        with self._sync_lock:
+            return self._sync()
+
+    def _sync(self) -> int:
+        """ Syncs the local store. Must be called with `_sync_lock` held.
+
+        Returns:
+            The number of messages that changed since the last sync.
+        """
+        start = self.store.history_id
+        if start is None:
+            self._start_history()
+            return 0
+
+        changed = set()
+        deleted = set()
+        history_id = start
+        request = self._masked(
+            {"userId": "me", "startHistoryId": start}, "history.list"
+        )
+        try:
+            while True:
+                page = self._execute(
+                    self.service.users().history().list(**request),
+                    "history.list",
                 )
-                .execute()
+                for record in page.get("history", []):
+                    for change in record.get("messagesDeleted", []):
+                        deleted.add(change["message"]["id"])
+                    for key in ("labelsAdded", "labelsRemoved"):
+                        for change in record.get(key, []):
+                            changed.add(change["message"]["id"])
+                history_id = page.get("historyId", history_id)
+
+                if not page.get("nextPageToken"):
+                    break
+                request["pageToken"] = page["nextPageToken"]
+
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            # The history has expired, so any stored metadata may be stale.
+            _logger.warning(
+                f"Gmail history {start} is no longer available. The local "
+                f"store has been reset."
             )
-        else:
-            return (
-                self.service.users()
-                .messages()
-                .get(userId="me", id=id, format=form.value)
-                .execute()
+            self.store.invalidate()
+            self._start_history()
+            return 0
+
+        self.store.delete(deleted)
+        self.store.invalidate(changed - deleted)
+        self.store.history_id = history_id
+        self._last_sync = time.monotonic()
+        return len(changed | deleted)
+
+    def _start_history(self):
+        """ Starts tracking the mailbox history from its current point.
+        """
+        profile = self._execute(
+            self.service.users().getProfile(
+                **self._masked({"userId": "me"}, "getProfile")
+            ),
+            "getProfile",
+        )
+        self.store.history_id = profile["historyId"]
+        self._last_sync = time.monotonic()
+
+    def _store_is_current(self, variant: str) -> bool:
+        """ Checks if stored messages of a variant can be served, syncing the
+            store first if it has not been synced in GMAIL_SYNC_INTERVAL.
+
+        Args:
+            variant: The store variant of the messages.
+
+        Returns:
+            True if stored messages of the variant are fresh, False otherwise.
+        """
+        if variant == RAW_VARIANT:
+            # RAW payloads never change once a message exists.
+            return True
+        if (
+            self._last_sync is not None
+            and time.monotonic() - self._last_sync
+            < constants.GMAIL_SYNC_INTERVAL
+        ):
+            return True
+
+        try:
+            self.sync()
+        except HttpError as e:
+            _logger.warning(
+                f"Could not sync the local Gmail store. Error: {e}."
+            )
+            return False
+        return True
+
+    def _default_store_path(self) -> str:
+        """ Returns the path of the local store of the authenticated account.
+        """
+        try:
+            account = self.get_current_email()
+        except NotAuthenticatedError:
+            account = "default"
+        return constants.GMAIL_STORE_PATH_FORMAT.format(account=account)
+
+    def _submit_messages(
+        self,
+        ids: List[str],
+        form: GmailMessageFormat,
+        metadata: Union[None, List[str]],
+    ) -> Future:
+        """ Starts getting up to GMAIL_BATCH_SIZE messages on the fetch engine.
+
+        Args:
+            ids: Ids of emails, in the order they should be returned.
+            form: The format of email to return.
+            metadata: metadata headers to include when receiving messages.
+
+        Returns:
+            A future of the list of message objects, in the same order as
+            `ids`.
+        """
+        use_store = self._store_is_current(variant_of(form, metadata))
+        return self.engine.submit(
+            self._get_message_batch, ids, form, metadata, use_store
+        )
+
+    def _get_message_batch(
+        self,
+        ids: List[str],
+        form: GmailMessageFormat,
+        metadata: Union[None, List[str]],
+        use_store: bool,
+    ) -> List[Dict[str, str]]:
+        """ Gets up to GMAIL_BATCH_SIZE messages, from the local store where
+            possible and otherwise with a single batch request.
+
+        Args:
+            ids: Ids of emails, in the order they should be returned.
+            form: The format of email to return.
+            metadata: metadata headers to include when receiving messages.
+            use_store: Whether stored messages are fresh enough to be served.
+
+        Returns:
+            A list of message objects, in the same order as `ids`. Messages
+            that could not be retrieved are logged and left out of the list.
+        """
+        variant = variant_of(form, metadata)
+        stored = {}
+        if use_store:
+            stored = self.store.get_many(ids, variant)
+            self.metrics.count_cache(
+                "store", len(stored), len(ids) - len(stored)
+            )
+
+        fetched = self._batch_get_messages(
+            [id for id in ids if id not in stored], form, metadata
+        )
+        self.store.put_many(fetched.values(), variant)
+
+        messages = (stored.get(id) or fetched.get(id) for id in ids)
+        return [m for m in messages if m is not None]
+
+    def _batch_get_messages(
+        self,
+        ids: List[str],
+        form: GmailMessageFormat,
+        metadata: Union[None, List[str]],
+    ) -> Dict[str, Dict[str, str]]:
+        """ Requests up to GMAIL_BATCH_SIZE messages in one batch request.
+            Messages that are throttled are retried with backoff.
+
+        Args:
+            ids: Ids of emails.
+            form: The format of email to return.
+            metadata: metadata headers to include when receiving messages.
+
+        Returns:
+            A dictionary of message id to message object. Messages that could
+            not be retrieved are logged and left out.
+        """
+        messages: Dict[str, Dict[str, str]] = {}
+        pending = set(ids)
+        attempt = 0
+        while pending:
+            throttled = set()
+
+            def callback(request_id: str, response: Dict[str, str], error):
+                if error is None:
+                    messages[request_id] = response
+                elif is_rate_limit_error(error):
+                    self.metrics.count("throttled")
+                    throttled.add(request_id)
+                else:
+                    _logger.warning(
+                        f"Could not retrieve Gmail message {request_id}."
+                        f" Error: {error}."
+                    )
+
+            batch = self.service.new_batch_http_request(callback=callback)
+            for id in pending:
+                batch.add(
+                    self._message_request(id, form, metadata), request_id=id
+                )
+            self.engine.execute(
+                lambda http: batch.execute(http=http),
+                constants.GMAIL_QUOTA_COSTS["messages.get"] * len(pending),
+            )
+
+            if throttled and attempt >= constants.GMAIL_MAX_RETRIES:
+                _logger.warning(
+                    f"Could not retrieve {len(throttled)} Gmail messages."
+                    f" Still rate limited after {attempt} retries."
+                )
+                break
+            elif throttled:
+                self.engine.backoff(attempt)
+                attempt += 1
+            pending = throttled
+
+        return messages
+
+    def _execute(self, request, method: str) -> Dict[str, str]:
+        """ Executes a single API request on the fetch engine.
+
+        Args:
+            request: A googleapiclient HttpRequest.
+            method: The API method of the request, a key of
+                GMAIL_QUOTA_COSTS.
+
+        Returns:
+            The deserialized response.
+        """
+        return self.engine.execute(
+            lambda http: request.execute(http=http),
+            constants.GMAIL_QUOTA_COSTS[method],
+        )
+
+    def _authorized_http(self):
+        """ Returns a new `httplib2.Http` authorized with the credentials.
+
+        Google only compresses responses for user agents containing "gzip",
+        which batch requests do not otherwise send.
+        """
+        http = set_user_agent(build_http(), constants.GMAIL_USER_AGENT)
+        return self._count_bytes(self.cred.authorize(http))
+
+    def _count_bytes(self, http):
+        """ Wraps an `httplib2.Http` to add the size of every response body
+            to `bytes_received`, and trace and measure every request.
+
+        Args:
+            http: The `httplib2.Http` to wrap.
+
+        Returns:
+            The same `httplib2.Http`.
+        """
+        request = http.request
+
+        def counted_request(uri, *args, **kwargs):
+            method = kwargs.get("method") or (args[0] if args else "GET")
+            start = time.perf_counter()
+            with tracer.span(method, "http", url=uri.split("?")[0]) as span:
+                response, content = request(uri, *args, **kwargs)
+                span.set(bytes=len(content or b""), status=response.status)
+            self.metrics.record_request(
+                endpoint_name(method, uri),
+                time.perf_counter() - start,
+                len(content or b""),
+                ok=response.status < 400,
             )
+            with self._bytes_lock:
+                self.bytes_received += len(content or b"")
+            return response, content
+
+        http.request = counted_request
+        return http
+
+    def _masked(self, request: Dict[str, str], method: str) -> Dict[str, str]:
+        """ Adds the partial response field mask of an API method to the
+            arguments of a request, if field masks are enabled.
+
+        Args:
+            request: The keyword arguments of the request.
+            method: A key of GMAIL_FIELD_MASKS.
+
+        Returns:
+            The same request arguments.
+        """
+        if self.field_masks and method in constants.GMAIL_FIELD_MASKS:
+            request["fields"] = constants.GMAIL_FIELD_MASKS[method]
+        return request
+
+    def _message_request(
+        self,
+        id: str,
+        form: GmailMessageFormat = GmailMessageFormat.RAW,
+        metadata: List[str] = None,
+    ):
+        """ Builds an unexecuted `messages.get` request for a single message.
 
-    def print_email_list(self, emails: Dict[str, str]):
+        Args:
+            id: Id of a email.
+            form: The format of email to return.
+            metadata: metadata headers to include when receiving messages.
+
+        Returns:
+            A googleapiclient HttpRequest, ready to be executed or batched.
+        """
+        request = {"userId": "me", "id": id, "format": form.value}
+        if metadata:
+            request["metadataHeaders"] = metadata
+        request = self._masked(request, f"messages.get/{form.value}")
+        return self.service.users().messages().get(**request)
+
+    def print_email_list(
+        self,
+        emails: Iterable[Union[MessageSummary, Dict[str, str]]],
+        total: int = None,
+    ) -> bool:
         """ Prints a list of email previews, including the name of the sender
             and a snippet of the message.
 
+        Rows are printed as soon as each message is available, so `emails`
+        may be a lazy iterator such as `iter_messages_from_query`.
+
+        Args:
+            emails: An iterable of message summaries, or of METADATA message
+                objects from the Gmail API.
+            total: The expected number of emails, used to align the index
+                column. If not set, it is taken from `emails` if it has a
+                length.
+
+        Return:
+            True if the list of emails was successfully sent to stdout,
+            False otherwise.
+        """
+        width = self._index_width(emails, total)
+        try:
+            for i, m in enumerate(emails):
+                print(self._format_email_row(i, m, width))
+        except KeyError as e:
+            _logger.error(
+                f"An Gmail message object did not have expected keys."
+                f" Error: {e}."
+            )
+            return False
+        else:
+            return True
+
+    async def print_email_list_async(
+        self,
+        emails: AsyncIterable[Union[MessageSummary, Dict[str, str]]],
+        total: int = None,
+    ) -> bool:
+        """ Like `print_email_list`, but for an asynchronous iterable such as
+            `iter_messages_from_query_async`.
+
         Args:
-            emails: A list of message objects from the Gmail API.
+            emails: An asynchronous iterable of message summaries, or of
+                METADATA message objects from the Gmail API.
+            total: The expected number of emails, used to align the index
+                column.
 
         Return:
             True if the list of emails was successfully sent to stdout,
             False otherwise.
         """
+        width = self._index_width(emails, total)
+        i = 0
         try:
-            for m, i in zip(emails, range(len(emails))):
-                From = m["payload"]["headers"]
-                From = next(x["value"] for x in From if x["name"] == "From")
-                From = f"{(45 - len(From)) * ' '}{From[:45]}"
-                index = f"{((len(emails) // 10) - (i // 10)) * ' '}{i}"
-                print(f"|{index}|{From} | {m['snippet'][:140]} ")
+            async for m in emails:
+                print(self._format_email_row(i, m, width))
+                i += 1
         except KeyError as e:
             _logger.error(
                 f"An Gmail message object did not have expected keys."
@@ -138,6 +751,29 @@ class GmailHandler(object):
         else:
             return True
 
+    @staticmethod
+    def _index_width(emails, total: Union[None, int]) -> int:
+        """ Returns the width of the index column of an email list. If
+            `total` is not set, it is taken from `emails` if it has a length.
+        """
+        if total is None and hasattr(emails, "__len__"):
+            total = len(emails)
+        return len(str(max(total - 1, 0))) if total else 1
+
+    @staticmethod
+    def _format_email_row(
+        index: int, m: Union[MessageSummary, Dict[str, str]], width: int
+    ) -> str:
+        """ Formats a row of an email list.
+
+        Raises:
+            KeyError: If the message has no From header.
+        """
+        if not isinstance(m, MessageSummary):
+            m = MessageSummary.from_message(m)
+        From = f"{m.sender[:45]:>45}"
+        return f"|{index:>{width}}|{From} | {m.snippet[:140]} "
+
     def get_messages_from_query(
         self,
         query,
@@ -160,22 +796,472 @@ class GmailHandler(object):
 
         Returns: A list of Message objects filtered by the given query.
         """
-        messages = (
+        return list(
+            self.iter_messages_from_query(
+                query, form=form, metadata=metadata, max_messages=max_messages
+            )
+        )
+
+    def iter_messages_from_query(
+        self,
+        query,
+        form: GmailMessageFormat = GmailMessageFormat.RAW,
+        metadata: List[str] = None,
+        max_messages: int = None,
+    ) -> Iterator[Dict[str, str]]:
+        """ Lazily yields complete message objects for a single query.
+
+        Pages of message ids are listed in a background thread, and batches
+        of messages are fetched concurrently on the fetch engine, up to
+        GMAIL_READ_AHEAD_BATCHES ahead of the consumer, so only a bounded
+        number of messages are held in memory.
+
+        Args:
+            query: A query string to filter emails with. Same format as
+                string filtering in the gmail GUI.
+            form: The form of email to return, options are:
+                    'full', 'metadata', 'minimal', 'raw'.
+            metadata: metadata headers to include when receiving messages.
+            max_messages: The maximum number of messages to retrieve from
+                gmail servers. If not set, all messages matching the filter
+                will be returned.
+
+        Returns:
+            An iterator of Message objects filtered by the given query, in
+            the order returned by `messages.list`.
+        """
+        batches = self._iter_message_batches(
+            query, form, metadata, max_messages
+        )
+        for batch in read_ahead(
+            batches, depth=constants.GMAIL_READ_AHEAD_BATCHES
+        ):
+            yield from batch.result()
+
+    async def iter_messages_from_query_async(
+        self,
+        query,
+        form: GmailMessageFormat = GmailMessageFormat.RAW,
+        metadata: List[str] = None,
+        max_messages: int = None,
+    ) -> AsyncIterator[Dict[str, str]]:
+        """ Like `iter_messages_from_query`, but yields to the event loop
+            while waiting for messages.
+
+        Cancelling the consumer stops listing, and cancels the batch it was
+        waiting for if it has not started.
+
+        Args:
+            query: A query string to filter emails with.
+            form: The form of email to return.
+            metadata: metadata headers to include when receiving messages.
+            max_messages: The maximum number of messages to retrieve.
+
+        Returns:
+            An asynchronous iterator of Message objects filtered by the given
+            query, in the order returned by `messages.list`.
+        """
+        batches = self._iter_message_batches(
+            query, form, metadata, max_messages
+        )
+        async for batch in aread_ahead(
+            batches, depth=constants.GMAIL_READ_AHEAD_BATCHES
+        ):
+            for message in await asyncio.wrap_future(batch):
+                yield message
+
+    def iter_message_ids(
+        self,
+        query,
+        max_messages: int = None,
+        page_size: int = constants.GMAIL_LIST_PAGE_SIZE,
+    ) -> Iterator[Dict[str, str]]:
+        """ Lazily yields the ids of messages matching a query, following
+            `nextPageToken` until the results or `max_messages` run out.
+
+        Args:
+            query: A query string to filter emails with. Same format as
+                string filtering in the gmail GUI.
+            max_messages: The maximum number of ids to yield. If not set, all
+                messages matching the filter will be yielded.
+            page_size: The number of ids requested per page, at most 500.
+
+        Returns:
+            An iterator of partial message objects with keys: id.
+        """
+        remaining = max_messages
+        page_token = None
+        while remaining is None or remaining > 0:
+            request = {
+                "userId": "me",
+                "q": query,
+                "maxResults": page_size
+                if remaining is None
+                else min(remaining, page_size),
+            }
+            if page_token:
+                request["pageToken"] = page_token
+            request = self._masked(request, "messages.list")
+
+            page = self._execute(
+                self.service.users().messages().list(**request),
+                "messages.list",
+            )
+            messages = page.get("messages", [])
+            if remaining is not None:
+                messages = messages[0:remaining]
+                remaining -= len(messages)
+            yield from messages
+
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return
+
+    def modify_messages(
+        self,
+        query: str,
+        add_label_ids: List[str] = None,
+        remove_label_ids: List[str] = None,
+        progress: Callable[[int, int], None] = None,
+    ) -> int:
+        """ Adds and removes labels of every message matching a query, e.g.
+            removing INBOX to archive them.
+
+        Every matching id is listed before any message is modified. The
+        changes usually remove messages from the query's results, e.g.
+        archiving `in:inbox`, so pages listed after a change would be cut
+        from a shrinking result set and skip messages. Every
+        GMAIL_MODIFY_CHUNK_SIZE ids are then sent in one
+        `messages.batchModify` call on the fetch engine, so calls run
+        concurrently, rate limited and retried. At most
+        GMAIL_MODIFY_MAX_PENDING calls wait at once.
+
+        Args:
+            query: A query string to filter emails with.
+            add_label_ids: Ids of the labels to add to each message.
+            remove_label_ids: Ids of the labels to remove from each message.
+            progress: Called with the number of messages modified and the
+                number matching the query, each time a call completes.
+
+        Returns:
+            The number of messages modified.
+
+        Raises:
+            HttpError: If listing fails, or a call still fails after
+                GMAIL_MAX_RETRIES retries. Calls already sent complete.
+        """
+        labels = {
+            "addLabelIds": add_label_ids or [],
+            "removeLabelIds": remove_label_ids or [],
+        }
+        # Pages may overlap if messages arrive while listing.
+        ids = list(
+            dict.fromkeys(
+                m["id"]
+                for m in self.iter_message_ids(
+                    query, page_size=constants.GMAIL_MODIFY_LIST_PAGE_SIZE
+                )
+            )
+        )
+        pending: Deque[Tuple[Future, int]] = collections.deque()
+        modified = 0
+
+        def collect():
+            nonlocal modified
+            future, count = pending.popleft()
+            future.result()
+            modified += count
+            if progress is not None:
+                progress(modified, len(ids))
+
+        try:
+            for chunk in _chunked(ids, constants.GMAIL_MODIFY_CHUNK_SIZE):
+                pending.append(
+                    (
+                        self.engine.submit(self._modify_chunk, chunk, labels),
+                        len(chunk),
+                    )
+                )
+                while pending and (
+                    pending[0][0].done()
+                    or len(pending) > constants.GMAIL_MODIFY_MAX_PENDING
+                ):
+                    collect()
+            while pending:
+                collect()
+        finally:
+            for future, _ in pending:
+                future.cancel()
+        _logger.debug(f"Gmail fetch engine: {self.engine.stats()}.")
+        return modified
+
+    def _modify_chunk(self, ids: List[str], labels: Dict[str, List[str]]):
+        """ Modifies the labels of up to GMAIL_MODIFY_CHUNK_SIZE messages in
+            one call, retrying server errors with backoff. Throttled calls
+            are retried by the engine. batchModify is idempotent, so retries
+            are safe.
+        """
+        request = self.service.users().messages().batchModify(
+            userId="me", body={"ids": ids, **labels}
+        )
+        attempt = 0
+        while True:
+            try:
+                self._execute(request, "messages.batchModify")
+                break
+            except HttpError as e:
+                retry = e.resp.status >= 500
+                if not retry or attempt >= constants.GMAIL_MAX_RETRIES:
+                    raise
+                self.engine.backoff(attempt)
+                attempt += 1
+        # Stored METADATA payloads hold the old labels.
+        self.store.invalidate(ids)
+
+    def get_label_id(self, name: str) -> Union[None, str]:
+        """ Returns the id of a label, given its name or id, e.g. "Receipts"
+            or "STARRED". Names are matched case insensitively.
+        """
+        labels = self._execute(
             self.service.users()
-            .messages()
-            .list(userId="me", q=query)
-            .execute()
-        )
-        if max_messages:
-            return [
-                self.get_message_from_id(m["id"], form=form, metadata=metadata)
-                for m in messages["messages"][0:max_messages]
-            ]
-        else:
-            return [
-                self.get_message_from_id(m["id"], form=form, metadata=metadata)
-                for m in messages["messages"]
-            ]
+            .labels()
+            .list(**self._masked({"userId": "me"}, "labels.list")),
+            "labels.list",
+        ).get("labels", [])
+        for label in labels:
+            if label["id"] == name or label["name"].lower() == name.lower():
+                return label["id"]
+        return None
+
+    def export_messages(
+        self,
+        query: str,
+        writer: Union[MboxWriter, EmlWriter],
+        progress: Callable[[Dict[str, int]], None] = None,
+    ) -> Dict[str, int]:
+        """ Writes the RAW bytes of every message matching a query to an
+            mbox file or EML files.
+
+        Ids are listed a page at a time, and batches of RAW messages are
+        fetched and decoded concurrently on the fetch engine, up to
+        GMAIL_EXPORT_READ_AHEAD_BATCHES ahead of the writer, so memory stays
+        bounded however many messages match. Messages are written in listing
+        order, and after each batch is flushed to disk its ids are recorded
+        in the writer's checkpoint. Messages already recorded there are not
+        fetched again, so an interrupted export resumes where it stopped,
+        and exporting to the same path again only adds new messages.
+
+        Bodies are not kept in the local store, which would double the disk
+        an export takes.
+
+        Args:
+            query: A query string to filter emails with.
+            writer: Where to write the messages, from `open_writer`.
+            progress: Called with the counts so far after each batch.
+
+        Returns:
+            The counts of the export: "exported", "skipped" as already
+            exported, "failed" to fetch, and "bytes" written.
+
+        Raises:
+            HttpError: If listing fails.
+            OSError: If writing fails.
+        """
+        checkpoint = ExportCheckpoint(writer.checkpoint_path)
+        counts = {"exported": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        try:
+            offset = writer.open(checkpoint.offset)
+            if checkpoint.offset is None:
+                checkpoint.record([], offset)
+
+            batches = self._iter_export_batches(query, checkpoint.done, counts)
+            for batch, size in read_ahead(
+                batches, depth=constants.GMAIL_EXPORT_READ_AHEAD_BATCHES
+            ):
+                messages = batch.result()
+                for id, internal_date, raw in messages:
+                    counts["bytes"] += writer.write(id, internal_date, raw)
+                checkpoint.record((m[0] for m in messages), writer.flush())
+                counts["exported"] += len(messages)
+                counts["failed"] += size - len(messages)
+                if progress is not None:
+                    progress(counts)
+        finally:
+            writer.close()
+            checkpoint.close()
+        _logger.debug(f"Gmail fetch engine: {self.engine.stats()}.")
+        return counts
+
+    def _iter_export_batches(
+        self, query: str, done: Set[str], counts: Dict[str, int]
+    ) -> Iterator[Tuple[Future, int]]:
+        """ Lists the messages matching a query that have not been exported,
+            starting a RAW fetch on the fetch engine for every
+            GMAIL_BATCH_SIZE ids, and counting those skipped in `counts`.
+
+        Returns:
+            An iterator of futures of batches from `_get_raw_batch`, and the
+            number of messages requested in each.
+        """
+        ids = self.iter_message_ids(
+            query, page_size=constants.GMAIL_EXPORT_LIST_PAGE_SIZE
+        )
+
+        def pending():
+            for m in ids:
+                if m["id"] in done:
+                    counts["skipped"] += 1
+                else:
+                    yield m["id"]
+
+        for chunk in _chunked(pending(), constants.GMAIL_BATCH_SIZE):
+            yield self.engine.submit(self._get_raw_batch, chunk), len(chunk)
+
+    def _get_raw_batch(self, ids: List[str]) -> List[Tuple[str, int, bytes]]:
+        """ Fetches and decodes up to GMAIL_BATCH_SIZE RAW messages with a
+            single batch request, bypassing the local store.
+
+        Returns:
+            A list of tuples of the id, internal date and RFC 2822 bytes of
+            each message, in the same order as `ids`. Messages that could not
+            be retrieved are logged and left out.
+        """
+        fetched = self._batch_get_messages(ids, GmailMessageFormat.RAW, None)
+        messages = []
+        for id in ids:
+            message = fetched.get(id)
+            if message is None:
+                continue
+            with tracer.span("base64", "decode", bytes=len(message["raw"])):
+                raw = base64.urlsafe_b64decode(message["raw"])
+            messages.append((id, int(message.get("internalDate", 0)), raw))
+        return messages
+
+    def get_attachments(self, id: str) -> List[Attachment]:
+        """ Lists the attachments of a message, without their bytes.
+
+        Args:
+            id: Id of a email.
+
+        Returns:
+            The attachments of the message, in the order of its parts.
+        """
+        return attachments_of(
+            self.get_message_from_id(id, form=GmailMessageFormat.FULL)
+        )
+
+    def download_attachment(self, attachment: Attachment) -> Tuple[str, bool]:
+        """ Downloads an attachment into the attachment store, unless it was
+            downloaded before.
+
+        The response's base64 is decoded and written a chunk at a time while
+        it is hashed, so the decoded file is never held in memory. Files are
+        stored by their hash, so an attachment shared by many messages takes
+        its space once.
+
+        Args:
+            attachment: The attachment, from `get_attachments`.
+
+        Returns:
+            A tuple of the SHA-256 hex digest of the attachment, which names
+            its file in the attachment store, and whether it was downloaded.
+        """
+        digest = self.store.get_attachment(
+            attachment.message_id, attachment.part_id
+        )
+        hit = digest is not None and digest in self.attachments
+        self.metrics.count_cache("attachment", hit, not hit)
+        if hit:
+            return digest, False
+
+        request = self._masked(
+            {
+                "userId": "me",
+                "messageId": attachment.message_id,
+                "id": attachment.attachment_id,
+            },
+            "messages.attachments.get",
+        )
+        data = self._execute(
+            self.service.users().messages().attachments().get(**request),
+            "messages.attachments.get",
+        )["data"]
+        with tracer.span("base64", "decode", bytes=len(data)):
+            digest, size, new = self.attachments.write(iter_decoded(data))
+        if not new:
+            _logger.debug(
+                f"Attachment {attachment.filename} of Gmail message "
+                f"{attachment.message_id} was already stored as {digest}."
+            )
+        self.store.put_attachment(
+            attachment.message_id, attachment.part_id, digest
+        )
+        return digest, True
+
+    def save_attachments(
+        self, attachments: List[Attachment], directory: str
+    ) -> List[Tuple[str, bool]]:
+        """ Downloads attachments concurrently on the fetch engine, and
+            copies each to a directory under its filename.
+
+        Args:
+            attachments: The attachments, from `get_attachments`.
+            directory: The directory to copy them to, created if necessary.
+
+        Returns:
+            A tuple for each attachment, in order, of the path of its copy
+            and whether it was downloaded rather than already stored.
+
+        Raises:
+            HttpError: If an attachment could not be downloaded.
+            OSError: If an attachment could not be written.
+        """
+        futures = [
+            self.engine.submit(self.download_attachment, a)
+            for a in attachments
+        ]
+        saved = []
+        try:
+            for attachment, future in zip(attachments, futures):
+                digest, downloaded = future.result()
+                path = self.attachments.save_as(
+                    digest, directory, attachment.filename
+                )
+                saved.append((path, downloaded))
+        finally:
+            for future in futures:
+                future.cancel()
+        return saved
+
+    def _iter_message_batches(
+        self,
+        query,
+        form: GmailMessageFormat,
+        metadata: Union[None, List[str]],
+        max_messages: Union[None, int],
+    ) -> Iterator[Future]:
+        """ Lists the messages matching a query, starting a batch fetch on the
+            fetch engine for every GMAIL_BATCH_SIZE ids.
+
+        Args:
+            query: A query string to filter emails with.
+            form: The form of email to return.
+            metadata: metadata headers to include when receiving messages.
+            max_messages: The maximum number of messages to retrieve.
+
+        Returns:
+            An iterator of futures of lists of at most GMAIL_BATCH_SIZE
+            messages, in order.
+        """
+        ids: List[str] = []
+        for m in self.iter_message_ids(query, max_messages=max_messages):
+            ids.append(m["id"])
+            if len(ids) == constants.GMAIL_BATCH_SIZE:
+                yield self._submit_messages(ids, form, metadata)
+                ids = []
+        if ids:
+            yield self._submit_messages(ids, form, metadata)
+        _logger.debug(f"Gmail fetch engine: {self.engine.stats()}.")
 
     def read_message(self, message: Dict[str, str]) -> bool:
         """ Given an index, prints the corresponding message
@@ -189,21 +1275,104 @@ class GmailHandler(object):
             False otherwise.
 
         """
+        return self.print_message(
+            base64.urlsafe_b64decode(message["raw"]), id=message.get("id")
+        )
+
+    def print_message(self, raw: bytes, id: str = None) -> bool:
+        """ Prints the sender, date and body of a message, given its decoded
+            RAW body.
+
+        The message is parsed as bytes, and only its best text part is
+        decoded. Attachments are skipped.
+
+        Args:
+            raw: The RFC 2822 bytes of the message, e.g. from
+                `get_message_body`.
+            id: Id of the email, used to memoise its rendered body.
+
+        Returns:
+            True, if it was successful in displaying the email.
+            False otherwise.
+        """
         # TODO: Think of a better way to represent individual emails.
         #  The current, dumps the html out to stdout.
         # Ideas:
         #   Render in browser, pop-up.
         #   Filter html tags.
-        msg_str = base64.urlsafe_b64decode(message["raw"].encode("ASCII"))
-
-        mime_msg = email.message_from_string(msg_str.decode())
+        mime_msg = mime.parse_message(raw)
         print(f"From: {mime_msg['From']}")
         print(f"Date: {mime_msg['Date']}")
-        h = html2text.HTML2Text()
-        h.ignore_links = True
 
-        if mime_msg.is_multipart():
-            for payload in mime_msg.get_payload():
-                print(h.handle(payload.get_payload(decode=False)))
-        else:
-            print(h.handle(mime_msg.get_payload(decode=False)))
+        text = self.render_body(mime_msg, id=id)
+        if text is None:
+            print("This email has no text to display.")
+            return False
+
+        print(text)
+        return True
+
+    def render_body(
+        self, message: Union[bytes, mime.MimePart], id: str = None
+    ) -> Union[None, str]:
+        """ Returns the best text part of a message, ready to be displayed.
+
+        Html is rendered in the renderer's worker pool. When an id is given,
+        the result is memoised by message id and part, so reading the message
+        again costs nothing, and added to the local search index.
+
+        Args:
+            message: The RFC 2822 bytes of the message, or the message
+                already parsed.
+            id: Id of the email.
+
+        Returns:
+            The text of the message, or None if it has no text body.
+        """
+        with tracer.span("mime", "decode"):
+            if isinstance(message, bytes):
+                message = mime.parse_message(message)
+            part = mime.best_body_part(message)
+            text = None if part is None else part.get_text()
+        if part is None:
+            return None
+
+        if part.get_content_subtype() == "html":
+            key = None if id is None else (id, part.offset)
+            with tracer.span("html2text", "render", chars=len(text)):
+                text = self.renderer.render(text, key=key)
+        if id is not None:
+            self.store.index_body(
+                id, text, {h: message[h] for h in ("From", "To", "Subject")}
+            )
+        return text
+
+    def search_messages(
+        self, query: str, max_messages: int = None
+    ) -> List[Dict[str, str]]:
+        """ Searches the messages fetched so far, in the local search index,
+            without querying Gmail.
+
+        Args:
+            query: The words to search for. See `GmailStore.search`.
+            max_messages: The most messages to return. If None, all matching
+                messages are returned.
+
+        Returns:
+            METADATA message objects with the GMAIL_LISTING_HEADERS, best
+                match first. Messages not stored in that format are fetched.
+        """
+        ids = self.store.search(query, max_messages)
+        variant = variant_of(
+            GmailMessageFormat.METADATA, constants.GMAIL_LISTING_HEADERS
+        )
+        messages = self.store.get_many(ids, variant)
+        missing = [id for id in ids if id not in messages]
+        if missing:
+            for m in self.get_messages_from_ids(
+                missing,
+                form=GmailMessageFormat.METADATA,
+                metadata=constants.GMAIL_LISTING_HEADERS,
+            ):
+                messages[m["id"]] = m
+        return [messages[id] for id in ids if id in messages]
@@ -0,0 +1,327 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Union
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import constants
+from metrics import endpoint_name
+
+_logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at
+    ON responses (accessed_at);
+"""
+
+# Headers describing the body as it came over the wire. Cached bodies are
+# already decoded, so these no longer apply.
+_TRANSFER_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+class CachedResponse(object):
+    """ A response held by an HttpCache.
+    """
+
+    __slots__ = ("status", "headers", "body", "stored_at")
+
+    def __init__(
+        self, status: int, headers: Dict[str, str], body: bytes, stored_at
+    ):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+
+    def validators(self) -> Dict[str, str]:
+        """ Returns the conditional request headers revalidating this
+            response, if it has an ETag or Last-Modified validator.
+        """
+        headers = CaseInsensitiveDict(self.headers)
+        validators = {}
+        if "etag" in headers:
+            validators["If-None-Match"] = headers["etag"]
+        if "last-modified" in headers:
+            validators["If-Modified-Since"] = headers["last-modified"]
+        return validators
+
+
+class HttpCache(object):
+    """
+        A local SQLite store of HTTP responses, keyed by a hash of their
+        request, bounded in total size by evicting the least recently used
+        responses.
+
+        Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = constants.FACEBOOK_HTTP_CACHE_MAX_BYTES,
+    ):
+        """
+        Args:
+            path: The path of the SQLite database. Parent directories are
+                created if necessary.
+            max_bytes: The most bytes of response bodies and headers held.
+
+        Returns:
+             Constructor.
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+
+    def close(self) -> bool:
+        """ Closes the underlying database.
+
+        Returns:
+            True if the cache was closed.
+        """
+        with self._lock:
+            self._db.close()
+        return True
+
+    @staticmethod
+    def key(method: str, url: str) -> str:
+        """ Returns the key of a request. URLs may hold access tokens, so
+            only their hash is stored.
+        """
+        return hashlib.sha256(f"{method} {url}".encode()).hexdigest()
+
+    def get(self, key: str) -> Union[None, CachedResponse]:
+        """ Gets a stored response, marking it as recently used.
+
+        Args:
+            key: The key of the request.
+
+        Returns:
+            The response, or None if it is not in the cache.
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT status, headers, body, stored_at FROM responses "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        status, headers, body, stored_at = row
+        return CachedResponse(status, json.loads(headers), body, stored_at)
+
+    def put(self, key: str, response: CachedResponse):
+        """ Stores a response, evicting the least recently used responses
+            until the cache fits in `max_bytes`. Responses larger than the
+            cache are not stored.
+
+        Args:
+            key: The key of the request.
+            response: The response to store.
+        """
+        headers = json.dumps(response.headers)
+        size = len(response.body) + len(headers)
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            if size > self.max_bytes:
+                return
+            self._db.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    response.status,
+                    headers,
+                    response.body,
+                    response.stored_at,
+                    time.time(),
+                    size,
+                ),
+            )
+            self._evict()
+
+    def refresh(self, key: str):
+        """ Marks a stored response as fresh, e.g. after the server confirmed
+            it has not changed.
+        """
+        with self._lock, self._db:
+            now = time.time()
+            self._db.execute(
+                "UPDATE responses SET stored_at = ?, accessed_at = ? "
+                "WHERE key = ?",
+                (now, now, key),
+            )
+
+    def clear(self):
+        """ Removes every stored response.
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses")
+
+    def _evict(self):
+        """ Removes the least recently used responses until the cache fits.
+            Must be called with the lock held.
+        """
+        total = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        )
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        _logger.debug(f"Evicted {len(evicted)} cached responses.")
+
+
+class CachingAdapter(BaseAdapter):
+    """
+        A transport adapter answering GET requests from an HttpCache.
+
+        A cached response younger than its endpoint's TTL is served without a
+        request. An older one is revalidated with its ETag or Last-Modified
+        validator, and served again if the server answers 304 Not Modified.
+        Requests with a "Cache-Control: no-cache" header always revalidate.
+
+        The cache is private to the user, and keyed by URLs holding their
+        access token, so responses are cached whatever their Cache-Control
+        header says. Their freshness comes from the TTLs alone.
+
+        Counts its `hits`, including revalidated responses, and `misses`,
+        for Metrics.track_cache. Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        cache: HttpCache,
+        ttls: Dict[str, float] = None,
+        transport: BaseAdapter = None,
+    ):
+        """
+        Args:
+            cache: The store of responses.
+            ttls: Seconds a response stays fresh, by endpoint name from
+                `metrics.endpoint_name`, e.g. "GET /me". Responses of other
+                endpoints are revalidated every time.
+            transport: The adapter sending requests. Defaults to an
+                HTTPAdapter.
+
+        Returns:
+             Constructor.
+        """
+        super().__init__()
+        self.cache = cache
+        if ttls is None:
+            ttls = constants.FACEBOOK_HTTP_CACHE_TTLS
+        self.ttls = ttls
+        self.transport = transport or HTTPAdapter()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def send(self, request: requests.PreparedRequest, **kwargs):
+        if request.method != "GET":
+            return self.transport.send(request, **kwargs)
+
+        key = HttpCache.key(request.method, request.url)
+        cached = self.cache.get(key)
+        if cached is not None:
+            ttl = self.ttls.get(endpoint_name(request.method, request.url), 0)
+            if "no-cache" in request.headers.get("Cache-Control", ""):
+                ttl = 0
+            if time.time() - cached.stored_at < ttl:
+                self._count(hit=True)
+                return self._response(request, cached, "fresh")
+            request.headers.update(cached.validators())
+
+        response = self.transport.send(request, **kwargs)
+        if cached is not None and response.status_code == 304:
+            self._count(hit=True)
+            self.cache.refresh(key)
+            replayed = self._response(request, cached, "revalidated")
+            replayed.elapsed = response.elapsed
+            response.close()
+            return replayed
+
+        self._count(hit=False)
+        if response.status_code == 200:
+            headers = {
+                k: v
+                for k, v in response.headers.items()
+                if k.lower() not in _TRANSFER_HEADERS
+            }
+            self.cache.put(
+                key,
+                CachedResponse(200, headers, response.content, time.time()),
+            )
+        return response
+
+    def close(self):
+        self.transport.close()
+
+    def _count(self, hit: bool):
+        """ Counts a lookup. Requests are sent from several threads at once.
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _response(
+        self,
+        request: requests.PreparedRequest,
+        cached: CachedResponse,
+        source: str,
+    ) -> requests.Response:
+        """ Builds a response to a request from a cached one.
+
+        Args:
+            request: The request answered.
+            cached: The cached response.
+            source: How the response was served, "fresh" or "revalidated",
+                set as its `from_cache` attribute.
+        """
+        response = requests.Response()
+        response.status_code = cached.status
+        response.headers = CaseInsensitiveDict(cached.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = cached.body
+        response.reason = "OK"
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = datetime.timedelta(0)
+        response.from_cache = source
+        return response
@@ -0,0 +1,91 @@
+import heapq
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, NamedTuple, Tuple
+
+_logger = logging.getLogger(__name__)
+
+
+class InboxItem(NamedTuple):
+    """ A compact, service independent summary of something new, e.g. an
+        email, a post or an event.
+
+    Attributes:
+        timestamp: When the item happened, in seconds since the epoch.
+        service: The name of the service the item came from.
+        kind: What the item is, e.g. "email".
+        sender: Who the item is from.
+        summary: A one line summary of the item.
+        id: The item's id in its service.
+    """
+
+    timestamp: float
+    service: str
+    kind: str
+    sender: str
+    summary: str
+    id: str
+
+
+def format_item(item: InboxItem) -> str:
+    """ Formats an item as a row of the inbox.
+    """
+    when = datetime.fromtimestamp(item.timestamp).strftime("%Y-%m-%d %H:%M")
+    return (
+        f"{when} | {item.service:<8} | {item.kind:<5} | "
+        f"{item.sender[:24]:<24} | {item.summary[:80]}"
+    )
+
+
+async def merge_newest_first(
+    streams: Dict[str, AsyncIterator[InboxItem]], timeout: float
+) -> AsyncIterator[InboxItem]:
+    """ Merges streams of items that are each newest first into one stream
+        that is newest first, with a heap holding the next item of each.
+
+    An item can only be yielded once every stream has offered its next item,
+    so the streams are all waited on concurrently. A stream that fails, or
+    that does not offer an item within `timeout` seconds, is left out of the
+    rest of the merge so it cannot hold up the others.
+
+    Args:
+        streams: The streams to merge, by name.
+        timeout: Seconds to wait for a stream's next item.
+
+    Returns:
+        An asynchronous iterator of the items of every stream, newest first.
+    """
+    import asyncio
+
+    # Entries are (-timestamp, tie breaker, item, stream name).
+    heap: List[Tuple[float, int, InboxItem, str]] = []
+    order = 0
+
+    async def advance(name: str):
+        nonlocal order
+        try:
+            item = await asyncio.wait_for(anext(streams[name]), timeout)
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            _logger.warning(
+                f"{name} did not answer within {timeout}s. Leaving it out."
+            )
+            return
+        except Exception as e:
+            _logger.warning(f"Could not get items from {name}. Error: {e}.")
+            return
+        heapq.heappush(heap, (-item.timestamp, order, item, name))
+        order += 1
+
+    try:
+        await asyncio.gather(*(advance(name) for name in streams))
+        while heap:
+            _, _, item, name = heapq.heappop(heap)
+            yield item
+            await advance(name)
+    finally:
+        for stream in streams.values():
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
@@ -0,0 +1,246 @@
+import collections
+import math
+import re
+import threading
+import time
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
+import constants
+
+_VERSION = re.compile(r"v\d+(\.\d+)?")
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """ Names the endpoint of a request, with ids in its path replaced, so
+        requests for different messages or events count together, e.g.
+        "GET /gmail/v1/users/me/messages/{id}".
+
+    Args:
+        method: The HTTP method of the request.
+        url: The URL of the request.
+
+    Returns:
+        The method and path of the endpoint.
+    """
+    segments = [s for s in urlparse(url).path.split("/") if s]
+    # Graph API paths may start with a version, or not.
+    if segments and _VERSION.fullmatch(segments[0]):
+        segments = segments[1:]
+    path = "/".join(
+        "{id}"
+        if any(c.isdigit() for c in s) and not _VERSION.fullmatch(s)
+        else s
+        for s in segments
+    )
+    return f"{method} /{path}"
+
+
+class LatencyHistogram(object):
+    """
+        A fixed memory histogram of durations, with logarithmic buckets so
+        percentiles have the same relative precision at every scale.
+
+        Recording is a logarithm and an increment. Each bucket is
+        2^(1 / buckets_per_doubling) times wider than the last, so with the
+        default 8 buckets per doubling a percentile is within 9% of the
+        true value.
+    """
+
+    def __init__(
+        self,
+        minimum: float = constants.METRICS_HISTOGRAM_MIN_SECONDS,
+        maximum: float = constants.METRICS_HISTOGRAM_MAX_SECONDS,
+        buckets_per_doubling: int = 8,
+    ):
+        """
+        Args:
+            minimum: Durations up to this many seconds share the first
+                bucket.
+            maximum: Durations from this many seconds share the last bucket.
+            buckets_per_doubling: The number of buckets between a duration
+                and twice it.
+
+        Returns:
+             Constructor.
+        """
+        self.minimum = minimum
+        self._scale = buckets_per_doubling / math.log(2)
+        self.buckets = [0] * (
+            int(math.log(maximum / minimum) * self._scale) + 2
+        )
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """ Adds a duration to the histogram.
+        """
+        if seconds <= self.minimum:
+            index = 0
+        else:
+            index = min(
+                int(math.log(seconds / self.minimum) * self._scale) + 1,
+                len(self.buckets) - 1,
+            )
+        self.buckets[index] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """ Returns the upper bound of the bucket holding the p-th
+            percentile, in seconds, or 0 if nothing has been recorded.
+
+        Args:
+            p: The percentile, from 0 to 100.
+        """
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= max(rank, 1):
+                return min(
+                    self.minimum * math.exp(index / self._scale), self.max
+                )
+        return self.max
+
+
+class EndpointStats(object):
+    """ The requests, failures, bytes and latencies of one endpoint.
+    """
+
+    __slots__ = ("requests", "errors", "bytes", "latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = LatencyHistogram()
+
+
+class Metrics(object):
+    """
+        Live counters of a service handler: per-endpoint request counts,
+        latency histograms and bytes, named counters such as retries and
+        throttles, and the hit ratios of its caches.
+
+        Memory is fixed per endpoint, and every update holds one lock
+        briefly, so handlers update their metrics on every request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.counters = collections.Counter()
+        self._cache_counts = collections.defaultdict(lambda: [0, 0])
+        self._tracked_caches = {}
+        self.since = time.time()
+
+    def record_request(
+        self, endpoint: str, seconds: float, size: int, ok: bool = True
+    ):
+        """ Records a completed request.
+
+        Args:
+            endpoint: The endpoint's name, e.g. from `endpoint_name`.
+            seconds: How long the request took.
+            size: The bytes of the response body.
+            ok: False if the request failed.
+        """
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.requests += 1
+            stats.errors += not ok
+            stats.bytes += size
+            stats.latency.record(seconds)
+
+    def count(self, name: str, n: int = 1):
+        """ Adds to a named counter, e.g. "retries" or "throttled".
+        """
+        with self._lock:
+            self.counters[name] += n
+
+    def count_cache(self, name: str, hits: int, misses: int):
+        """ Records lookups of a cache that does not count its own.
+        """
+        with self._lock:
+            counts = self._cache_counts[name]
+            counts[0] += hits
+            counts[1] += misses
+
+    def track_cache(self, name: str, cache: Any):
+        """ Reports the hit ratio of a cache that counts its own `hits` and
+            `misses`, e.g. an LRUCache.
+        """
+        with self._lock:
+            self._tracked_caches[name] = (cache, cache.hits, cache.misses)
+
+    def reset(self):
+        """ Clears every counter, starting a new measurement period.
+        """
+        with self._lock:
+            self.endpoints.clear()
+            self.counters.clear()
+            self._cache_counts.clear()
+            self._tracked_caches = {
+                name: (cache, cache.hits, cache.misses)
+                for name, (cache, _, _) in self._tracked_caches.items()
+            }
+            self.since = time.time()
+
+    def caches(self) -> Dict[str, List[int]]:
+        """ Returns the hits and misses of every cache since the last reset.
+        """
+        with self._lock:
+            caches = {k: list(v) for k, v in self._cache_counts.items()}
+            for name, (cache, hits, misses) in self._tracked_caches.items():
+                caches[name] = [cache.hits - hits, cache.misses - misses]
+        return caches
+
+    def report(self) -> List[str]:
+        """ Returns the metrics as lines of a table, ready to print.
+        """
+        lines = [
+            f"Since {time.strftime('%X', time.localtime(self.since))}, "
+            f"{time.time() - self.since:.0f}s ago."
+        ]
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            counters = sorted(self.counters.items())
+            rows = [
+                (
+                    name,
+                    stats.requests,
+                    stats.errors,
+                    stats.bytes,
+                    [stats.latency.percentile(p) for p in (50, 90, 99)],
+                )
+                for name, stats in endpoints
+            ]
+        if rows:
+            width = max(len(row[0]) for row in rows)
+            lines.append(
+                f"{'endpoint':<{width}} | {'requests':>8} | {'errors':>6} | "
+                f"{'kB':>9} | {'p50 ms':>7} | {'p90 ms':>7} | {'p99 ms':>7}"
+            )
+            for name, requests, errors, size, percentiles in rows:
+                lines.append(
+                    f"{name:<{width}} | {requests:>8} | {errors:>6} | "
+                    f"{size / 1024:>9.1f} | "
+                    + " | ".join(f"{p * 1000:>7.1f}" for p in percentiles)
+                )
+        else:
+            lines.append("No requests.")
+        if counters:
+            lines.append(", ".join(f"{k}: {v}" for k, v in counters))
+
+        for name, (hits, misses) in sorted(self.caches().items()):
+            lookups = hits + misses
+            ratio = f"{hits / lookups:.0%}" if lookups else "-"
+            lines.append(
+                f"{name} cache: {ratio} hits ({hits} of {lookups} lookups)."
+            )
+        return lines
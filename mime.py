@@ -0,0 +1,218 @@
+import binascii
+import logging
+from email import policy
+from email.parser import BytesHeaderParser
+from typing import Iterator, Tuple, Union
+
+import constants
+
+_logger = logging.getLogger(__name__)
+
+_HEADER_PARSER = BytesHeaderParser(policy=policy.default)
+
+
+class MimePart(object):
+    """
+        A MIME part that is parsed lazily from the raw bytes of a message.
+
+        Only the headers of a part are parsed when it is created. Its
+        children are found by scanning for the multipart boundary, and its
+        body is only decoded when asked for, so the bodies of parts that are
+        never displayed (e.g. attachments) are never copied or decoded.
+    """
+
+    def __init__(self, raw: bytes, start: int = 0, end: int = None):
+        """
+        Args:
+            raw: The RFC 2822 bytes of the whole message.
+            start: The offset in `raw` where this part's headers start.
+            end: The offset in `raw` where this part ends. If not set, the
+                part extends to the end of `raw`.
+
+        Returns:
+             Constructor.
+        """
+        self._raw = raw
+        self.offset = start
+        self._end = len(raw) if end is None else end
+        headers_end, self._body_start = _split_headers(raw, start, self._end)
+        self.headers = _HEADER_PARSER.parsebytes(raw[start:headers_end])
+
+    def __getitem__(self, name: str):
+        return self.headers[name]
+
+    def get_content_type(self) -> str:
+        """ Returns the part's content type, e.g. 'text/html'.
+        """
+        return self.headers.get_content_type()
+
+    def get_content_subtype(self) -> str:
+        """ Returns the part's content subtype, e.g. 'html'.
+        """
+        return self.headers.get_content_subtype()
+
+    def is_multipart(self) -> bool:
+        """ Returns True if the part contains other parts.
+        """
+        return self.headers.get_content_maintype() == "multipart"
+
+    def is_attachment(self) -> bool:
+        """ Returns True if the part's Content-Disposition is attachment.
+        """
+        return self.headers.is_attachment()
+
+    @property
+    def body_size(self) -> int:
+        """ The size of the part's body, before it is decoded.
+        """
+        return self._end - self._body_start
+
+    def iter_parts(self) -> Iterator["MimePart"]:
+        """ Lazily yields the direct children of a multipart part.
+
+        Returns:
+            An iterator of child parts, in order. Empty if the part is not
+            multipart.
+        """
+        boundary = self.headers.get_boundary()
+        if not self.is_multipart() or not boundary:
+            return
+
+        delimiter = b"--" + boundary.encode("ASCII", "replace")
+        position = self._find_delimiter(delimiter, self._body_start)
+        while position != -1:
+            after = position + len(delimiter)
+            if self._raw.startswith(b"--", after):
+                # The close delimiter.
+                return
+            line_end = self._raw.find(b"\n", after, self._end)
+            if line_end == -1:
+                return
+
+            start = line_end + 1
+            position = self._find_delimiter(delimiter, start)
+            end = self._end if position == -1 else position - 1
+            if end > start and self._raw[end - 1 : end] == b"\r":
+                end -= 1
+            yield MimePart(self._raw, start, max(start, end))
+
+    def walk(self) -> Iterator["MimePart"]:
+        """ Lazily walks this part and all of its descendants, depth first.
+        """
+        yield self
+        for part in self.iter_parts():
+            yield from part.walk()
+
+    def get_body(self) -> bytes:
+        """ Returns the part's body, decoded from its transfer encoding.
+        """
+        body = self._raw[self._body_start : self._end]
+        encoding = self.headers.get("Content-Transfer-Encoding", "")
+        encoding = str(encoding).strip().lower()
+        try:
+            if encoding == "base64":
+                return binascii.a2b_base64(body)
+            if encoding == "quoted-printable":
+                return binascii.a2b_qp(body)
+        except binascii.Error as e:
+            _logger.info(f"Could not decode {encoding} body. Error: {e}.")
+        return body
+
+    def get_text(self) -> str:
+        """ Returns the part's body, decoded to a string with its charset.
+            Characters that cannot be decoded are replaced.
+        """
+        body = self.get_body()
+        charset = self.headers.get_content_charset("utf-8")
+        try:
+            return body.decode(charset, "replace")
+        except LookupError:
+            _logger.info(f"Unknown charset {charset}. Decoding as utf-8.")
+            return body.decode("utf-8", "replace")
+
+    def _find_delimiter(self, delimiter: bytes, position: int) -> int:
+        """ Finds the next boundary delimiter line at or after a line start.
+
+        Returns:
+            The offset of the delimiter, or -1 if there is none.
+        """
+        if self._raw.startswith(delimiter, position):
+            return position
+        index = self._raw.find(b"\n" + delimiter, position, self._end)
+        return -1 if index == -1 else index + 1
+
+
+def _split_headers(raw: bytes, start: int, end: int) -> Tuple[int, int]:
+    """ Finds the blank line separating a part's headers from its body.
+
+    Returns:
+        A tuple of the offset where the headers end and the offset where the
+        body starts.
+    """
+    for blank in (b"\r\n", b"\n"):
+        if raw.startswith(blank, start):
+            return start, start + len(blank)
+
+    crlf = raw.find(b"\r\n\r\n", start, end)
+    lf = raw.find(b"\n\n", start, end)
+    if crlf != -1 and (lf == -1 or crlf < lf):
+        return crlf + 2, crlf + 4
+    if lf != -1:
+        return lf + 1, lf + 2
+    return end, end
+
+
+def parse_message(raw: bytes) -> MimePart:
+    """ Parses the RFC 2822 bytes of a message, without decoding them to a
+        string first.
+
+    Args:
+        raw: The decoded RAW body of a message.
+
+    Returns:
+        The root part of the message.
+    """
+    return MimePart(raw)
+
+
+def iter_text_parts(message: MimePart) -> Iterator[MimePart]:
+    """ Lazily walks the MIME tree of a message, yielding the text/plain and
+        text/html parts that are not attachments.
+
+    Args:
+        message: A parsed message.
+
+    Returns:
+        An iterator of text parts, in the order they appear.
+    """
+    for part in message.walk():
+        if part.is_attachment():
+            continue
+        if part.get_content_type() in ("text/plain", "text/html"):
+            yield part
+
+
+def best_body_part(
+    message: MimePart,
+    preference: Tuple[str, ...] = constants.GMAIL_BODY_PREFERENCE,
+) -> Union[None, MimePart]:
+    """ Picks the part of a message that best represents its body.
+
+    The walk stops as soon as a part of the most preferred subtype is found.
+
+    Args:
+        message: A parsed message.
+        preference: Text subtypes in order of preference, e.g.
+            ("html", "plain").
+
+    Returns:
+        The best text part, or None if the message has no text body.
+    """
+    found = {}
+    for part in iter_text_parts(message):
+        subtype = part.get_content_subtype()
+        if subtype == preference[0]:
+            return part
+        found.setdefault(subtype, part)
+
+    return next((found[s] for s in preference if s in found), None)
@@ -0,0 +1,144 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import queue
+import threading
+from typing import AsyncIterator, Iterable, Iterator, TypeVar
+
+_logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Seconds a blocked producer waits before re-checking if the consumer left.
+_PRODUCER_POLL_INTERVAL = 0.1
+
+
+class _EndOfIteration(object):
+    """ Marks the end of the producer's iterable on the read-ahead queue.
+    """
+
+    pass
+
+
+class _ProducerError(object):
+    """ Carries an exception raised by the producer back to the consumer.
+    """
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def read_ahead(iterable: Iterable[T], depth: int = 1) -> Iterator[T]:
+    """ Iterates over `iterable` in a background thread, keeping up to
+        `depth` items ready ahead of the consumer.
+
+    This lets slow producers (e.g. paginated network requests) fetch the next
+    item while the current one is being consumed. Exceptions raised by the
+    producer are re-raised in the consumer, in order. If the consumer stops
+    iterating early, the producer is stopped once its current item is ready.
+
+    Args:
+        iterable: The iterable to consume in the background.
+        depth: The maximum number of items to hold ahead of the consumer.
+
+    Returns:
+        An iterator over the same items, in the same order.
+    """
+    items: queue.Queue = queue.Queue(maxsize=max(depth, 1))
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=_PRODUCER_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_ProducerError(e))
+        else:
+            put(_EndOfIteration())
+
+    # The producer runs in the consumer's context, e.g. its traced command.
+    context = contextvars.copy_context()
+    producer = threading.Thread(
+        target=context.run, args=(produce,), daemon=True
+    )
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if isinstance(item, _EndOfIteration):
+                return
+            if isinstance(item, _ProducerError):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+
+
+async def aread_ahead(
+    iterable: Iterable[T], depth: int = 1
+) -> AsyncIterator[T]:
+    """ Like `read_ahead`, but for consumers on an event loop: the iterable
+        is consumed in a background thread without blocking the loop.
+
+    If the consumer is cancelled or stops iterating early, the producer is
+    stopped once its current item is ready.
+
+    Args:
+        iterable: The iterable to consume in the background.
+        depth: The maximum number of items to hold ahead of the consumer.
+
+    Returns:
+        An asynchronous iterator over the same items, in the same order.
+    """
+    loop = asyncio.get_running_loop()
+    items: asyncio.Queue = asyncio.Queue(maxsize=max(depth, 1))
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        if stopped.is_set():
+            return False
+        try:
+            asyncio.run_coroutine_threadsafe(items.put(item), loop).result()
+        except (RuntimeError, concurrent.futures.CancelledError):
+            # The event loop closed, or cancelled the put.
+            return False
+        return not stopped.is_set()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_ProducerError(e))
+        else:
+            put(_EndOfIteration())
+
+    context = contextvars.copy_context()
+    threading.Thread(
+        target=context.run, args=(produce,), daemon=True
+    ).start()
+    try:
+        while True:
+            item = await items.get()
+            if isinstance(item, _EndOfIteration):
+                return
+            if isinstance(item, _ProducerError):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        # Unblocks a producer waiting for room on the queue.
+        while not items.empty():
+            items.get_nowait()
@@ -0,0 +1,318 @@
+import collections
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Union
+
+import constants
+
+_logger = logging.getLogger(__name__)
+
+# The statistics of the command running in the current context, if any.
+_command: contextvars.ContextVar = contextvars.ContextVar(
+    "command", default=None
+)
+
+
+class Span(object):
+    """ A timed operation, recorded when its block exits.
+    """
+
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def set(self, **args):
+        """ Adds arguments to the span, e.g. a byte count once it is known.
+        """
+        self.args.update(args)
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(
+            self.name,
+            self.category,
+            self.start,
+            time.perf_counter() - self.start,
+            **self.args,
+        )
+
+
+class _NullSpan(object):
+    """ Stands in for a span while tracing is disabled, at no cost.
+    """
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _CommandStats(object):
+    """ The time, count and bytes of the spans of one command, by category,
+        and its cProfile profiles.
+    """
+
+    def __init__(self, number: int, text: str):
+        self.number = number
+        self.text = text
+        self.categories = collections.defaultdict(lambda: [0.0, 0, 0])
+        self.profiles: List[Any] = []
+        self._lock = threading.Lock()
+
+    def add(self, category: str, duration: float, size: int):
+        with self._lock:
+            totals = self.categories[category]
+            totals[0] += duration
+            totals[1] += 1
+            totals[2] += size
+
+    def add_profile(self, profile):
+        with self._lock:
+            self.profiles.append(profile)
+
+
+class Tracer(object):
+    """
+        Records spans of commands, HTTP requests, decoding and rendering, for
+        per-command summaries and a Chrome trace of the session.
+
+        Disabled by default, when spans cost a single attribute check. When
+        `profile_dir` is set, each command is also profiled with cProfile,
+        on the threads it runs on, and its stats written there.
+    """
+
+    def __init__(self, max_spans: int = constants.PROFILE_MAX_SPANS):
+        """
+        Args:
+            max_spans: The most spans held for the trace. The oldest are
+                dropped first.
+
+        Returns:
+             Constructor.
+        """
+        self.enabled = False
+        self.profile_dir = None
+        self.spans = collections.deque(maxlen=max_spans)
+        self._threads: Dict[int, str] = {}
+        self._origin = time.perf_counter()
+        self._numbers = itertools.count(1)
+        self._local = threading.local()
+
+    def configure(self, enabled: bool, profile_dir: str = None):
+        """ Turns tracing on or off.
+
+        Args:
+            enabled: If True, spans are recorded and each command's summary
+                is logged.
+            profile_dir: If set, commands are profiled with cProfile and
+                their stats written to this directory.
+        """
+        self.enabled = enabled or profile_dir is not None
+        self.profile_dir = profile_dir
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def span(
+        self, name: str, category: str, **args
+    ) -> Union[Span, _NullSpan]:
+        """ Returns a span timing a block, e.g.
+            `with tracer.span("GET", "http", url=url) as span: ...`.
+
+        Args:
+            name: What the block does.
+            category: One of command, http, decode or render.
+            args: Details shown in the trace. A "bytes" argument is also
+                summed into the command's summary.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, category, args)
+
+    def record(
+        self, name: str, category: str, start: float, duration: float, **args
+    ):
+        """ Records a span that has already finished.
+
+        Args:
+            name: What was done.
+            category: One of command, http, decode or render.
+            start: When it started, by `time.perf_counter`.
+            duration: Seconds it took.
+            args: Details shown in the trace.
+        """
+        if not self.enabled:
+            return
+        thread = threading.get_ident()
+        if thread not in self._threads:
+            self._threads[thread] = threading.current_thread().name
+        self.spans.append((name, category, start, duration, thread, args))
+
+        stats = _command.get()
+        if stats is not None and category != "command":
+            stats.add(category, duration, args.get("bytes", 0))
+
+    @contextlib.contextmanager
+    def command(self, text: str) -> Iterator[None]:
+        """ Traces a command, logging a summary of where its time went once
+            it finishes, and profiling it if `profile_dir` is set.
+
+        Work the command starts on other threads counts towards it, as long
+        as the thread was started with the command's context.
+
+        Args:
+            text: The command, as typed.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        stats = _CommandStats(next(self._numbers), text)
+        token = _command.set(stats)
+        profile = self._start_profile()
+        start = time.perf_counter()
+        try:
+            with self.span(text, "command"):
+                yield
+        finally:
+            self._stop_profile(profile, stats)
+            _command.reset(token)
+            self._finish(stats, time.perf_counter() - start)
+
+    def profiled(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """ Wraps a function run in a worker thread for a command, so the
+            command's profile includes it. Run it with the command's context,
+            e.g. through `asyncio.to_thread`.
+        """
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            stats = _command.get()
+            profile = None if stats is None else self._start_profile()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._stop_profile(profile, stats)
+
+        return run
+
+    def export_chrome_trace(self, path: str) -> int:
+        """ Writes the recorded spans in Chrome's trace event format, for
+            chrome://tracing or Perfetto.
+
+        Args:
+            path: The file to write.
+
+        Returns:
+            The number of spans written.
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": thread,
+                "args": {"name": name},
+            }
+            for thread, name in list(self._threads.items())
+        ]
+        spans = list(self.spans)
+        for name, category, start, duration, thread, args in spans:
+            events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": (start - self._origin) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": pid,
+                    "tid": thread,
+                    "args": args,
+                }
+            )
+        with open(path, "w") as f:
+            json.dump(
+                {"traceEvents": events, "displayTimeUnit": "ms"},
+                f,
+                default=str,
+            )
+        return len(spans)
+
+    def _start_profile(self):
+        """ Starts profiling the calling thread with a `cProfile.Profile`,
+            unless profiling is off or the thread is already profiled, e.g.
+            by a concurrent command.
+        """
+        if self.profile_dir is None or getattr(
+            self._local, "profiling", False
+        ):
+            return None
+        # Imported here, as most sessions never profile.
+        import cProfile
+
+        self._local.profiling = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _stop_profile(self, profile, stats: _CommandStats):
+        if profile is None:
+            return
+        profile.disable()
+        self._local.profiling = False
+        stats.add_profile(profile)
+
+    def _finish(self, stats: _CommandStats, duration: float):
+        """ Logs the summary of a finished command, and writes its profile.
+        """
+        parts = []
+        for category, (seconds, count, size) in sorted(
+            stats.categories.items()
+        ):
+            part = f"{category} {seconds * 1000:.0f} ms ({count}"
+            if size:
+                part += f", {size / 1024:.1f} kB"
+            parts.append(part + ")")
+        _logger.info(
+            f"`{stats.text}` took {duration * 1000:.0f} ms"
+            + (f": {', '.join(parts)}." if parts else ".")
+        )
+
+        if self.profile_dir is None or not stats.profiles:
+            return
+        name = re.sub(r"\W+", "-", stats.text).strip("-")[:40]
+        path = os.path.join(
+            self.profile_dir, f"{stats.number:04d}-{name}.prof"
+        )
+        import pstats
+
+        pstats.Stats(*stats.profiles).dump_stats(path)
+        _logger.info(f"Wrote the profile of `{stats.text}` to {path}.")
+
+
+# The tracer of the process, configured by waddle.py's --verbose and
+# --profile flags.
+tracer = Tracer()
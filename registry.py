@@ -0,0 +1,161 @@
+import importlib
+import logging
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    NamedTuple,
+    Tuple,
+    Union,
+)
+
+from controller_interface import ServiceController
+from exceptions import NotAuthenticatedError
+from inbox import InboxItem
+
+_logger = logging.getLogger(__name__)
+
+
+class ServiceEntry(NamedTuple):
+    """ Describes a service without importing it.
+
+    Attributes:
+        name: The name of the service, shown to the user.
+        description: The description of the service, shown to the user.
+        module: The module defining the service's controller.
+        controller: The name of the controller class in `module`.
+    """
+
+    name: str
+    description: str
+    module: str
+    controller: str
+
+
+# The available services. Only the modules of services the user selects are
+# imported, so their API clients do not slow down starting the CLI.
+SERVICES: Tuple[ServiceEntry, ...] = (
+    ServiceEntry(
+        name="Gmail",
+        description="This service allows you to view emails from your Gmail "
+        "account.",
+        module="controller_gmail",
+        controller="GmailController",
+    ),
+    ServiceEntry(
+        name="Facebook",
+        description="This service allows users to interact with their "
+        "Facebook account.",
+        module="controller_facebook",
+        controller="FacebookController",
+    ),
+)
+
+
+class LazyServiceController(ServiceController):
+    """
+        Stands in for a service's controller until it is first used, then
+        imports and constructs it and delegates to it.
+    """
+
+    def __init__(self, entry: ServiceEntry):
+        """
+        Args:
+            entry: The service to load.
+
+        Returns:
+             Constructor.
+        """
+        self.entry = entry
+        self._controller: Union[None, ServiceController] = None
+
+    @property
+    def loaded(self) -> bool:
+        """ True once the service's controller has been imported.
+        """
+        return self._controller is not None
+
+    @property
+    def controller(self) -> ServiceController:
+        """ The service's controller, imported on first access.
+        """
+        if self._controller is None:
+            _logger.debug(
+                f"Loading {self.entry.name} from {self.entry.module}."
+            )
+            module = importlib.import_module(self.entry.module)
+            self._controller = getattr(module, self.entry.controller)()
+        return self._controller
+
+    def get_name(self) -> str:
+        return self.entry.name
+
+    def get_description(self) -> str:
+        return self.entry.description
+
+    def close(self) -> bool:
+        """ Closes the service's controller, if it was ever loaded.
+        """
+        if self._controller is None:
+            return True
+        return self._controller.close()
+
+    def is_authenticated(self) -> bool:
+        # A service that was never loaded cannot have been signed in to.
+        return self.loaded and self._controller.is_authenticated()
+
+    def authenticate_from_file(self, path: str) -> bool:
+        return self.controller.authenticate_from_file(path)
+
+    def authenticate(self) -> bool:
+        return self.controller.authenticate()
+
+    def run(self) -> bool:
+        return self.controller.run()
+
+    async def run_async(self) -> bool:
+        return await self.controller.run_async()
+
+    def process_args(self, args: List[str]) -> bool:
+        return self.controller.process_args(args)
+
+    async def process_args_async(self, args: List[str]) -> bool:
+        return await self.controller.process_args_async(args)
+
+    def get_metrics(self):
+        # A service that has not been loaded has made no requests.
+        return self._controller.get_metrics() if self.loaded else None
+
+    def help(self, args: List[str]) -> bool:
+        return self.controller.help(args)
+
+    def records_async(
+        self, args: List[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        return self.controller.records_async(args)
+
+    def inbox_streams(
+        self, limit: int
+    ) -> Dict[str, AsyncIterator[InboxItem]]:
+        """ Returns the streams of the service's controller. A service that
+            was never loaded cannot have been signed in to, so it is not
+            loaded for this.
+        """
+        if self._controller is None:
+            raise NotAuthenticatedError()
+        return self._controller.inbox_streams(limit)
+
+
+def load_services(
+    entries: Tuple[ServiceEntry, ...] = SERVICES
+) -> List[LazyServiceController]:
+    """ Creates a lazily loaded controller for each service.
+
+    Args:
+        entries: The services to create controllers for.
+
+    Returns:
+        A controller per service, none of which have been imported yet.
+    """
+    return [LazyServiceController(entry) for entry in entries]
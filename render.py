@@ -0,0 +1,155 @@
+import html
+import logging
+import multiprocessing
+import re
+import signal
+import threading
+from typing import Hashable
+
+import constants
+from cache import LRUCache
+
+import html2text
+
+_logger = logging.getLogger(__name__)
+
+_TAG = re.compile(r"<[^>]*>")
+_INVISIBLE = re.compile(
+    r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL
+)
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def html_to_text(source: str) -> str:
+    """ Renders html to readable text with html2text. Run in the worker pool.
+
+    Args:
+        source: The html to render.
+
+    Returns:
+        The rendered text.
+    """
+    h = html2text.HTML2Text()
+    h.ignore_links = True
+    return h.handle(source)
+
+
+def strip_html(source: str) -> str:
+    """ Quickly reduces html to text by dropping its tags. Used when html is
+        too large or too slow to render with html2text.
+
+    Args:
+        source: The html to strip.
+
+    Returns:
+        The text content of the html.
+    """
+    text = _TAG.sub("", _INVISIBLE.sub("", source))
+    return _BLANK_LINES.sub("\n\n", html.unescape(text)).strip() + "\n"
+
+
+def _ignore_interrupts():
+    """ Stops worker processes from handling Ctrl-C, which the terminal also
+        sends to them. The controller cancels their work instead.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class HtmlRenderer(object):
+    """
+        Renders html to text in a pool of worker processes, so large html does
+        not block the caller's interpreter, and memoises the results.
+
+        Html larger than `max_chars`, or that takes longer than `timeout` to
+        render, falls back to `strip_html`.
+    """
+
+    def __init__(
+        self,
+        workers: int = constants.HTML_RENDER_WORKERS,
+        max_chars: int = constants.HTML_RENDER_MAX_CHARS,
+        timeout: float = constants.HTML_RENDER_TIMEOUT,
+    ):
+        """
+        Args:
+            workers: The number of worker processes.
+            max_chars: The largest html that is rendered with html2text.
+            timeout: Seconds to wait for a worker to render html.
+
+        Returns:
+             Constructor.
+        """
+        self.workers = workers
+        self.max_chars = max_chars
+        self.timeout = timeout
+        self.cache = LRUCache(
+            constants.HTML_RENDER_CACHE_MAX_CHARS, size_of=len
+        )
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def render(self, source: str, key: Hashable = None) -> str:
+        """ Renders html to text, or returns the text memoised for `key`.
+
+        Args:
+            source: The html to render.
+            key: Uniquely identifies the html, e.g. (message id, part). If
+                not set, the result is not memoised.
+
+        Returns:
+            The rendered text.
+        """
+        text = None if key is None else self.cache.get(key)
+        if text is not None:
+            return text
+
+        if len(source) > self.max_chars:
+            _logger.info(
+                f"Html of {len(source)} characters is too large to render."
+            )
+            text = strip_html(source)
+        else:
+            text = self._render_in_pool(source)
+        if key is not None:
+            self.cache.put(key, text)
+        return text
+
+    def close(self) -> bool:
+        """ Stops the worker processes.
+
+        Returns:
+            True once the workers have stopped.
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+        return True
+
+    def _render_in_pool(self, source: str) -> str:
+        """ Renders html with html2text in a worker process, falling back to
+            stripping its tags if the worker times out or fails.
+        """
+        with self._lock:
+            if self._pool is None:
+                # Spawned rather than forked, as the fetch engine's threads
+                # may hold locks at the time of the fork.
+                context = multiprocessing.get_context("spawn")
+                self._pool = context.Pool(
+                    self.workers, initializer=_ignore_interrupts
+                )
+            result = self._pool.apply_async(html_to_text, (source,))
+
+        try:
+            return result.get(timeout=self.timeout)
+        except multiprocessing.TimeoutError:
+            _logger.warning(
+                f"Rendering html took longer than {self.timeout}s. Showing "
+                f"it without formatting."
+            )
+            # The stuck worker cannot be cancelled, so replace the pool.
+            self.close()
+        except Exception as e:
+            _logger.warning(f"Could not render html. Error: {e}.")
+        return strip_html(source)
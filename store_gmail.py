@@ -0,0 +1,517 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+import constants
+
+_logger = logging.getLogger(__name__)
+
+# The variant under which RAW payloads are stored. RAW payloads never change,
+# so unlike other variants they are kept when a message is invalidated.
+RAW_VARIANT = "raw"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payloads (
+    id TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    body TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (id, variant)
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    message_id TEXT NOT NULL,
+    part_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (message_id, part_id)
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# The full-text index of fetched messages. Its rowids are those of
+# `indexed`, which maps them to message ids. Prefix indexes of 2 and 3
+# characters make short prefix queries as fast as whole words.
+_SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    internal_date INTEGER
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(
+    sender,
+    recipients,
+    subject,
+    snippet,
+    body,
+    prefix = '2 3',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# The columns of the search index.
+_SEARCH_FIELDS = ("sender", "recipients", "subject", "snippet", "body")
+
+# The index's header columns, and the message headers indexed in each.
+_SEARCH_HEADERS = {
+    "sender": ("From",),
+    "recipients": ("To", "Cc"),
+    "subject": ("Subject",),
+}
+
+# Query prefixes restricting a term to a column, e.g. "from:alice".
+_SEARCH_COLUMNS = {
+    "from": "sender",
+    "to": "recipients",
+    "subject": "subject",
+}
+
+
+class GmailStore(object):
+    """
+        A local SQLite store of Gmail message payloads, keyed by message id
+        and the variant (format and headers) they were fetched with, along
+        with the mailbox `historyId` the store is synchronised to. Bounded
+        in total size by evicting the payloads fetched longest ago, as they
+        can be fetched again.
+
+        Messages with headers are also added to a full-text index as they are
+        stored, and rendered bodies once they are read, so fetched mail can
+        be searched offline. The index needs SQLite's FTS5 extension. Without
+        it, `searchable` is False. A message is dropped from the index when
+        its last payload is evicted.
+
+        Safe to share between threads.
+    """
+
+    def __init__(
+        self, path: str, max_bytes: int = constants.GMAIL_STORE_MAX_BYTES
+    ):
+        """
+        Args:
+            path: The path of the SQLite database. Parent directories are
+                created if necessary.
+            max_bytes: The most bytes of message payloads held.
+
+        Returns:
+             Constructor.
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+            columns = [
+                row[1]
+                for row in self._db.execute("PRAGMA table_info(payloads)")
+            ]
+            if "size" not in columns:
+                # Stores from before payloads were sized.
+                self._db.execute(
+                    "ALTER TABLE payloads "
+                    "ADD COLUMN size INTEGER NOT NULL DEFAULT 0"
+                )
+                self._db.execute("UPDATE payloads SET size = length(body)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS payloads_fetched_at "
+                "ON payloads (fetched_at, size)"
+            )
+        self.searchable = self._create_index()
+
+    def close(self) -> bool:
+        """ Closes the underlying database.
+
+        Returns:
+            True if the store was closed.
+        """
+        with self._lock:
+            self._db.close()
+        return True
+
+    def get(self, id: str, variant: str) -> Union[None, Dict[str, str]]:
+        """ Gets a stored message payload.
+
+        Args:
+            id: Id of a email.
+            variant: The variant the message was stored under.
+
+        Returns:
+            The stored message object, or None if it is not in the store.
+        """
+        return self.get_many([id], variant).get(id)
+
+    def get_many(
+        self, ids: List[str], variant: str
+    ) -> Dict[str, Dict[str, str]]:
+        """ Gets the stored payloads of several messages.
+
+        Args:
+            ids: Ids of emails.
+            variant: The variant the messages were stored under.
+
+        Returns:
+            A dictionary of message id to message object, for the ids that
+            are in the store.
+        """
+        if not ids:
+            return {}
+
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, body FROM payloads WHERE variant = ? AND id IN "
+                f"({','.join('?' * len(ids))})",
+                [variant, *ids],
+            ).fetchall()
+        return {id: json.loads(body) for id, body in rows}
+
+    def put_many(self, messages: Iterable[Dict[str, str]], variant: str):
+        """ Stores message payloads, replacing any existing ones of the same
+            variant, then evicts the payloads fetched longest ago until the
+            store fits in `max_bytes`. Payloads larger than the store are
+            only indexed.
+
+        Args:
+            messages: Message objects from the Gmail API. Must have an `id`.
+            variant: The variant to store the messages under.
+        """
+        now = time.time()
+        messages = list(messages)
+        rows = []
+        for m in messages:
+            body = json.dumps(m)
+            if len(body) <= self.max_bytes:
+                rows.append((m["id"], variant, body, now, len(body)))
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO payloads VALUES (?, ?, ?, ?, ?)", rows
+            )
+            for m in messages:
+                self._index(m["id"], **_search_fields(m))
+            self._evict()
+
+    def invalidate(self, ids: Iterable[str] = None):
+        """ Drops the mutable (non RAW) payloads of messages, for example
+            after their labels have changed.
+
+        Args:
+            ids: Ids of emails. If not set, every message is invalidated.
+        """
+        with self._lock, self._db:
+            if ids is None:
+                self._db.execute(
+                    "DELETE FROM payloads WHERE variant != ?", (RAW_VARIANT,)
+                )
+            else:
+                self._db.executemany(
+                    "DELETE FROM payloads WHERE id = ? AND variant != ?",
+                    [(id, RAW_VARIANT) for id in ids],
+                )
+
+    def delete(self, ids: Iterable[str]):
+        """ Removes every payload of messages that no longer exist.
+
+        Args:
+            ids: Ids of emails.
+        """
+        ids = [(id,) for id in ids]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM payloads WHERE id = ?", ids)
+            self._db.executemany(
+                "DELETE FROM attachments WHERE message_id = ?", ids
+            )
+            self._unindex(ids)
+
+    def get_attachment(
+        self, message_id: str, part_id: str
+    ) -> Union[None, str]:
+        """ Gets the digest of a downloaded attachment in an
+            AttachmentStore.
+
+        Args:
+            message_id: Id of the email.
+            part_id: Id of the attachment's MIME part.
+
+        Returns:
+            The SHA-256 hex digest, or None if it has not been downloaded.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM attachments "
+                "WHERE message_id = ? AND part_id = ?",
+                (message_id, part_id),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def put_attachment(self, message_id: str, part_id: str, digest: str):
+        """ Records the digest of a downloaded attachment.
+
+        Args:
+            message_id: Id of the email.
+            part_id: Id of the attachment's MIME part.
+            digest: The SHA-256 hex digest of its bytes.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO attachments VALUES (?, ?, ?)",
+                (message_id, part_id, digest),
+            )
+
+    def index_body(self, id: str, body: str, headers: Dict[str, str] = None):
+        """ Adds the rendered text body of a message to the search index.
+
+        Args:
+            id: Id of a email.
+            body: The text of the message, as displayed. Only its first
+                GMAIL_SEARCH_BODY_MAX_CHARS characters are indexed.
+            headers: Headers of the message to index with it, e.g. if it was
+                read without being listed first.
+        """
+        headers = headers or {}
+        fields = {
+            column: ", ".join(
+                str(headers[h]) for h in names if headers.get(h)
+            )
+            or None
+            for column, names in _SEARCH_HEADERS.items()
+        }
+        with self._lock, self._db:
+            self._index(
+                id,
+                body=body[: constants.GMAIL_SEARCH_BODY_MAX_CHARS],
+                **fields,
+            )
+
+    def search(self, query: str, limit: int = None) -> List[str]:
+        """ Searches the index of fetched messages.
+
+        Every word of the query must match, as the prefix of a word in the
+        message's headers, snippet or body. A word may be restricted to a
+        header with "from:", "to:" or "subject:". Results are ranked by BM25,
+        with matches in the subject and sender weighing most.
+
+        Args:
+            query: The words to search for, e.g. "from:ali invoice".
+            limit: The most results to return. If None, all are returned.
+
+        Returns:
+            The ids of the matching emails, best match first.
+        """
+        match = _match_expression(query)
+        if not self.searchable or not match:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT indexed.id FROM search "
+                "JOIN indexed ON indexed.rowid = search.rowid "
+                "WHERE search MATCH ? "
+                "ORDER BY bm25(search, 5.0, 2.0, 8.0, 1.0, 1.0), "
+                "indexed.internal_date DESC LIMIT ?",
+                (match, -1 if limit is None else limit),
+            ).fetchall()
+        return [id for id, in rows]
+
+    def _evict(self):
+        """ Removes the payloads fetched longest ago until the store fits,
+            and the indexed fields of the messages left with none. Must be
+            called with the lock held, in a transaction.
+        """
+        total = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM payloads"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT id, variant, size FROM payloads ORDER BY fetched_at"
+        )
+        evicted = []
+        for id, variant, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((id, variant))
+            total -= size
+        self._db.executemany(
+            "DELETE FROM payloads WHERE id = ? AND variant = ?", evicted
+        )
+        self._unindex(
+            (id,)
+            for id in {id for id, _ in evicted}
+            if not self._db.execute(
+                "SELECT 1 FROM payloads WHERE id = ?", (id,)
+            ).fetchone()
+        )
+        _logger.debug(f"Evicted {len(evicted)} stored payloads.")
+
+    def _unindex(self, ids: Iterable[Tuple[str]]):
+        """ Removes messages from the search index. Must be called with the
+            lock held, in a transaction.
+
+        Args:
+            ids: One-tuples of the ids of emails.
+        """
+        if not self.searchable:
+            return
+        ids = list(ids)
+        self._db.executemany(
+            "DELETE FROM search WHERE rowid = "
+            "(SELECT rowid FROM indexed WHERE id = ?)",
+            ids,
+        )
+        self._db.executemany("DELETE FROM indexed WHERE id = ?", ids)
+
+    def _create_index(self) -> bool:
+        """ Creates the search index, filling it from the stored payloads if
+            it is new.
+
+        Returns:
+            True if the index is available.
+        """
+        try:
+            with self._lock, self._db:
+                new = not self._db.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'search'"
+                ).fetchone()
+                self._db.executescript(_SEARCH_SCHEMA)
+        except sqlite3.OperationalError as e:
+            _logger.warning(
+                f"Search is unavailable, as SQLite has no FTS5. Error: {e}."
+            )
+            return False
+        if new:
+            with self._lock, self._db:
+                self.searchable = True
+                for body, in self._db.execute(
+                    "SELECT body FROM payloads WHERE variant != ?",
+                    (RAW_VARIANT,),
+                ).fetchall():
+                    message = json.loads(body)
+                    self._index(message["id"], **_search_fields(message))
+        return True
+
+    def _index(self, id: str, internal_date: int = None, **fields):
+        """ Adds or updates the indexed fields of a message. Fields that are
+            None keep their indexed value. Must be called with the lock held,
+            in a transaction.
+        """
+        if not self.searchable:
+            return
+        row = self._db.execute(
+            "SELECT rowid, internal_date FROM indexed WHERE id = ?", (id,)
+        ).fetchone()
+        if row is None:
+            rowid = self._db.execute(
+                "INSERT INTO indexed (id, internal_date) VALUES (?, ?)",
+                (id, internal_date),
+            ).lastrowid
+            current = {}
+        else:
+            rowid = row[0]
+            if internal_date is not None and internal_date != row[1]:
+                self._db.execute(
+                    "UPDATE indexed SET internal_date = ? WHERE rowid = ?",
+                    (internal_date, rowid),
+                )
+            indexed = self._db.execute(
+                f"SELECT {', '.join(_SEARCH_FIELDS)} FROM search "
+                f"WHERE rowid = ?",
+                (rowid,),
+            ).fetchone()
+            current = dict(zip(_SEARCH_FIELDS, indexed or ()))
+
+        values = {
+            column: current.get(column)
+            if fields.get(column) is None
+            else fields[column]
+            for column in _SEARCH_FIELDS
+        }
+        if values == current:
+            return
+        self._db.execute("DELETE FROM search WHERE rowid = ?", (rowid,))
+        self._db.execute(
+            f"INSERT INTO search (rowid, {', '.join(_SEARCH_FIELDS)}) "
+            f"VALUES (?, ?, ?, ?, ?, ?)",
+            (rowid, *values.values()),
+        )
+
+    @property
+    def history_id(self) -> Union[None, str]:
+        """ The mailbox `historyId` the store is synchronised to, or None if
+            the store has never been synchronised.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM state WHERE key = 'history_id'"
+            ).fetchone()
+        return row[0] if row else None
+
+    @history_id.setter
+    def history_id(self, value: str):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO state VALUES ('history_id', ?)",
+                (str(value),),
+            )
+
+
+def _search_fields(message: Dict[str, Any]) -> Dict[str, Any]:
+    """ Returns the indexed fields of a message object from the Gmail API.
+        Fields it does not have are None.
+    """
+    headers = {}
+    for header in message.get("payload", {}).get("headers", []):
+        headers.setdefault(header["name"].lower(), []).append(header["value"])
+    fields = {
+        column: ", ".join(
+            v for h in names for v in headers.get(h.lower(), [])
+        )
+        or None
+        for column, names in _SEARCH_HEADERS.items()
+    }
+    fields["snippet"] = message.get("snippet")
+    if "internalDate" in message:
+        fields["internal_date"] = int(message["internalDate"])
+    return fields
+
+
+def _match_expression(query: str) -> str:
+    """ Turns the words of a search into an FTS5 match expression, matching
+        every word as a prefix. Words are quoted, so they are never read as
+        FTS5 syntax.
+    """
+    terms = []
+    for word in query.split():
+        column = None
+        prefix, _, rest = word.partition(":")
+        if rest and prefix.lower() in _SEARCH_COLUMNS:
+            column, word = _SEARCH_COLUMNS[prefix.lower()], rest
+        # Punctuation separates tokens, so it is searched as spaces.
+        word = re.sub(r"[^\w]+", " ", word).strip()
+        if not word:
+            continue
+        term = '"' + word.replace('"', '""') + '"*'
+        terms.append(f"{column} : {term}" if column else term)
+    return " AND ".join(terms)
+
+
+def variant_of(form, metadata: List[str] = None) -> str:
+    """ Returns the store variant of a message fetched with the given format
+        and metadata headers.
+
+    Args:
+        form: The GmailMessageFormat the message was fetched with.
+        metadata: metadata headers included when fetching the message.
+
+    Returns:
+        A string uniquely identifying the variant.
+    """
+    if metadata:
+        return f"{form.value}:{','.join(sorted(metadata))}"
+    return form.value
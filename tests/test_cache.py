@@ -0,0 +1,57 @@
+import time
+
+from cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    # Reading "a" makes "b" the least recently used.
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_are_evicted_until_a_value_fits():
+    cache = LRUCache(max_size=10, size_of=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    cache.put("c", "xxxxxxxx")
+    assert "a" not in cache
+    assert "b" not in cache
+    assert cache.get("c") == "xxxxxxxx"
+
+
+def test_value_larger_than_the_cache_is_not_added():
+    cache = LRUCache(max_size=4, size_of=len)
+    cache.put("a", "xx")
+    cache.put("b", "xxxxx")
+    assert "b" not in cache
+    assert cache.get("a") == "xx"
+
+
+def test_replacing_a_value_frees_its_size():
+    cache = LRUCache(max_size=4, size_of=len)
+    cache.put("a", "xxx")
+    cache.put("a", "x")
+    cache.put("b", "xxx")
+    assert len(cache) == 2
+
+
+def test_idle_entries_expire():
+    cache = LRUCache(max_size=10, idle_timeout=0.05)
+    cache.put("a", 1)
+    time.sleep(0.1)
+    assert cache.get("a", "missing") == "missing"
+    assert len(cache) == 0
+
+
+def test_hits_and_misses_are_counted():
+    cache = LRUCache(max_size=10)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from exporter_gmail import (
+    EmlWriter,
+    ExportCheckpoint,
+    MboxWriter,
+    open_writer,
+)
+
+
+def test_checkpoint_resumes_with_the_recorded_ids(tmp_path):
+    path = str(tmp_path / "export.checkpoint")
+    checkpoint = ExportCheckpoint(path)
+    assert (checkpoint.done, checkpoint.offset) == (set(), None)
+    checkpoint.record(["1", "2"], 100)
+    checkpoint.record(["3"], 150)
+    checkpoint.close()
+
+    resumed = ExportCheckpoint(path)
+    assert resumed.done == {"1", "2", "3"}
+    assert resumed.offset == 150
+    resumed.close()
+
+
+def test_torn_checkpoint_line_is_dropped(tmp_path):
+    path = str(tmp_path / "export.checkpoint")
+    checkpoint = ExportCheckpoint(path)
+    checkpoint.record(["1"], 100)
+    checkpoint.close()
+    with open(path, "a") as f:
+        f.write('{"offset": 200, "ids": ["2"')
+
+    resumed = ExportCheckpoint(path)
+    assert (resumed.done, resumed.offset) == ({"1"}, 100)
+    # Lines recorded after the torn one are read back.
+    resumed.record(["3"], 300)
+    resumed.close()
+    assert ExportCheckpoint(path).done == {"1", "3"}
+
+
+def test_mbox_resume_drops_what_follows_the_checkpoint(tmp_path):
+    path = str(tmp_path / "export.mbox")
+    writer = MboxWriter(path)
+    writer.open()
+    writer.write("1", 0, b"Subject: One\r\n\r\nOne.\r\n")
+    offset = writer.flush()
+    # Written, but interrupted before its checkpoint.
+    writer.write("2", 0, b"Subject: Two\r\n\r\nTwo.\r\n")
+    writer.close()
+    assert os.path.getsize(path) > offset
+
+    resumed = MboxWriter(path)
+    assert resumed.open(offset) == offset
+    resumed.write("2", 0, b"Subject: Two\r\n\r\nTwo.\r\n")
+    resumed.close()
+    with open(path, "rb") as f:
+        assert f.read().count(b"Subject: Two") == 1
+
+
+def test_mbox_quotes_from_lines(tmp_path):
+    path = str(tmp_path / "export.mbox")
+    writer = MboxWriter(path)
+    writer.open()
+    writer.write("1", 0, b"Subject: x\r\n\r\nFrom here.\r\n>From there.")
+    writer.close()
+    with open(path, "rb") as f:
+        lines = f.read().split(b"\n")
+    assert lines[0].startswith(b"From 1@gmail ")
+    assert lines[3:6] == [b">From here.", b">>From there.", b""]
+
+
+def test_eml_files_are_named_by_id(tmp_path):
+    writer = EmlWriter(str(tmp_path))
+    writer.open()
+    writer.write("abc", 1000, b"Subject: x\r\n\r\nBody.")
+    with open(tmp_path / "abc.eml", "rb") as f:
+        assert f.read() == b"Subject: x\r\n\r\nBody."
+    assert os.path.getmtime(tmp_path / "abc.eml") == 1
+
+
+def test_unknown_export_format(tmp_path):
+    with pytest.raises(ValueError):
+        open_writer("pst", str(tmp_path))
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from fetcher_gmail import TokenBucket
+
+
+def test_full_bucket_does_not_wait():
+    bucket = TokenBucket(rate=10, capacity=10)
+    start = time.monotonic()
+    bucket.acquire(10)
+    assert time.monotonic() - start < 0.05
+
+
+def test_empty_bucket_waits_for_its_refill():
+    bucket = TokenBucket(rate=100, capacity=10)
+    bucket.acquire(10)
+    start = time.monotonic()
+    bucket.acquire(10)
+    assert 0.08 < time.monotonic() - start < 0.3
+
+
+def test_request_larger_than_the_capacity_leaves_a_debt():
+    bucket = TokenBucket(rate=100, capacity=5)
+    start = time.monotonic()
+    bucket.acquire(20)
+    assert time.monotonic() - start < 0.05
+    # The 15 tokens owed and the one asked for take 0.16s to refill.
+    bucket.acquire(1)
+    assert 0.14 < time.monotonic() - start < 0.4
+
+
+def test_waiting_threads_share_the_rate():
+    bucket = TokenBucket(rate=100, capacity=10)
+    threads = [
+        threading.Thread(target=bucket.acquire, args=(10,)) for _ in range(5)
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The first request is served from the full bucket.
+    assert 0.38 < time.monotonic() - start < 0.8
+
+
+def test_rate_changes_while_a_thread_waits():
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.acquire(10)
+    waiter = threading.Thread(target=bucket.acquire, args=(10,))
+    waiter.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    bucket.set_rate(20)
+    # The waiter sleeps without holding the bucket's lock.
+    assert time.monotonic() - start < 0.05
+    assert bucket.rate == 20
+    waiter.join()
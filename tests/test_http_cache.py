@@ -0,0 +1,105 @@
+import datetime
+import io
+import time
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from http_cache import CachedResponse, CachingAdapter, HttpCache
+
+
+class _Transport(BaseAdapter):
+    """ Answers requests with queued status codes, recording the headers of
+        each request.
+    """
+
+    def __init__(self, *statuses: int):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(dict(request.headers))
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response.headers = CaseInsensitiveDict(
+            {"ETag": '"v1"', "Content-Type": "application/json"}
+        )
+        response._content = b"" if response.status_code == 304 else b"{}"
+        response.raw = io.BytesIO(response._content)
+        response.request = request
+        response.url = request.url
+        response.elapsed = datetime.timedelta(0)
+        return response
+
+    def close(self):
+        pass
+
+
+def _session(transport: BaseAdapter, ttls=None) -> requests.Session:
+    session = requests.Session()
+    session.mount(
+        "https://", CachingAdapter(HttpCache(":memory:"), ttls, transport)
+    )
+    return session
+
+
+def test_fresh_response_is_served_without_a_request():
+    transport = _Transport(200)
+    session = _session(transport, {"GET /me": 60})
+    session.get("https://graph.example.com/me")
+    response = session.get("https://graph.example.com/me")
+    assert response.from_cache == "fresh"
+    assert response.json() == {}
+    assert len(transport.sent) == 1
+
+
+def test_stale_response_is_revalidated_with_its_etag():
+    transport = _Transport(200, 304)
+    session = _session(transport, {})
+    session.get("https://graph.example.com/me")
+    response = session.get("https://graph.example.com/me")
+    assert transport.sent[1]["If-None-Match"] == '"v1"'
+    assert response.from_cache == "revalidated"
+    assert response.status_code == 200
+    assert response.json() == {}
+    adapter = session.get_adapter("https://graph.example.com")
+    assert (adapter.hits, adapter.misses) == (1, 1)
+
+
+def test_changed_response_replaces_the_cached_one():
+    transport = _Transport(200, 200, 304)
+    session = _session(transport, {})
+    session.get("https://graph.example.com/me")
+    response = session.get("https://graph.example.com/me")
+    assert getattr(response, "from_cache", None) is None
+    assert session.get("https://graph.example.com/me").from_cache == (
+        "revalidated"
+    )
+
+
+def test_no_cache_request_revalidates_a_fresh_response():
+    transport = _Transport(200, 304)
+    session = _session(transport, {"GET /me": 60})
+    session.get("https://graph.example.com/me")
+    response = session.get(
+        "https://graph.example.com/me", headers={"Cache-Control": "no-cache"}
+    )
+    assert response.from_cache == "revalidated"
+    assert len(transport.sent) == 2
+
+
+@pytest.fixture
+def cache():
+    cache = HttpCache(":memory:", max_bytes=100)
+    yield cache
+    cache.close()
+
+
+def test_least_recently_used_responses_are_evicted(cache):
+    for key in ("a", "b", "c"):
+        cache.put(key, CachedResponse(200, {}, b"x" * 40, time.time()))
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
@@ -0,0 +1,162 @@
+import base64
+
+import mime
+
+
+def _multipart(boundary: str, parts, newline: str = "\r\n") -> bytes:
+    """ Builds a multipart/mixed message from the headers and body of each
+        of its parts.
+    """
+    lines = [
+        "Subject: Test",
+        f'Content-Type: multipart/mixed; boundary="{boundary}"',
+        "",
+        "The preamble.",
+    ]
+    for headers, body in parts:
+        lines += [f"--{boundary}", *headers, "", body]
+    lines += [f"--{boundary}--", "The epilogue.", ""]
+    return newline.join(lines).encode()
+
+
+def test_parts_split_on_crlf_boundaries():
+    raw = _multipart(
+        "b1",
+        [
+            (["Content-Type: text/plain"], "Plain."),
+            (["Content-Type: text/html"], "<p>Html.</p>"),
+        ],
+    )
+    parts = list(mime.parse_message(raw).iter_parts())
+    assert [p.get_content_type() for p in parts] == [
+        "text/plain",
+        "text/html",
+    ]
+    # The line break before a delimiter belongs to the delimiter.
+    assert [p.get_body() for p in parts] == [b"Plain.", b"<p>Html.</p>"]
+
+
+def test_parts_split_on_lf_boundaries():
+    raw = _multipart(
+        "b1", [(["Content-Type: text/plain"], "Plain.")], newline="\n"
+    )
+    (part,) = mime.parse_message(raw).iter_parts()
+    assert part.get_body() == b"Plain."
+
+
+def test_boundary_text_inside_a_line_is_not_a_delimiter():
+    raw = _multipart(
+        "b1", [(["Content-Type: text/plain"], "Not a delimiter: --b1 here.")]
+    )
+    (part,) = mime.parse_message(raw).iter_parts()
+    assert part.get_body() == b"Not a delimiter: --b1 here."
+
+
+def test_unterminated_multipart_ends_with_the_message():
+    raw = _multipart("b1", [(["Content-Type: text/plain"], "Plain.")])
+    raw = raw[: raw.index(b"--b1--")]
+    (part,) = mime.parse_message(raw).iter_parts()
+    assert part.get_body().rstrip() == b"Plain."
+
+
+def test_nested_multipart_is_walked_depth_first():
+    inner = _multipart(
+        "inner",
+        [
+            (["Content-Type: text/plain"], "Plain."),
+            (["Content-Type: text/html"], "<p>Html.</p>"),
+        ],
+    ).decode()
+    inner_headers, _, inner_body = inner.partition("\r\n\r\n")
+    raw = _multipart(
+        "outer",
+        [
+            (inner_headers.split("\r\n")[1:], inner_body),
+            (
+                [
+                    "Content-Type: text/html",
+                    'Content-Disposition: attachment; filename="a.html"',
+                ],
+                "<p>Attached.</p>",
+            ),
+        ],
+    )
+    message = mime.parse_message(raw)
+    assert [p.get_content_type() for p in message.walk()] == [
+        "multipart/mixed",
+        "multipart/mixed",
+        "text/plain",
+        "text/html",
+        "text/html",
+    ]
+    # The attachment is html too, but not a body.
+    assert [p.get_body() for p in mime.iter_text_parts(message)] == [
+        b"Plain.",
+        b"<p>Html.</p>",
+    ]
+
+
+def test_best_body_part_follows_the_preference():
+    raw = _multipart(
+        "b1",
+        [
+            (["Content-Type: text/plain"], "Plain."),
+            (["Content-Type: text/html"], "<p>Html.</p>"),
+        ],
+    )
+    message = mime.parse_message(raw)
+    assert mime.best_body_part(message, ("html", "plain")).get_body() == (
+        b"<p>Html.</p>"
+    )
+    assert mime.best_body_part(message, ("plain", "html")).get_body() == (
+        b"Plain."
+    )
+
+
+def test_best_body_part_of_a_message_without_text():
+    raw = _multipart("b1", [(["Content-Type: image/png"], "png")])
+    assert mime.best_body_part(mime.parse_message(raw)) is None
+
+
+def test_base64_body_is_decoded():
+    text = "Café ☕"
+    raw = (
+        "Content-Type: text/plain; charset=utf-8\r\n"
+        "Content-Transfer-Encoding: base64\r\n"
+        "\r\n" + base64.encodebytes(text.encode()).decode()
+    ).encode()
+    assert mime.parse_message(raw).get_text() == text
+
+
+def test_quoted_printable_body_is_decoded_with_its_charset():
+    raw = (
+        b"Content-Type: text/plain; charset=iso-8859-1\r\n"
+        b"Content-Transfer-Encoding: quoted-printable\r\n"
+        b"\r\n"
+        b"Caf=E9, a soft=\r\n break."
+    )
+    assert mime.parse_message(raw).get_text() == "Café, a soft break."
+
+
+def test_invalid_base64_body_is_left_encoded():
+    raw = (
+        b"Content-Type: text/plain\r\n"
+        b"Content-Transfer-Encoding: base64\r\n"
+        b"\r\n"
+        b"abc"
+    )
+    assert mime.parse_message(raw).get_body() == b"abc"
+
+
+def test_unknown_charset_is_decoded_as_utf8():
+    raw = (
+        "Content-Type: text/plain; charset=x-unknown\r\n\r\nCafé"
+    ).encode()
+    assert mime.parse_message(raw).get_text() == "Café"
+
+
+def test_message_without_a_body():
+    message = mime.parse_message(b"Subject: Headers only\r\n")
+    assert message["Subject"] == "Headers only"
+    assert message.get_body() == b""
+    assert message.body_size == 0
@@ -0,0 +1,109 @@
+import pytest
+
+from store_gmail import GmailStore, _match_expression
+
+
+def _message(id: str, subject: str, sender: str, date: int, snippet=""):
+    """ Returns a METADATA message object, as the Gmail API does.
+    """
+    return {
+        "id": id,
+        "snippet": snippet,
+        "internalDate": str(date),
+        "payload": {
+            "headers": [
+                {"name": "From", "value": sender},
+                {"name": "Subject", "value": subject},
+            ]
+        },
+    }
+
+
+@pytest.fixture
+def store():
+    store = GmailStore(":memory:")
+    if not store.searchable:
+        pytest.skip("SQLite has no FTS5.")
+    yield store
+    store.close()
+
+
+def test_words_are_quoted_prefixes():
+    assert _match_expression("inv 2024") == '"inv"* AND "2024"*'
+
+
+def test_column_prefixes_restrict_a_word():
+    assert _match_expression("from:alice Subject:report") == (
+        'sender : "alice"* AND subject : "report"*'
+    )
+
+
+def test_unknown_prefix_is_searched_as_words():
+    assert _match_expression("cc:bob") == '"cc bob"*'
+
+
+def test_fts_syntax_is_quoted():
+    assert _match_expression('a"b OR NEAR(c)') == (
+        '"a b"* AND "OR"* AND "NEAR c"*'
+    )
+
+
+def test_punctuation_only_query_matches_nothing(store):
+    assert _match_expression("-- : !") == ""
+    assert store.search("-- : !") == []
+
+
+def test_search_matches_prefixes_in_headers_and_snippet(store):
+    store.put_many(
+        [
+            _message("1", "Invoice 42", "Alice <alice@example.com>", 1),
+            _message("2", "Lunch", "Bob <bob@example.com>", 2, "invoices"),
+            _message("3", "Holiday", "Carol <carol@example.com>", 3),
+        ],
+        "metadata",
+    )
+    assert sorted(store.search("invo")) == ["1", "2"]
+    assert store.search("from:ali") == ["1"]
+    assert store.search("from:bob invoice") == ["2"]
+    assert store.search("subject:alice") == []
+
+
+def test_search_ranks_subject_matches_first(store):
+    store.put_many(
+        [
+            _message("1", "Lunch", "Bob <bob@example.com>", 2, "report"),
+            _message("2", "Report", "Alice <alice@example.com>", 1),
+        ],
+        "metadata",
+    )
+    assert store.search("report") == ["2", "1"]
+    assert store.search("report", limit=1) == ["2"]
+
+
+def test_indexed_bodies_are_searched(store):
+    store.put_many([_message("1", "Hello", "a@example.com", 1)], "metadata")
+    store.index_body("1", "The quarterly numbers.")
+    assert store.search("quarter") == ["1"]
+    # Indexing a body keeps the headers indexed.
+    assert store.search("subject:hello") == ["1"]
+
+
+def test_deleted_messages_leave_the_index(store):
+    store.put_many([_message("1", "Hello", "a@example.com", 1)], "metadata")
+    store.delete(["1"])
+    assert store.search("hello") == []
+    assert store.get("1", "metadata") is None
+
+
+def test_payloads_fetched_longest_ago_are_evicted():
+    store = GmailStore(":memory:", max_bytes=1000)
+    for i in range(20):
+        store.put_many(
+            [_message(str(i), f"Subject {i}", "a@example.com", i)], "metadata"
+        )
+    assert store.get("0", "metadata") is None
+    assert store.get("19", "metadata") is not None
+    if store.searchable:
+        assert store.search("subject 0") == []
+        assert store.search("subject 19") == ["19"]
+    store.close()
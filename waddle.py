@@ -1,22 +1,129 @@
 import argparse
+import atexit
 import logging
+import os
+import sys
+import time
 
-from controller_gmail import GmailController
-from controller_facebook import FacebookController
+import constants
+from client import run_command
 from controller_main import MainController
+from profiling import tracer
+from registry import load_services
 
 _logger = logging.getLogger(__name__)
 
 
+def write_trace(directory: str):
+    """ Writes the session's trace to a directory, on exit.
+    """
+    path = os.path.join(directory, "trace.json")
+    spans = tracer.export_chrome_trace(path)
+    print(
+        f"Wrote {spans} spans to {path}. Open it in chrome://tracing or "
+        f"https://ui.perfetto.dev.",
+        file=sys.stderr,
+    )
+
+
 if __name__ == "__main__":
-    _logger.setLevel(logging.DEBUG)
     DEFAULT_CREDENTIAL_PATH = "credentials-je.dat"
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "--verbose", "-v", default=0, action="count", help="verbosity"
+        "--verbose",
+        "-v",
+        default=0,
+        action="count",
+        help="log where each command's time went. Repeat for debug logs",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile each command with cProfile and write a Chrome trace "
+        "of the session, in a new directory under "
+        f"{constants.PROFILE_DIR}. With --daemon, profiles its commands",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep signed in sessions alive for one-shot commands, signing "
+        "in to the services named as the command first",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="run a script of commands (- for stdin), writing newline "
+        "delimited JSON",
+    )
+    parser.add_argument(
+        "--credentials",
+        metavar="SERVICE=PATH",
+        action="append",
+        default=[],
+        help="sign in to a service with a credentials file instead of "
+        "prompting, e.g. gmail=credentials.dat",
+    )
+    parser.add_argument(
+        "command",
+        nargs="*",
+        help="a one-shot command run on the daemon, e.g. `gmail recent 20`",
     )
     arguments = parser.parse_args()
+    if any("=" not in c for c in arguments.credentials):
+        parser.error("--credentials must be given as SERVICE=PATH.")
+    credentials = dict(c.split("=", 1) for c in arguments.credentials)
+
+    if arguments.verbose:
+        logging.basicConfig(
+            level=logging.INFO if arguments.verbose == 1 else logging.DEBUG,
+            format="%(levelname)s %(name)s: %(message)s",
+        )
+    if arguments.profile:
+        profile_dir = os.path.join(
+            constants.PROFILE_DIR, time.strftime("%Y%m%d-%H%M%S")
+        )
+        tracer.configure(True, profile_dir)
+        atexit.register(write_trace, profile_dir)
+    elif arguments.verbose:
+        tracer.configure(True)
+
+    if arguments.batch:
+        import asyncio
+
+        from batch import BatchRunner
+
+        main_controller = MainController(load_services())
+        main_controller.authenticate_from_files(credentials)
+        script = (
+            sys.stdin if arguments.batch == "-" else open(arguments.batch)
+        )
+        with script:
+            ok = asyncio.run(BatchRunner(main_controller).run(script))
+        main_controller.close_controllers()
+        sys.exit(0 if ok else 1)
+
+    if arguments.daemon:
+        import asyncio
+
+        from daemon import WaddleDaemon
+
+        main_controller = MainController(load_services())
+        main_controller.authenticate_from_files(credentials)
+        daemon = WaddleDaemon(main_controller)
+        daemon.sign_in(arguments.command)
+        sys.exit(0 if asyncio.run(daemon.serve()) else 1)
+
+    if arguments.command:
+        ok = run_command(arguments.command)
+        if ok is None:
+            print(
+                "No daemon is running. Start one with e.g. "
+                "`python waddle.py --daemon gmail`."
+            )
+            sys.exit(2)
+        sys.exit(0 if ok else 1)
 
-    service_controller = [GmailController(), FacebookController()]
+    # Each service's controller is only imported once the user selects it.
+    service_controller = load_services()
     main_controller = MainController(service_controller)
     main_controller.run()